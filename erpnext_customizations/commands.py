@@ -0,0 +1,39 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+import json
+
+import click
+import frappe
+from frappe.commands import get_site, pass_context
+
+
+@click.command("ingest-batch-consumption")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "file_format", type=click.Choice(["jsonl", "csv"]),
+    help="Event file format; inferred from the file extension when omitted")
+@click.option("--chunk-size", default=5000, show_default=True, help="Events validated and written per transaction")
+@pass_context
+def ingest_batch_consumption(context, path, file_format=None, chunk_size=5000):
+    """Bulk-ingest batch consumption events from a JSONL or CSV file"""
+    from erpnext_customizations.inventory_management.consumption_ingestion import (
+        ingest_consumption_events, read_events
+    )
+
+    file_format = file_format or ("csv" if path.lower().endswith(".csv") else "jsonl")
+    site = get_site(context)
+
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        with open(path, newline="", encoding="utf-8") as stream:
+            report = ingest_consumption_events(read_events(stream, file_format), chunk_size=chunk_size)
+    finally:
+        frappe.destroy()
+
+    click.echo(json.dumps(report, indent=1, default=str))
+
+
+commands = [
+    ingest_batch_consumption
+]
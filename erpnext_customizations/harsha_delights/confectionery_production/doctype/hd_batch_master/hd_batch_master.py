@@ -6,6 +6,14 @@ from frappe.model.document import Document
 from frappe.utils import cint, flt, getdate, add_days, nowdate
 from datetime import datetime, timedelta
 
+from erpnext_customizations.inventory_management.alert_notifications import queue_notifications
+from erpnext_customizations.inventory_management.batch_alerts import enqueue_batch_alerts
+from erpnext_customizations.inventory_management.batch_consumption import consume_batch
+from erpnext_customizations.inventory_management.batch_ledger import post_ledger_entries
+
+# Days to expiry at which a save raises an expiry alert
+EXPIRY_ALERT_DAYS = 7
+
 class HDBatchMaster(Document):
     def autoname(self):
         """Generate batch ID automatically"""
@@ -115,6 +123,7 @@ class HDBatchMaster(Document):
     def on_update(self):
         """Execute after document update"""
         self.update_stock_entries()
+        self.post_quantity_change()
         self.create_alerts()
         
     def update_stock_entries(self):
@@ -122,20 +131,62 @@ class HDBatchMaster(Document):
         # This would typically update Stock Ledger Entry with batch details
         pass
         
+    def post_quantity_change(self):
+        """Record receipts and manual quantity edits in the batch ledger"""
+        before = self.get_doc_before_save()
+        qty_change = flt(self.available_qty) - flt(before.available_qty if before else 0)
+        
+        if qty_change:
+            post_ledger_entries([{
+                "batch_id": self.name,
+                "item": self.item,
+                "warehouse": self.warehouse,
+                "entry_type": "Adjustment" if before else "Receipt",
+                "qty_change": qty_change,
+                "balance_qty": self.available_qty,
+                "voucher_type": self.doctype,
+                "voucher_no": self.name
+            }])
+            
     def create_alerts(self):
-        """Create alerts for expiring batches or quality issues"""
-        # Create expiry alerts
-        days_to_expiry = (getdate(self.expiry_date) - getdate(nowdate())).days
+        """Queue alerts for changes made by this save: entering the expiry window or a failing quality grade"""
+        before = self.get_doc_before_save()
+        alert_types = []
         
-        if days_to_expiry <= 7 and self.status == "Active":
+        # Expiry alert only when this save moves the batch into the expiry window
+        if self.alert_applies("Expiry Warning") and not (before and self.expiry_alert_due(before)):
+            alert_types.append("Expiry Warning")
+            
+        # Quality alert only when the grade changes to a failing one
+        if self.alert_applies("Quality Alert") and (not before or before.quality_grade != self.quality_grade):
+            alert_types.append("Quality Alert")
+            
+        if alert_types:
+            enqueue_batch_alerts(self.name, alert_types)
+            
+    @staticmethod
+    def expiry_alert_due(doc):
+        """Whether a batch version is Active and within 7 days of expiry"""
+        return doc.status == "Active" and doc.expiry_date and \
+            (getdate(doc.expiry_date) - getdate(nowdate())).days <= EXPIRY_ALERT_DAYS
+            
+    def alert_applies(self, alert_type):
+        """Whether the batch currently warrants the alert type"""
+        if alert_type == "Expiry Warning":
+            return bool(self.expiry_alert_due(self))
+        if alert_type == "Quality Alert":
+            return self.quality_grade in ["C", "Reject"]
+        return False
+        
+    def send_alert(self, alert_type):
+        """Queue the notification for an alert type"""
+        if alert_type == "Expiry Warning":
             self.create_notification(
-                subject=f"Batch {self.batch_id} expiring in {days_to_expiry} days",
+                subject=f"Batch {self.batch_id} expiring in {self.get_days_to_expiry()} days",
                 message=f"Batch {self.batch_id} for item {self.item_name} is expiring on {self.expiry_date}",
                 alert_type="Expiry Warning"
             )
-            
-        # Create quality alerts
-        if self.quality_grade in ["C", "Reject"]:
+        elif alert_type == "Quality Alert":
             self.create_notification(
                 subject=f"Quality issue with batch {self.batch_id}",
                 message=f"Batch {self.batch_id} has quality grade {self.quality_grade}",
@@ -143,39 +194,26 @@ class HDBatchMaster(Document):
             )
             
     def create_notification(self, subject, message, alert_type):
-        """Create system notification"""
-        try:
-            # Create notification for relevant users
-            users_to_notify = []
-            
-            if alert_type == "Expiry Warning":
-                users_to_notify = frappe.get_all("Has Role", 
-                    filters={"role": ["in", ["Quality Manager", "Stock Manager"]]},
-                    pluck="parent"
-                )
-            elif alert_type == "Quality Alert":
-                users_to_notify = frappe.get_all("Has Role", 
-                    filters={"role": "Quality Manager"},
-                    pluck="parent"
-                )
-                
-            for user in users_to_notify:
-                frappe.share.add("HD Batch Master", self.name, user, notify=1)
-                
-                # Create ToDo for urgent actions
-                if days_to_expiry <= 3 or self.quality_grade == "Reject":
-                    frappe.get_doc({
-                        "doctype": "ToDo",
-                        "description": message,
-                        "priority": "High" if days_to_expiry <= 1 else "Medium",
-                        "status": "Open",
-                        "allocated_to": user,
-                        "reference_type": "HD Batch Master",
-                        "reference_name": self.name
-                    }).insert(ignore_permissions=True)
-                    
-        except Exception as e:
-            frappe.log_error(f"Error creating notification: {str(e)}", "Batch Master Notification Error")
+        """Queue a notification for relevant users with the next alert digest"""
+        roles = {
+            "Expiry Warning": ["Quality Manager", "Stock Manager"],
+            "Quality Alert": ["Quality Manager"]
+        }.get(alert_type, [])
+        
+        # Create ToDo for urgent actions
+        days_to_expiry = self.get_days_to_expiry()
+        todo_priority = None
+        if days_to_expiry <= 3 or self.quality_grade == "Reject":
+            todo_priority = "High" if days_to_expiry <= 1 else "Medium"
+            
+        queue_notifications([{
+            "reference_doctype": "HD Batch Master",
+            "reference_name": self.name,
+            "subject": subject,
+            "message": message,
+            "roles": roles,
+            "todo_priority": todo_priority
+        }])
 
     @frappe.whitelist()
     def consume_quantity(self, qty_consumed, consumption_type="Sale"):
@@ -185,27 +223,11 @@ class HDBatchMaster(Document):
         if qty_consumed <= 0:
             frappe.throw("Consumption quantity must be greater than zero")
             
-        if qty_consumed > self.available_qty:
-            frappe.throw(f"Cannot consume {qty_consumed}. Only {self.available_qty} available in batch")
-            
-        # Update available quantity
-        self.available_qty = flt(self.available_qty) - qty_consumed
+        # Guarded decrement and log insert; skips validate/on_update of this batch
+        result = consume_batch(self.name, qty_consumed, consumption_type)
         
-        # Update status if fully consumed
-        if self.available_qty <= 0:
-            self.status = "Consumed"
-            
-        self.save()
-        
-        # Log consumption
-        frappe.get_doc({
-            "doctype": "HD Batch Consumption Log",
-            "batch_id": self.name,
-            "consumption_date": nowdate(),
-            "qty_consumed": qty_consumed,
-            "consumption_type": consumption_type,
-            "consumed_by": frappe.session.user
-        }).insert(ignore_permissions=True)
+        self.available_qty = result.remaining_qty
+        self.status = result.status
         
         return {"success": True, "remaining_qty": self.available_qty}
 
@@ -250,4 +272,9 @@ class HDBatchMaster(Document):
             filters={"batch_id": self.name},
             fields=["consumption_date", "qty_consumed", "consumption_type", "consumed_by"],
             order_by="consumption_date desc"
-        )
\ No newline at end of file
+        )
+
+def on_doctype_update():
+    """FEFO allocation scans open batches of an item in a warehouse by expiry; expiry scans range over all of them"""
+    frappe.db.add_index("HD Batch Master", ["item", "warehouse", "status", "expiry_date"])
+    frappe.db.add_index("HD Batch Master", ["status", "expiry_date", "available_qty"])
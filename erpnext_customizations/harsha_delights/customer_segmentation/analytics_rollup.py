@@ -0,0 +1,235 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+"""Precomputed segment analytics.
+
+A daily job rolls Sales Invoice revenue up per segment per month into
+HD Segment Analytics Rollup and stores a growth snapshot per active
+assignment in HD Segment Assignment Snapshot. Dashboards read those rows
+instead of aggregating twelve months of invoices on every load. Rollups
+cover invoices posted before the refresh date; today's partial numbers can
+be topped up with a small indexed query on posting_date.
+"""
+
+import frappe
+from frappe.utils import add_months, cint, flt, get_first_day, getdate, now, nowdate
+
+from erpnext_customizations.customer_segmentation.rule_engine import load_customer_metrics
+
+ROLLUP_DOCTYPE = "HD Segment Analytics Rollup"
+SNAPSHOT_DOCTYPE = "HD Segment Assignment Snapshot"
+ROLLUP_MONTHS = 12
+SNAPSHOT_CHUNK_SIZE = 1000
+
+
+def get_window_start(months=ROLLUP_MONTHS):
+    """First day of the oldest month inside the rollup window"""
+    return get_first_day(add_months(nowdate(), -(months - 1)))
+
+
+def refresh_segment_analytics():
+    """Daily job: rebuild segment rollups and assignment snapshots"""
+    refresh_segment_rollups()
+    refresh_assignment_snapshots()
+
+
+def refresh_segment_rollups(months=ROLLUP_MONTHS):
+    """Recompute monthly rollups for every segment over the trailing window"""
+    window_start = getdate(get_window_start(months))
+    today = nowdate()
+
+    revenue = frappe.db.sql("""
+        SELECT
+            a.customer_segment,
+            DATE_FORMAT(si.posting_date, '%%Y-%%m') AS period_key,
+            SUM(si.grand_total) AS total_revenue,
+            COUNT(DISTINCT si.name) AS total_orders,
+            COUNT(DISTINCT si.customer) AS active_members
+        FROM `tabSales Invoice` si
+        INNER JOIN `tabHD Customer Segment Assignment` a
+            ON a.customer = si.customer AND a.status = 'Active'
+        WHERE si.docstatus = 1
+        AND si.posting_date >= %s
+        AND si.posting_date < %s
+        GROUP BY a.customer_segment, period_key
+    """, (window_start, today), as_dict=True)
+
+    revenue_map = {(row.customer_segment, row.period_key): row for row in revenue}
+
+    member_counts = dict(frappe.db.sql("""
+        SELECT customer_segment, COUNT(*)
+        FROM `tabHD Customer Segment Assignment`
+        WHERE status = 'Active'
+        GROUP BY customer_segment
+    """))
+
+    periods = [getdate(add_months(window_start, i)) for i in range(months)]
+    timestamp = now()
+    user = frappe.session.user
+
+    values = []
+    for segment in frappe.get_all("HD Customer Segment", pluck="name"):
+        for period_start in periods:
+            period_key = period_start.strftime("%Y-%m")
+            row = revenue_map.get((segment, period_key)) or frappe._dict()
+            total_revenue = flt(row.total_revenue)
+            total_orders = cint(row.total_orders)
+            values.append((
+                f"{segment}-{period_key}", timestamp, timestamp, user, user,
+                segment, period_key, period_start, timestamp,
+                total_revenue, total_orders,
+                total_revenue / total_orders if total_orders else 0,
+                cint(row.active_members), cint(member_counts.get(segment)),
+            ))
+
+    _upsert(ROLLUP_DOCTYPE, [
+        "name", "creation", "modified", "owner", "modified_by",
+        "customer_segment", "period_key", "period_start", "refreshed_on",
+        "total_revenue", "total_orders", "avg_order_value",
+        "active_members", "member_count",
+    ], values)
+
+    return len(values)
+
+
+def refresh_assignment_snapshots():
+    """Store revenue and growth inputs for every active assignment"""
+    last_name = ""
+    refreshed = 0
+
+    while True:
+        assignments = frappe.db.sql("""
+            SELECT
+                a.name,
+                a.customer,
+                a.customer_segment,
+                COALESCE(SUM(si.grand_total), 0) AS total_revenue,
+                COALESCE(AVG(si.grand_total), 0) AS avg_order_value,
+                COUNT(si.name) AS order_count
+            FROM (
+                SELECT name, customer, customer_segment, assignment_date
+                FROM `tabHD Customer Segment Assignment`
+                WHERE status = 'Active' AND name > %s
+                ORDER BY name
+                LIMIT %s
+            ) a
+            LEFT JOIN `tabSales Invoice` si
+                ON si.customer = a.customer
+                AND si.docstatus = 1
+                AND si.posting_date >= a.assignment_date
+                AND si.posting_date < CURDATE()
+            GROUP BY a.name, a.customer, a.customer_segment
+            ORDER BY a.name
+        """, (last_name, SNAPSHOT_CHUNK_SIZE), as_dict=True)
+
+        if not assignments:
+            break
+
+        snapshot = load_customer_metrics(list({row.customer for row in assignments}))
+        annual_purchase = snapshot.column("annual_purchase")
+        order_frequency = snapshot.column("order_frequency")
+        timestamp = now()
+        today = nowdate()
+        user = frappe.session.user
+
+        values = []
+        for row in assignments:
+            position = snapshot.index.get(row.customer)
+            values.append((
+                row.name, timestamp, timestamp, user, user,
+                row.name, row.customer, row.customer_segment, today,
+                flt(row.total_revenue), flt(row.avg_order_value), cint(row.order_count),
+                flt(annual_purchase[position]) if position is not None else 0,
+                flt(order_frequency[position]) if position is not None else 0,
+            ))
+
+        _upsert(SNAPSHOT_DOCTYPE, [
+            "name", "creation", "modified", "owner", "modified_by",
+            "assignment", "customer", "customer_segment", "snapshot_date",
+            "total_revenue", "avg_order_value", "order_count",
+            "current_annual_purchase", "current_order_frequency",
+        ], values)
+
+        refreshed += len(values)
+        last_name = assignments[-1].name
+        frappe.db.commit()
+
+    return refreshed
+
+
+def _upsert(doctype, fields, values, chunk_size=1000):
+    """Multi-row INSERT ... ON DUPLICATE KEY UPDATE keyed on name"""
+    columns = ", ".join(f"`{field}`" for field in fields)
+    updates = ", ".join(f"`{field}` = VALUES(`{field}`)" for field in fields
+        if field not in ("name", "creation", "owner"))
+    row_placeholder = "({0})".format(", ".join(["%s"] * len(fields)))
+
+    for i in range(0, len(values), chunk_size):
+        chunk = values[i:i + chunk_size]
+        frappe.db.sql("""
+            INSERT INTO `tab{0}` ({1})
+            VALUES {2}
+            ON DUPLICATE KEY UPDATE {3}
+        """.format(doctype, columns, ", ".join([row_placeholder] * len(chunk)), updates),
+            [value for row in chunk for value in row])
+
+
+def get_segment_rollup(segment, include_today=False, months=ROLLUP_MONTHS):
+    """Segment analytics served from the monthly rollup rows, or None if not built yet"""
+    rows = frappe.get_all(ROLLUP_DOCTYPE,
+        filters={"customer_segment": segment, "period_start": [">=", get_window_start(months)]},
+        fields=["total_revenue", "total_orders", "member_count", "refreshed_on"],
+        order_by="period_start desc"
+    )
+
+    if not rows:
+        return None
+
+    total_revenue = sum(flt(row.total_revenue) for row in rows)
+    total_orders = sum(cint(row.total_orders) for row in rows)
+    refreshed_on = getdate(rows[0].refreshed_on)
+
+    if include_today:
+        partial = frappe.db.sql("""
+            SELECT COALESCE(SUM(si.grand_total), 0), COUNT(DISTINCT si.name)
+            FROM `tabSales Invoice` si
+            INNER JOIN `tabHD Customer Segment Assignment` a
+                ON a.customer = si.customer AND a.customer_segment = %s AND a.status = 'Active'
+            WHERE si.posting_date >= %s
+            AND si.docstatus = 1
+        """, (segment, refreshed_on))
+        total_revenue += flt(partial[0][0])
+        total_orders += cint(partial[0][1])
+
+    return {
+        "customer_count": cint(rows[0].member_count),
+        "total_revenue": total_revenue,
+        "total_orders": total_orders,
+        "avg_order_value": total_revenue / total_orders if total_orders else 0,
+        "refreshed_on": rows[0].refreshed_on,
+    }
+
+
+def get_assignment_snapshot(assignment, include_today=False):
+    """Assignment analytics inputs served from its snapshot row, or None if not built yet"""
+    snapshot = frappe.db.get_value(SNAPSHOT_DOCTYPE, assignment, [
+        "customer", "snapshot_date", "total_revenue", "avg_order_value", "order_count",
+        "current_annual_purchase", "current_order_frequency",
+    ], as_dict=True)
+
+    if not snapshot:
+        return None
+
+    if include_today:
+        partial = frappe.db.sql("""
+            SELECT COALESCE(SUM(grand_total), 0), COUNT(*)
+            FROM `tabSales Invoice`
+            WHERE customer = %s
+            AND posting_date >= %s
+            AND docstatus = 1
+        """, (snapshot.customer, snapshot.snapshot_date))
+        snapshot.total_revenue = flt(snapshot.total_revenue) + flt(partial[0][0])
+        snapshot.order_count = cint(snapshot.order_count) + cint(partial[0][1])
+        snapshot.avg_order_value = snapshot.total_revenue / snapshot.order_count if snapshot.order_count else 0
+
+    return snapshot
@@ -0,0 +1,147 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+"""Set-based propagation of segment benefits to primary members.
+
+Credit limits and payment terms are written onto Customer with UPDATE ... JOIN
+statements over chunks of primary assignments, instead of loading and saving
+every Customer document.
+"""
+
+import frappe
+from frappe.utils import cint
+
+BENEFIT_FIELDS = ("credit_limit_multiplier", "payment_terms", "discount_percentage", "special_pricing_enabled")
+PROPAGATION_CHUNK_SIZE = 2000
+
+# Base limit used when no credit limit was captured at assignment time
+DEFAULT_BASE_CREDIT_LIMIT = 100000
+
+
+def apply_segment_benefits(assignments):
+    """Apply the segment benefits of the given primary assignments in bulk"""
+    report = {"members": 0, "credit_limits_updated": 0, "payment_terms_updated": 0, "assignments_updated": 0}
+
+    for i in range(0, len(assignments), PROPAGATION_CHUNK_SIZE):
+        chunk = assignments[i:i + PROPAGATION_CHUNK_SIZE]
+        chunk_report = _apply_chunk(chunk)
+        for key in report:
+            report[key] += chunk_report[key]
+
+    return report
+
+
+def _apply_chunk(assignments):
+    placeholders = ", ".join(["%s"] * len(assignments))
+    join = """
+        FROM `tabHD Customer Segment Assignment` a
+        INNER JOIN `tabHD Customer Segment` s ON s.name = a.customer_segment
+        INNER JOIN `tabCustomer` c ON c.name = a.customer
+        WHERE a.name IN ({0})
+        AND a.status = 'Active'
+        AND a.is_primary = 1
+    """.format(placeholders)
+    new_credit_limit = "COALESCE(NULLIF(a.credit_limit_at_assignment, 0), {0}) * s.credit_limit_multiplier".format(
+        DEFAULT_BASE_CREDIT_LIMIT)
+
+    changes = frappe.db.sql("""
+        SELECT
+            COUNT(*) AS members,
+            SUM(s.credit_limit_multiplier > 0
+                AND NOT (c.credit_limit <=> {0})) AS credit_limits_updated,
+            SUM(COALESCE(s.payment_terms, '') != ''
+                AND NOT (c.payment_terms <=> s.payment_terms)) AS payment_terms_updated,
+            SUM(NOT (a.discount_percentage_applied <=> s.discount_percentage)
+                OR NOT (a.special_pricing_applied <=> s.special_pricing_enabled)) AS assignments_updated
+        {1}
+    """.format(new_credit_limit, join), assignments, as_dict=True)[0]
+
+    if cint(changes.credit_limits_updated):
+        frappe.db.sql("""
+            UPDATE `tabHD Customer Segment Assignment` a
+            INNER JOIN `tabHD Customer Segment` s ON s.name = a.customer_segment
+            INNER JOIN `tabCustomer` c ON c.name = a.customer
+            SET c.credit_limit = {0}
+            WHERE a.name IN ({1})
+            AND a.status = 'Active'
+            AND a.is_primary = 1
+            AND s.credit_limit_multiplier > 0
+        """.format(new_credit_limit, placeholders), assignments)
+
+    if cint(changes.payment_terms_updated):
+        frappe.db.sql("""
+            UPDATE `tabHD Customer Segment Assignment` a
+            INNER JOIN `tabHD Customer Segment` s ON s.name = a.customer_segment
+            INNER JOIN `tabCustomer` c ON c.name = a.customer
+            SET c.payment_terms = s.payment_terms
+            WHERE a.name IN ({0})
+            AND a.status = 'Active'
+            AND a.is_primary = 1
+            AND COALESCE(s.payment_terms, '') != ''
+        """.format(placeholders), assignments)
+
+    if cint(changes.assignments_updated):
+        frappe.db.sql("""
+            UPDATE `tabHD Customer Segment Assignment` a
+            INNER JOIN `tabHD Customer Segment` s ON s.name = a.customer_segment
+            SET a.discount_percentage_applied = s.discount_percentage,
+                a.special_pricing_applied = s.special_pricing_enabled
+            WHERE a.name IN ({0})
+            AND a.status = 'Active'
+            AND a.is_primary = 1
+        """.format(placeholders), assignments)
+
+    return {key: cint(value) for key, value in changes.items()}
+
+
+def propagate_segment_benefits(segment):
+    """Recompute benefits for every primary member of a segment, chunk by chunk"""
+    report = {"members": 0, "credit_limits_updated": 0, "payment_terms_updated": 0, "assignments_updated": 0}
+    last_name = ""
+
+    while True:
+        assignments = frappe.db.sql_list("""
+            SELECT name
+            FROM `tabHD Customer Segment Assignment`
+            WHERE customer_segment = %s
+            AND status = 'Active'
+            AND is_primary = 1
+            AND name > %s
+            ORDER BY name
+            LIMIT %s
+        """, (segment, last_name, PROPAGATION_CHUNK_SIZE))
+
+        if not assignments:
+            break
+
+        chunk_report = apply_segment_benefits(assignments)
+        for key in report:
+            report[key] += chunk_report[key]
+
+        last_name = assignments[-1]
+        frappe.db.commit()
+
+    segment_doc = frappe.get_doc("HD Customer Segment", segment)
+    segment_doc.add_comment("Info",
+        f"Segment benefits propagated to {report['members']} primary members: "
+        f"{report['credit_limits_updated']} credit limits, {report['payment_terms_updated']} payment terms "
+        f"and {report['assignments_updated']} assignment discounts updated")
+
+    return report
+
+
+def enqueue_benefit_propagation(segment_doc):
+    """Queue propagation when any benefit field of a saved segment changed"""
+    if not segment_doc.get_doc_before_save():
+        return
+
+    if not any(segment_doc.has_value_changed(field) for field in BENEFIT_FIELDS):
+        return
+
+    frappe.enqueue(
+        "erpnext_customizations.customer_segmentation.benefit_propagation.propagate_segment_benefits",
+        queue="long",
+        job_name=f"propagate_segment_benefits::{segment_doc.name}",
+        enqueue_after_commit=True,
+        segment=segment_doc.name
+    )
@@ -0,0 +1,235 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+"""Set-based writers for HD Customer Segment Assignment.
+
+Bulk segmentation runs insert assignments with multi-row inserts and then
+resolve every affected customer's primary segment in one pass, instead of
+deciding primacy one customer at a time.
+"""
+
+import frappe
+from frappe.utils import add_days, cint, flt, getdate, now, nowdate
+
+from erpnext_customizations.customer_segmentation.benefit_propagation import apply_segment_benefits
+from erpnext_customizations.customer_segmentation.membership_history import open_intervals
+from erpnext_customizations.customer_segmentation.rule_engine import (
+    evaluate_all_segments, load_customer_metrics
+)
+
+ASSIGNMENT_DOCTYPE = "HD Customer Segment Assignment"
+BULK_CHUNK_SIZE = 1000
+
+
+def chunked(values, size=BULK_CHUNK_SIZE):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def resolve_primary_segments(customers=None):
+    """Pick each customer's primary segment by priority across active assignments.
+
+    The winner per customer is ranked with a window function (highest segment
+    priority, then the current primary, then the most recent assignment) and
+    all changed `is_primary` flags are written with one UPDATE per chunk, so
+    every customer with an active assignment ends up with exactly one primary.
+    """
+    if customers is None:
+        changes = _get_primary_changes()
+    else:
+        changes = []
+        for chunk in chunked(list(set(customers))):
+            changes.extend(_get_primary_changes(chunk))
+
+    promoted = [row.name for row in changes if cint(row.should_be_primary)]
+    demoted = [row.name for row in changes if not cint(row.should_be_primary)]
+    promoted_set = set(promoted)
+
+    for chunk in chunked(promoted + demoted):
+        chunk_promoted = [name for name in chunk if name in promoted_set] or [""]
+        frappe.db.sql("""
+            UPDATE `tabHD Customer Segment Assignment`
+            SET is_primary = name IN ({0}), modified = %s
+            WHERE name IN ({1})
+        """.format(", ".join(["%s"] * len(chunk_promoted)), ", ".join(["%s"] * len(chunk))),
+            chunk_promoted + [now()] + chunk)
+
+    sync_customer_primary_segments(customers)
+    benefits = apply_segment_benefits(promoted)
+
+    return {
+        "promoted": len(promoted),
+        "demoted": len(demoted),
+        "promoted_assignments": promoted,
+        "benefits": benefits
+    }
+
+
+def sync_customer_primary_segments(customers=None):
+    """Mirror each customer's active primary segment onto `Customer.hd_primary_segment`.
+
+    This indexed column is the membership lookup the segment-level Pricing
+    Rules rely on: transactions fetch it from the customer and the rule
+    condition matches on it, so no per-customer Pricing Rule is needed.
+    """
+    if customers is None:
+        chunks = [None]
+    else:
+        chunks = list(chunked(list(set(customers))))
+
+    for chunk in chunks:
+        conditions = ""
+        params = []
+        if chunk is not None:
+            conditions = " AND c.name IN ({0})".format(", ".join(["%s"] * len(chunk)))
+            params.extend(chunk)
+
+        frappe.db.sql("""
+            UPDATE `tabCustomer` c
+            LEFT JOIN `tabHD Customer Segment Assignment` a
+                ON a.customer = c.name AND a.status = 'Active' AND a.is_primary = 1
+            SET c.hd_primary_segment = a.customer_segment
+            WHERE NOT (c.hd_primary_segment <=> a.customer_segment){0}
+        """.format(conditions), params)
+
+
+def _get_primary_changes(customers=None):
+    """Return active assignments whose `is_primary` flag disagrees with the ranking"""
+    conditions = ""
+    params = []
+
+    if customers is not None:
+        conditions = " AND a.customer IN ({0})".format(", ".join(["%s"] * len(customers)))
+        params.extend(customers)
+
+    return frappe.db.sql("""
+        SELECT name, should_be_primary
+        FROM (
+            SELECT
+                a.name,
+                a.is_primary,
+                ROW_NUMBER() OVER (
+                    PARTITION BY a.customer
+                    ORDER BY COALESCE(s.priority, 0) DESC, a.is_primary DESC,
+                        a.assignment_date DESC, a.name DESC
+                ) = 1 AS should_be_primary
+            FROM `tabHD Customer Segment Assignment` a
+            LEFT JOIN `tabHD Customer Segment` s ON s.name = a.customer_segment
+            WHERE a.status = 'Active'{0}
+        ) ranked
+        WHERE ranked.is_primary != ranked.should_be_primary
+    """.format(conditions), params, as_dict=True)
+
+
+def bulk_assign_customers(segment, customers, assignment_type="Auto", resolve_primary=True,
+        opened_by="Assigned"):
+    """Insert active assignments for many customers with multi-row inserts"""
+    segment_doc = frappe.get_cached_doc("HD Customer Segment", segment)
+    customers = list(dict.fromkeys(customers or []))
+
+    if not customers:
+        return {"assignments_created": 0, "customers": []}
+
+    already_assigned = set()
+    for chunk in chunked(customers):
+        already_assigned.update(frappe.get_all(ASSIGNMENT_DOCTYPE,
+            filters={"customer_segment": segment, "status": "Active", "customer": ["in", chunk]},
+            pluck="customer"
+        ))
+
+    new_customers = [customer for customer in customers if customer not in already_assigned]
+    if not new_customers:
+        return {"assignments_created": 0, "customers": []}
+
+    snapshot = load_customer_metrics(new_customers)
+    customer_details = {}
+    for chunk in chunked(new_customers):
+        for row in frappe.get_all("Customer",
+            filters={"name": ["in", chunk]},
+            fields=["name", "customer_name", "credit_limit"]
+        ):
+            customer_details[row.name] = row
+
+    today = nowdate()
+    review_date = add_days(today, segment_doc.review_frequency_days or 90)
+    timestamp = now()
+    user = frappe.session.user
+    names = _reserve_assignment_names(len(new_customers))
+
+    fields = [
+        "name", "creation", "modified", "owner", "modified_by", "docstatus",
+        "customer", "customer_name", "customer_segment", "segment_name",
+        "assignment_date", "assignment_type", "is_primary", "status",
+        "effective_from", "review_date", "assigned_by",
+        "annual_purchase_at_assignment", "order_frequency_at_assignment", "credit_limit_at_assignment",
+    ]
+    annual_purchase = snapshot.column("annual_purchase")
+    order_frequency = snapshot.column("order_frequency")
+
+    values = []
+    for name, customer in zip(names, new_customers):
+        details = customer_details.get(customer) or frappe._dict()
+        position = snapshot.index.get(customer)
+        values.append((
+            name, timestamp, timestamp, user, user, 0,
+            customer, details.customer_name, segment, segment_doc.segment_name,
+            today, assignment_type, 0, "Active",
+            today, review_date, user,
+            flt(annual_purchase[position]) if position is not None else 0,
+            flt(order_frequency[position]) if position is not None else 0,
+            flt(details.credit_limit),
+        ))
+
+    for chunk in chunked(values):
+        frappe.db.bulk_insert(ASSIGNMENT_DOCTYPE, fields, chunk)
+
+    open_intervals([(name, customer, segment) for name, customer in zip(names, new_customers)],
+        valid_from=today, opened_by=opened_by)
+
+    result = {"assignments_created": len(new_customers), "customers": new_customers}
+
+    if resolve_primary:
+        result["primary"] = resolve_primary_segments(new_customers)
+
+    return result
+
+
+def _reserve_assignment_names(count):
+    """Reserve `count` consecutive names from the assignment naming series in one step"""
+    today = getdate(nowdate())
+    prefix = f"CSA-{today.year}-{today.month:02d}-"
+
+    current = frappe.db.sql("SELECT `current` FROM `tabSeries` WHERE name = %s FOR UPDATE", prefix)
+    if current:
+        start = cint(current[0][0])
+        frappe.db.sql("UPDATE `tabSeries` SET `current` = %s WHERE name = %s", (start + count, prefix))
+    else:
+        start = 0
+        frappe.db.sql("INSERT INTO `tabSeries` (name, `current`) VALUES (%s, %s)", (prefix, count))
+
+    return [f"{prefix}{str(start + i).zfill(3)}" for i in range(1, count + 1)]
+
+
+@frappe.whitelist()
+def run_auto_assignment():
+    """Assign customers to every auto-assignment segment in a single evaluation pass"""
+    frappe.only_for(["Sales Manager", "Customer Service Manager"])
+
+    eligible = evaluate_all_segments()
+    assignments_created = 0
+    touched_customers = set()
+
+    for segment, customers in eligible.items():
+        result = bulk_assign_customers(segment, customers, resolve_primary=False)
+        assignments_created += result["assignments_created"]
+        touched_customers.update(result["customers"])
+
+    primary = resolve_primary_segments(list(touched_customers))
+
+    return {
+        "success": True,
+        "segments_evaluated": len(eligible),
+        "assignments_created": assignments_created,
+        "primary_changes": primary["promoted"] + primary["demoted"],
+        "message": f"Auto assignment completed. {assignments_created} assignments created across {len(eligible)} segments"
+    }
@@ -0,0 +1,16 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+class HDCustomerItemGroupSpend(Document):
+    """Monthly spend of a customer on an item group, maintained by the affinity job"""
+    pass
+
+
+def on_doctype_update():
+    """One row per customer, item group and month; window scans filter on period_start"""
+    frappe.db.add_unique("HD Customer Item Group Spend", ["customer", "item_group", "period_key"],
+        constraint_name="unique_customer_item_group_period")
+    frappe.db.add_index("HD Customer Item Group Spend", ["period_start", "customer"])
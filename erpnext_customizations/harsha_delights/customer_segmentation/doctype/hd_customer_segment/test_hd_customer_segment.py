@@ -0,0 +1,45 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+import json
+
+import frappe
+import numpy as np
+from frappe.tests.utils import FrappeTestCase
+
+from erpnext_customizations.customer_segmentation.rule_engine import CustomerMetricsSnapshot
+from erpnext_customizations.customer_segmentation.segment_ladder import compile_qualification
+
+RULES = json.dumps({"logic": "AND", "conditions": [
+    {"field": "annual_purchase", "operator": ">=", "value": 500000}
+]})
+
+class TestHDCustomerSegment(FrappeTestCase):
+    def make_snapshot(self):
+        return CustomerMetricsSnapshot(np.array(["_Test Big", "_Test Small"], dtype=object), {
+            "annual_purchase": np.array([800000.0, 1000.0]),
+            "order_frequency": np.array([12.0, 12.0]),
+            "territory": np.array(["Mumbai", "Mumbai"], dtype=object),
+        })
+
+    def make_segment(self, **values):
+        segment = frappe._dict(auto_assignment_rules=RULES, min_annual_purchase=0, min_order_frequency=0,
+            geographic_restriction=None)
+        segment.update(values)
+        return segment
+
+    def test_qualification_applies_rules_of_auto_assignment_segments(self):
+        """Members of an auto-assignment segment must still meet its rules"""
+        predicate = compile_qualification(self.make_segment(auto_assignment_enabled=1))
+        self.assertEqual(predicate(self.make_snapshot()).tolist(), [True, False])
+
+    def test_qualification_ignores_rules_of_manual_segments(self):
+        """Rules of a segment with auto assignment disabled do not demote its members"""
+        predicate = compile_qualification(self.make_segment(auto_assignment_enabled=0))
+        self.assertEqual(predicate(self.make_snapshot()).tolist(), [True, True])
+
+    def test_qualification_keeps_geographic_restriction_of_manual_segments(self):
+        """Built-in conditions apply whether or not the segment assigns by rules"""
+        predicate = compile_qualification(self.make_segment(auto_assignment_enabled=0,
+            geographic_restriction="Pune"))
+        self.assertEqual(predicate(self.make_snapshot()).tolist(), [False, False])
@@ -3,14 +3,18 @@
 
 import frappe
 from frappe.model.document import Document
-from frappe.utils import flt, getdate, nowdate, add_days
+from frappe.utils import cint, flt, getdate, nowdate, add_days
+
+from erpnext_customizations.customer_segmentation.analytics_rollup import get_assignment_snapshot
+from erpnext_customizations.customer_segmentation.benefit_propagation import apply_segment_benefits
+from erpnext_customizations.customer_segmentation.bulk_assignment import resolve_primary_segments
+from erpnext_customizations.customer_segmentation.membership_history import close_intervals, open_intervals
 
 class HDCustomerSegmentAssignment(Document):
     def validate(self):
         """Validate customer segment assignment"""
         self.set_names()
         self.validate_dates()
-        self.validate_primary_segment()
         self.set_effective_dates()
         self.capture_assignment_metrics()
         
@@ -32,22 +36,6 @@ class HDCustomerSegmentAssignment(Document):
             if getdate(self.effective_from) < getdate(self.assignment_date):
                 frappe.throw("Effective From date cannot be before Assignment Date")
                 
-    def validate_primary_segment(self):
-        """Validate primary segment assignment"""
-        if self.is_primary and self.status == "Active":
-            # Check if customer already has another primary segment
-            existing_primary = frappe.db.exists("HD Customer Segment Assignment", {
-                "customer": self.customer,
-                "is_primary": 1,
-                "status": "Active",
-                "name": ["!=", self.name]
-            })
-            
-            if existing_primary:
-                # Deactivate the previous primary segment
-                frappe.db.set_value("HD Customer Segment Assignment", 
-                    existing_primary, "is_primary", 0)
-                    
     def set_effective_dates(self):
         """Set default effective dates"""
         if not self.effective_from:
@@ -96,61 +84,37 @@ class HDCustomerSegmentAssignment(Document):
         
     def on_update(self):
         """Execute after document update"""
+        self.record_membership_history()
+        self.resolve_primary_segment()
         self.update_customer_segment_benefits()
-        self.create_pricing_rules()
+        
+    def record_membership_history(self):
+        """Open or close the membership interval when the assignment (de)activates"""
+        previous = self.get_doc_before_save()
+        was_active = previous and previous.status == "Active"
+        
+        if self.status == "Active" and not was_active:
+            opened_by = {"Upgraded": "Escalated", "Downgraded": "Demoted"}.get(self.assignment_type, "Assigned")
+            if previous:
+                opened_by = "Reactivated"
+            open_intervals([(self.name, self.customer, self.customer_segment)],
+                valid_from=self.effective_from or self.assignment_date, opened_by=opened_by)
+        elif was_active and self.status != "Active":
+            close_intervals([self.name], valid_to=self.effective_to or nowdate(),
+                closed_by="Expired" if self.status == "Expired" else "Deactivated")
+            
+    def resolve_primary_segment(self):
+        """Re-rank the customer's active assignments so exactly one is primary"""
+        result = resolve_primary_segments([self.customer])
+        self.is_primary = frappe.db.get_value("HD Customer Segment Assignment", self.name, "is_primary")
+        # Newly promoted assignments already had their benefits applied
+        self.flags.benefits_applied = self.name in result["promoted_assignments"]
         
     def update_customer_segment_benefits(self):
         """Update customer with segment benefits"""
-        if self.status == "Active" and self.is_primary:
-            segment_doc = frappe.get_doc("HD Customer Segment", self.customer_segment)
-            customer_doc = frappe.get_doc("Customer", self.customer)
-            
-            # Update credit limit
-            if segment_doc.credit_limit_multiplier:
-                base_credit_limit = self.credit_limit_at_assignment or 100000  # Default base limit
-                new_credit_limit = base_credit_limit * flt(segment_doc.credit_limit_multiplier)
-                customer_doc.db_set("credit_limit", new_credit_limit)
-                
-            # Update payment terms
-            if segment_doc.payment_terms:
-                customer_doc.db_set("payment_terms", segment_doc.payment_terms)
-                
-            # Update default discount
-            if segment_doc.discount_percentage:
-                self.discount_percentage_applied = segment_doc.discount_percentage
-                
-            # Mark special pricing
-            if segment_doc.special_pricing_enabled:
-                self.special_pricing_applied = 1
-                
-    def create_pricing_rules(self):
-        """Create pricing rules for the customer segment"""
-        if self.status == "Active":
-            segment_doc = frappe.get_doc("HD Customer Segment", self.customer_segment)
+        if self.status == "Active" and self.is_primary and not self.flags.benefits_applied:
+            apply_segment_benefits([self.name])
             
-            # Create pricing rule if segment has discount
-            if segment_doc.discount_percentage:
-                pricing_rule_name = f"Segment_{segment_doc.segment_code}_{self.customer}"
-                
-                # Check if pricing rule already exists
-                existing_rule = frappe.db.exists("Pricing Rule", pricing_rule_name)
-                
-                if not existing_rule:
-                    pricing_rule = frappe.get_doc({
-                        "doctype": "Pricing Rule",
-                        "name": pricing_rule_name,
-                        "title": f"{segment_doc.segment_name} - {self.customer_name}",
-                        "apply_on": "Customer",
-                        "customer": self.customer,
-                        "rate_or_discount": "Discount Percentage",
-                        "discount_percentage": segment_doc.discount_percentage,
-                        "valid_from": self.effective_from,
-                        "valid_upto": self.effective_to,
-                        "priority": segment_doc.priority or 1,
-                        "disable": 0
-                    })
-                    pricing_rule.insert(ignore_permissions=True)
-                    
     @frappe.whitelist()
     def review_assignment(self, review_notes=None):
         """Review the customer segment assignment"""
@@ -189,11 +153,8 @@ class HDCustomerSegmentAssignment(Document):
         if reason:
             self.review_notes = (self.review_notes or "") + f"\n{nowdate()}: Deactivated - {reason}"
             
-        # Disable related pricing rules
-        pricing_rule_name = f"Segment_{self.customer_segment}_{self.customer}"
-        if frappe.db.exists("Pricing Rule", pricing_rule_name):
-            frappe.db.set_value("Pricing Rule", pricing_rule_name, "disable", 1)
-            
+        # Segment pricing follows Customer.hd_primary_segment, which the
+        # primary resolver clears or re-points when this assignment closes
         self.save()
         
         return {
@@ -202,36 +163,32 @@ class HDCustomerSegmentAssignment(Document):
         }
         
     @frappe.whitelist()
-    def get_assignment_analytics(self):
+    def get_assignment_analytics(self, include_today=False):
         """Get analytics for this assignment"""
         analytics = {}
+        snapshot = get_assignment_snapshot(self.name, include_today=cint(include_today))
         
-        # Revenue since assignment
-        revenue_data = frappe.db.sql("""
-            SELECT 
-                COALESCE(SUM(grand_total), 0) as total_revenue,
-                COALESCE(AVG(grand_total), 0) as avg_order_value,
-                COUNT(*) as order_count
-            FROM `tabSales Invoice`
-            WHERE customer = %s
-            AND posting_date >= %s
-            AND docstatus = 1
-        """, [self.customer, self.assignment_date], as_dict=True)
-        
-        if revenue_data:
-            analytics.update(revenue_data[0])
+        if snapshot:
+            analytics.update({
+                "total_revenue": snapshot.total_revenue,
+                "avg_order_value": snapshot.avg_order_value,
+                "order_count": snapshot.order_count
+            })
+            current_annual_purchase = flt(snapshot.current_annual_purchase)
+            current_order_frequency = flt(snapshot.current_order_frequency)
         else:
-            analytics.update({"total_revenue": 0, "avg_order_value": 0, "order_count": 0})
+            # Snapshot not built yet, aggregate live
+            analytics.update(self.get_live_revenue_since_assignment())
+            current_annual_purchase = self.get_customer_annual_purchase()
+            current_order_frequency = self.get_customer_order_frequency()
             
         # Calculate growth metrics
         if self.annual_purchase_at_assignment > 0:
-            current_annual_purchase = self.get_customer_annual_purchase()
             analytics["revenue_growth_percent"] = ((current_annual_purchase - self.annual_purchase_at_assignment) / self.annual_purchase_at_assignment) * 100
         else:
             analytics["revenue_growth_percent"] = 0
             
         # Order frequency comparison
-        current_order_frequency = self.get_customer_order_frequency()
         if self.order_frequency_at_assignment > 0:
             analytics["frequency_growth_percent"] = ((current_order_frequency - self.order_frequency_at_assignment) / self.order_frequency_at_assignment) * 100
         else:
@@ -242,6 +199,24 @@ class HDCustomerSegmentAssignment(Document):
         
         return analytics
         
+    def get_live_revenue_since_assignment(self):
+        """Aggregate revenue since assignment directly from Sales Invoice"""
+        revenue_data = frappe.db.sql("""
+            SELECT 
+                COALESCE(SUM(grand_total), 0) as total_revenue,
+                COALESCE(AVG(grand_total), 0) as avg_order_value,
+                COUNT(*) as order_count
+            FROM `tabSales Invoice`
+            WHERE customer = %s
+            AND posting_date >= %s
+            AND docstatus = 1
+        """, [self.customer, self.assignment_date], as_dict=True)
+        
+        if revenue_data:
+            return revenue_data[0]
+            
+        return {"total_revenue": 0, "avg_order_value": 0, "order_count": 0}
+        
     def on_cancel(self):
         """Execute when assignment is cancelled"""
         self.deactivate_assignment("Assignment cancelled")
\ No newline at end of file
@@ -0,0 +1,14 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+class HDCustomerSimilarity(Document):
+    """Nearest neighbours of a customer within a segment, written by the similarity job"""
+    pass
+
+
+def on_doctype_update():
+    """Segment rewrites delete by segment"""
+    frappe.db.add_index("HD Customer Similarity", ["customer_segment"])
@@ -0,0 +1,15 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+class HDLoyaltyLedgerEntry(Document):
+    """Append-only loyalty points movement for a voucher"""
+    pass
+
+
+def on_doctype_update():
+    """Voucher lookups on cancel and per-customer statements"""
+    frappe.db.add_index("HD Loyalty Ledger Entry", ["voucher_type", "voucher_no"])
+    frappe.db.add_index("HD Loyalty Ledger Entry", ["customer", "posting_date"])
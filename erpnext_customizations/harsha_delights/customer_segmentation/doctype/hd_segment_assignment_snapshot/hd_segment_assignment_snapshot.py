@@ -0,0 +1,9 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+class HDSegmentAssignmentSnapshot(Document):
+    """Daily growth snapshot of a segment assignment, written by the analytics job"""
+    pass
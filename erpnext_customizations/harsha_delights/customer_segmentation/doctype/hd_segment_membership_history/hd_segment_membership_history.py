@@ -0,0 +1,15 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+class HDSegmentMembershipHistory(Document):
+    """Half-open [valid_from, valid_to) interval of a customer's membership in a segment"""
+    pass
+
+
+def on_doctype_update():
+    """Interval indexes for point-in-time and range lookups"""
+    frappe.db.add_index("HD Segment Membership History", ["customer", "valid_from", "valid_to"])
+    frappe.db.add_index("HD Segment Membership History", ["customer_segment", "valid_from", "valid_to"])
@@ -0,0 +1,267 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+"""Customer × item group spend for product-based segments.
+
+Sales Invoice Item spend is kept per customer, item group and month in
+HD Customer Item Group Spend. A daily job rewrites only the customer-months
+touched by invoices submitted or cancelled since its last run, with
+INSERT ... SELECT statements. Segment rules read the trailing window as a
+sparse matrix held in coordinate form, so share-of-spend, breadth and
+recency conditions are evaluated for every customer at once instead of with
+per-customer subqueries.
+
+Item group conditions include descendant groups, so a rule on "Chocolates"
+also counts spend on its sub-groups::
+
+    {"field": "item_group_share", "item_group": "Chocolates", "operator": ">=", "value": 0.6}
+"""
+
+import frappe
+import numpy as np
+from frappe.utils import add_months, get_first_day, getdate, now, nowdate
+
+SPEND_DOCTYPE = "HD Customer Item Group Spend"
+AFFINITY_MONTHS = 12
+WATERMARK_KEY = "hd_item_group_affinity_watermark"
+REFRESH_CHUNK_SIZE = 1000
+
+# Above this many customers the matrix is loaded for the whole window and filtered in memory
+CUSTOMER_FILTER_LIMIT = 1000
+
+# Rule fields that need an "item_group" (a group name or a list of them)
+ITEM_GROUP_FIELDS = (
+    "item_group_spend",
+    "item_group_share",
+    "days_since_item_group_purchase",
+)
+
+AFFINITY_FIELDS = ITEM_GROUP_FIELDS + (
+    "distinct_item_groups",
+)
+
+
+def get_window_start(months=AFFINITY_MONTHS):
+    """First day of the oldest month inside the affinity window"""
+    return get_first_day(add_months(nowdate(), -(months - 1)))
+
+
+def refresh_item_group_affinity(full=False, months=AFFINITY_MONTHS):
+    """Daily job: rewrite spend rows for customer-months changed since the last run"""
+    started = now()
+    window_start = getdate(get_window_start(months))
+    watermark = None if full else frappe.db.get_global(WATERMARK_KEY)
+
+    if watermark:
+        changed = frappe.db.sql("""
+            SELECT DISTINCT DATE_FORMAT(posting_date, '%%Y-%%m-01') AS period_start, customer
+            FROM `tabSales Invoice`
+            WHERE modified >= %s
+            AND docstatus > 0
+            AND posting_date >= %s
+        """, (watermark, window_start))
+
+        customers_by_period = {}
+        for period_start, customer in changed:
+            customers_by_period.setdefault(getdate(period_start), []).append(customer)
+    else:
+        periods = [getdate(add_months(window_start, i)) for i in range(months)]
+        customers_by_period = {period_start: None for period_start in periods}
+
+    rows_written = 0
+    for period_start, customers in sorted(customers_by_period.items()):
+        if customers is None:
+            rows_written += _rewrite_period(period_start, started)
+        else:
+            for i in range(0, len(customers), REFRESH_CHUNK_SIZE):
+                rows_written += _rewrite_period(period_start, started, customers[i:i + REFRESH_CHUNK_SIZE])
+        frappe.db.commit()
+
+    frappe.db.sql("DELETE FROM `tab{0}` WHERE period_start < %s".format(SPEND_DOCTYPE), (window_start,))
+    frappe.db.set_global(WATERMARK_KEY, started)
+    frappe.db.commit()
+
+    return {"periods": len(customers_by_period), "rows_written": rows_written}
+
+
+def _rewrite_period(period_start, timestamp, customers=None):
+    """Replace the spend rows of one month, for all customers or the given ones"""
+    params = {
+        "period_key": period_start.strftime("%Y-%m"),
+        "from_date": period_start,
+        "to_date": getdate(add_months(period_start, 1)),
+        "timestamp": timestamp,
+        "user": frappe.session.user,
+    }
+
+    delete_condition = ""
+    invoice_condition = ""
+    if customers is not None:
+        params["customers"] = tuple(customers)
+        delete_condition = " AND customer IN %(customers)s"
+        invoice_condition = " AND si.customer IN %(customers)s"
+
+    frappe.db.sql("""
+        DELETE FROM `tab{0}`
+        WHERE period_key = %(period_key)s{1}
+    """.format(SPEND_DOCTYPE, delete_condition), params)
+
+    frappe.db.sql("""
+        INSERT INTO `tab{0}` (
+            name, creation, modified, owner, modified_by, docstatus,
+            customer, item_group, period_key, period_start,
+            spend, qty, invoice_count, last_purchase_date, refreshed_on
+        )
+        SELECT
+            MD5(CONCAT_WS('::', si.customer, sii.item_group, %(period_key)s)),
+            %(timestamp)s, %(timestamp)s, %(user)s, %(user)s, 0,
+            si.customer, sii.item_group, %(period_key)s, %(from_date)s,
+            SUM(sii.base_net_amount), SUM(sii.stock_qty), COUNT(DISTINCT si.name),
+            MAX(si.posting_date), %(timestamp)s
+        FROM `tabSales Invoice Item` sii
+        INNER JOIN `tabSales Invoice` si ON si.name = sii.parent
+        WHERE si.docstatus = 1
+        AND si.posting_date >= %(from_date)s
+        AND si.posting_date < %(to_date)s
+        AND COALESCE(sii.item_group, '') != ''{1}
+        GROUP BY si.customer, sii.item_group
+    """.format(SPEND_DOCTYPE, invoice_condition), params)
+
+    return frappe.db.sql("SELECT ROW_COUNT()")[0][0]
+
+
+class ItemGroupAffinityMatrix:
+    """Sparse customer × item group spend matrix in coordinate form"""
+
+    def __init__(self, customers, item_groups, rows, cols, spend, last_purchase):
+        self.customers = customers
+        self.item_groups = item_groups
+        self.group_index = {item_group: i for i, item_group in enumerate(item_groups)}
+        self.rows = rows
+        self.cols = cols
+        self.spend = spend
+        self.last_purchase = last_purchase
+        self._metrics = {}
+        self._expanded_groups = {}
+
+    def __len__(self):
+        return len(self.customers)
+
+    def total_spend(self):
+        return self._cached(("total_spend",), lambda: np.bincount(
+            self.rows, weights=self.spend, minlength=len(self)))
+
+    def entry_mask(self, item_groups):
+        """Boolean mask over stored entries belonging to the item groups or their descendants"""
+        columns = [self.group_index[item_group] for item_group in self._expand(item_groups)
+            if item_group in self.group_index]
+        return np.isin(self.cols, np.array(columns, dtype=np.int64))
+
+    def metric(self, field, item_groups=None):
+        """Per-customer vector of an affinity rule field"""
+        if field == "distinct_item_groups":
+            return self._cached((field,), lambda: np.bincount(
+                self.rows[self.spend > 0], minlength=len(self)).astype(np.float64))
+
+        key = (field,) + tuple(sorted(item_groups))
+        return self._cached(key, lambda: self._group_metric(field, item_groups))
+
+    def to_dense(self, customer_positions=None):
+        """Dense spend rows for the given customer positions (all customers by default)"""
+        if customer_positions is None:
+            customer_positions = np.arange(len(self))
+
+        lookup = np.full(len(self), -1, dtype=np.int64)
+        lookup[customer_positions] = np.arange(len(customer_positions))
+        selected = lookup[self.rows] >= 0
+
+        dense = np.zeros((len(customer_positions), len(self.item_groups)), dtype=np.float64)
+        np.add.at(dense, (lookup[self.rows[selected]], self.cols[selected]), self.spend[selected])
+        return dense
+
+    def _group_metric(self, field, item_groups):
+        mask = self.entry_mask(item_groups)
+        rows = self.rows[mask]
+
+        if field == "days_since_item_group_purchase":
+            last_purchase = np.full(len(self), -np.inf)
+            np.maximum.at(last_purchase, rows, self.last_purchase[mask])
+            return _today_ordinal() - last_purchase
+
+        spend = np.bincount(rows, weights=self.spend[mask], minlength=len(self))
+        if field == "item_group_spend":
+            return spend
+
+        total = self.total_spend()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(total > 0, spend / np.where(total > 0, total, 1), 0.0)
+
+    def _expand(self, item_groups):
+        key = tuple(sorted(item_groups))
+        if key not in self._expanded_groups:
+            self._expanded_groups[key] = get_item_group_descendants(item_groups)
+        return self._expanded_groups[key]
+
+    def _cached(self, key, compute):
+        if key not in self._metrics:
+            self._metrics[key] = compute()
+        return self._metrics[key]
+
+
+def get_item_group_descendants(item_groups):
+    """Item groups together with every group below them in the tree"""
+    if not item_groups:
+        return []
+
+    return frappe.db.sql_list("""
+        SELECT DISTINCT child.name
+        FROM `tabItem Group` parent
+        INNER JOIN `tabItem Group` child ON child.lft >= parent.lft AND child.rgt <= parent.rgt
+        WHERE parent.name IN ({0})
+    """.format(", ".join(["%s"] * len(item_groups))), list(item_groups))
+
+
+def load_affinity_matrix(customers=None, months=AFFINITY_MONTHS):
+    """Load the trailing window of spend rows as a matrix whose rows follow `customers`"""
+    conditions = ""
+    params = [get_window_start(months)]
+
+    if customers is not None and len(customers) <= CUSTOMER_FILTER_LIMIT:
+        if not len(customers):
+            return _build_matrix(np.array([], dtype=object), [])
+        conditions = " AND customer IN ({0})".format(", ".join(["%s"] * len(customers)))
+        params.extend(customers)
+
+    entries = frappe.db.sql("""
+        SELECT customer, item_group, SUM(spend), MAX(last_purchase_date)
+        FROM `tab{0}`
+        WHERE period_start >= %s{1}
+        GROUP BY customer, item_group
+    """.format(SPEND_DOCTYPE, conditions), params)
+
+    if customers is None:
+        customers = np.array(sorted({entry[0] for entry in entries}), dtype=object)
+
+    return _build_matrix(np.asarray(customers, dtype=object), entries)
+
+
+def _build_matrix(customers, entries):
+    index = {customer: i for i, customer in enumerate(customers.tolist())}
+    entries = [entry for entry in entries if entry[0] in index]
+    item_groups = sorted({entry[1] for entry in entries})
+    group_index = {item_group: i for i, item_group in enumerate(item_groups)}
+    count = len(entries)
+
+    rows = np.fromiter((index[entry[0]] for entry in entries), dtype=np.int64, count=count)
+    cols = np.fromiter((group_index[entry[1]] for entry in entries), dtype=np.int64, count=count)
+    spend = np.fromiter((float(entry[2] or 0) for entry in entries), dtype=np.float64, count=count)
+    last_purchase = np.fromiter(
+        (getdate(entry[3]).toordinal() if entry[3] else -np.inf for entry in entries),
+        dtype=np.float64, count=count
+    )
+
+    return ItemGroupAffinityMatrix(customers, item_groups, rows, cols, spend, last_purchase)
+
+
+def _today_ordinal():
+    return getdate(nowdate()).toordinal()
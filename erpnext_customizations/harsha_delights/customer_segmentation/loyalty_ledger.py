@@ -0,0 +1,184 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+"""Loyalty points ledger fed by Sales Invoice submit and cancel.
+
+Every submitted invoice appends an Earned entry to HD Loyalty Ledger Entry,
+scaled by the loyalty points multiplier of the customer's primary segment,
+and cancelling the invoice appends a matching Reversed entry. A submitted
+return appends a Returned entry that takes back the original invoice's
+points in proportion to the amount returned. Ledger rows are never updated
+or deleted. The same transaction adds the movement to the
+customer's HD Loyalty Balance row (named after the customer) with an
+INSERT ... ON DUPLICATE KEY UPDATE, so checkout reads a balance by primary
+key instead of summing the ledger.
+"""
+
+import frappe
+from frappe.utils import flt, now
+
+LEDGER_DOCTYPE = "HD Loyalty Ledger Entry"
+BALANCE_DOCTYPE = "HD Loyalty Balance"
+
+# One base point is earned per this much base net total
+POINTS_CURRENCY_UNIT = 100
+
+
+def on_sales_invoice_submit(doc, method=None):
+    """Sales Invoice on_submit: credit points to the customer, or take them back for a return"""
+    if not doc.customer:
+        return
+
+    if doc.is_return:
+        _post_return_entries(doc)
+        return
+
+    if _has_entry(doc, "Earned"):
+        return
+
+    primary = frappe.db.sql("""
+        SELECT a.name AS assignment, a.customer_segment, s.loyalty_points_multiplier
+        FROM `tabHD Customer Segment Assignment` a
+        INNER JOIN `tabHD Customer Segment` s ON s.name = a.customer_segment
+        WHERE a.customer = %s
+        AND a.status = 'Active'
+        AND a.is_primary = 1
+        LIMIT 1
+    """, (doc.customer,), as_dict=True)
+    primary = primary[0] if primary else frappe._dict()
+
+    multiplier = flt(primary.loyalty_points_multiplier) or 1
+    points = flt(flt(doc.base_net_total) / POINTS_CURRENCY_UNIT * multiplier, 2)
+    if not points:
+        return
+
+    _post_entry(doc, "Earned", primary.customer_segment, primary.assignment,
+        flt(doc.base_net_total), multiplier, points)
+
+
+def on_sales_invoice_cancel(doc, method=None):
+    """Sales Invoice on_cancel: append reversals of the points credited or returned on submit"""
+    if _has_entry(doc, "Reversed"):
+        return
+
+    posted = frappe.get_all(LEDGER_DOCTYPE,
+        filters={"voucher_type": doc.doctype, "voucher_no": doc.name, "entry_type": ["in", ["Earned", "Returned"]]},
+        fields=["customer_segment", "assignment", "base_amount", "multiplier", "points"]
+    )
+
+    for entry in posted:
+        _post_entry(doc, "Reversed", entry.customer_segment, entry.assignment,
+            -flt(entry.base_amount), entry.multiplier, -flt(entry.points))
+
+
+def _post_return_entries(doc):
+    """Take back the points the returned invoice earned, in proportion to the amount returned"""
+    if not doc.return_against or _has_entry(doc, "Returned"):
+        return
+
+    earned = frappe.get_all(LEDGER_DOCTYPE,
+        filters={"voucher_type": doc.doctype, "voucher_no": doc.return_against, "entry_type": "Earned"},
+        fields=["customer_segment", "assignment", "base_amount", "multiplier", "points"]
+    )
+
+    for entry in earned:
+        if not flt(entry.base_amount):
+            continue
+
+        # base_net_total of a return is negative
+        returned_share = flt(doc.base_net_total) / flt(entry.base_amount)
+        _post_entry(doc, "Returned", entry.customer_segment, entry.assignment,
+            flt(doc.base_net_total), entry.multiplier, flt(flt(entry.points) * returned_share, 2))
+
+
+def _has_entry(doc, entry_type):
+    return frappe.db.exists(LEDGER_DOCTYPE,
+        {"voucher_type": doc.doctype, "voucher_no": doc.name, "entry_type": entry_type})
+
+
+def _post_entry(doc, entry_type, segment, assignment, base_amount, multiplier, points):
+    timestamp = now()
+    user = frappe.session.user
+
+    frappe.db.bulk_insert(LEDGER_DOCTYPE, [
+        "name", "creation", "modified", "owner", "modified_by",
+        "customer", "customer_segment", "assignment", "entry_type",
+        "voucher_type", "voucher_no", "posting_date",
+        "base_amount", "multiplier", "points",
+    ], [(
+        frappe.generate_hash(length=10), timestamp, timestamp, user, user,
+        doc.customer, segment, assignment, entry_type,
+        doc.doctype, doc.name, doc.posting_date,
+        base_amount, multiplier, points,
+    )])
+
+    earned = points if entry_type == "Earned" else 0
+    reversed_points = -points if entry_type in ("Reversed", "Returned") else 0
+
+    frappe.db.sql("""
+        INSERT INTO `tab{0}`
+            (name, creation, modified, owner, modified_by, customer,
+            points_balance, points_earned, points_reversed, last_entry_on)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            points_balance = points_balance + VALUES(points_balance),
+            points_earned = points_earned + VALUES(points_earned),
+            points_reversed = points_reversed + VALUES(points_reversed),
+            last_entry_on = VALUES(last_entry_on),
+            modified = VALUES(modified),
+            modified_by = VALUES(modified_by)
+    """.format(BALANCE_DOCTYPE), (
+        doc.customer, timestamp, timestamp, user, user, doc.customer,
+        points, earned, reversed_points, timestamp,
+    ))
+
+    if assignment:
+        frappe.db.sql("""
+            UPDATE `tabHD Customer Segment Assignment`
+            SET loyalty_points_earned = COALESCE(loyalty_points_earned, 0) + %s
+            WHERE name = %s
+        """, (points, assignment))
+
+
+@frappe.whitelist()
+def get_loyalty_balance(customer):
+    """Current loyalty points balance of a customer"""
+    frappe.has_permission(BALANCE_DOCTYPE, "read", throw=True)
+    return flt(frappe.db.get_value(BALANCE_DOCTYPE, customer, "points_balance"))
+
+
+@frappe.whitelist()
+def rebuild_loyalty_balances():
+    """Recompute every materialized balance from the ledger"""
+    frappe.only_for(["Sales Manager", "Customer Service Manager"])
+
+    timestamp = now()
+    user = frappe.session.user
+
+    frappe.db.sql("""
+        INSERT INTO `tab{0}`
+            (name, creation, modified, owner, modified_by, customer,
+            points_balance, points_earned, points_reversed, last_entry_on)
+        SELECT
+            customer, %(timestamp)s, %(timestamp)s, %(user)s, %(user)s, customer,
+            SUM(points),
+            SUM(CASE WHEN entry_type = 'Earned' THEN points ELSE 0 END),
+            -SUM(CASE WHEN entry_type IN ('Reversed', 'Returned') THEN points ELSE 0 END),
+            MAX(creation)
+        FROM `tab{1}`
+        GROUP BY customer
+        ON DUPLICATE KEY UPDATE
+            points_balance = VALUES(points_balance),
+            points_earned = VALUES(points_earned),
+            points_reversed = VALUES(points_reversed),
+            last_entry_on = VALUES(last_entry_on),
+            modified = VALUES(modified),
+            modified_by = VALUES(modified_by)
+    """.format(BALANCE_DOCTYPE, LEDGER_DOCTYPE), {"timestamp": timestamp, "user": user})
+
+    frappe.db.commit()
+
+    return {
+        "success": True,
+        "message": f"Rebuilt {frappe.db.count(BALANCE_DOCTYPE)} loyalty balances from the ledger"
+    }
@@ -0,0 +1,91 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+"""Point-in-time segment membership history.
+
+Every assignment change opens or closes a half-open [valid_from, valid_to)
+interval in HD Segment Membership History, in the same transaction as the
+assignment write. Open intervals end at OPEN_END instead of NULL so that
+both bounds stay usable in the (customer, valid_from, valid_to) and
+(customer_segment, valid_from, valid_to) indexes.
+"""
+
+import frappe
+from frappe.utils import getdate, now, nowdate
+
+HISTORY_DOCTYPE = "HD Segment Membership History"
+OPEN_END = "9999-12-31"
+HISTORY_CHUNK_SIZE = 1000
+
+
+def open_intervals(assignments, valid_from=None, opened_by="Assigned"):
+    """Open membership intervals for (assignment, customer, segment) tuples with multi-row inserts"""
+    if not assignments:
+        return 0
+
+    valid_from = valid_from or nowdate()
+    timestamp = now()
+    user = frappe.session.user
+
+    values = [
+        (frappe.generate_hash(length=10), timestamp, timestamp, user, user,
+            customer, segment, assignment, valid_from, OPEN_END, opened_by)
+        for assignment, customer, segment in assignments
+    ]
+
+    for i in range(0, len(values), HISTORY_CHUNK_SIZE):
+        frappe.db.bulk_insert(HISTORY_DOCTYPE, [
+            "name", "creation", "modified", "owner", "modified_by",
+            "customer", "customer_segment", "assignment", "valid_from", "valid_to", "opened_by",
+        ], values[i:i + HISTORY_CHUNK_SIZE])
+
+    return len(values)
+
+
+def close_intervals(assignments, valid_to=None, closed_by="Deactivated"):
+    """Close the open intervals of the given assignments"""
+    if not assignments:
+        return
+
+    valid_to = valid_to or nowdate()
+
+    for i in range(0, len(assignments), HISTORY_CHUNK_SIZE):
+        chunk = assignments[i:i + HISTORY_CHUNK_SIZE]
+        frappe.db.sql("""
+            UPDATE `tabHD Segment Membership History`
+            SET valid_to = GREATEST(valid_from, %s), closed_by = %s, modified = %s
+            WHERE assignment IN ({0})
+            AND valid_to = %s
+        """.format(", ".join(["%s"] * len(chunk))), [valid_to, closed_by, now()] + chunk + [OPEN_END])
+
+
+@frappe.whitelist()
+def get_segments_on(customer, date=None):
+    """Segments a customer belonged to on a given date"""
+    frappe.has_permission(HISTORY_DOCTYPE, "read", throw=True)
+
+    return frappe.db.sql_list("""
+        SELECT DISTINCT customer_segment
+        FROM `tabHD Segment Membership History`
+        WHERE customer = %s
+        AND valid_from <= %s
+        AND valid_to > %s
+    """, (customer, getdate(date or nowdate()), getdate(date or nowdate())))
+
+
+@frappe.whitelist()
+def get_members_between(segment, from_date, to_date=None):
+    """Customers that belonged to a segment at any point in [from_date, to_date]"""
+    frappe.has_permission(HISTORY_DOCTYPE, "read", throw=True)
+
+    to_date = to_date or from_date
+    if getdate(to_date) < getdate(from_date):
+        frappe.throw("To date cannot be before From date")
+
+    return frappe.db.sql_list("""
+        SELECT DISTINCT customer
+        FROM `tabHD Segment Membership History`
+        WHERE customer_segment = %s
+        AND valid_from <= %s
+        AND valid_to > %s
+    """, (segment, getdate(to_date), getdate(from_date)))
@@ -0,0 +1,193 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+"""RFM scoring and k-means clustering for Behavioral and Value Based segments.
+
+A recency/frequency/monetary matrix is built for every customer with one
+grouped Sales Invoice query, scored and clustered with NumPy, and the
+resulting clusters are written as segment assignments through the bulk
+assignment path. Clusters are ranked by their mean RFM score and mapped onto
+the active segments of the requested type in priority order, so the most
+valuable cluster lands in the highest priority segment.
+"""
+
+import frappe
+import numpy as np
+from frappe.utils import cint, flt, nowdate
+
+from erpnext_customizations.customer_segmentation.bulk_assignment import (
+    chunked, bulk_assign_customers, resolve_primary_segments
+)
+from erpnext_customizations.customer_segmentation.membership_history import close_intervals
+
+RFM_LOOKBACK_DAYS = 730
+RFM_SCORE_BINS = 5
+KMEANS_MAX_ITERATIONS = 100
+KMEANS_TOLERANCE = 1e-4
+
+
+def build_rfm_matrix(lookback_days=RFM_LOOKBACK_DAYS):
+    """Return (customers, matrix) where matrix columns are recency days, frequency, monetary"""
+    rows = frappe.db.sql("""
+        SELECT
+            si.customer,
+            DATEDIFF(CURDATE(), MAX(si.posting_date)) AS recency,
+            COUNT(*) AS frequency,
+            SUM(si.base_grand_total) AS monetary
+        FROM `tabSales Invoice` si
+        INNER JOIN `tabCustomer` c ON c.name = si.customer AND c.disabled = 0
+        WHERE si.docstatus = 1
+        AND si.is_return = 0
+        AND si.posting_date >= DATE_SUB(CURDATE(), INTERVAL %s DAY)
+        GROUP BY si.customer
+    """, (cint(lookback_days),))
+
+    if not rows:
+        return np.array([], dtype=object), np.empty((0, 3), dtype=np.float64)
+
+    customers = np.array([row[0] for row in rows], dtype=object)
+    matrix = np.array([(flt(row[1]), flt(row[2]), flt(row[3])) for row in rows], dtype=np.float64)
+    return customers, matrix
+
+
+def rfm_scores(matrix, bins=RFM_SCORE_BINS):
+    """Quantile-score each RFM column from 1 (worst) to `bins` (best)"""
+    scores = np.empty(matrix.shape, dtype=np.int64)
+    quantiles = np.linspace(0, 1, bins + 1)[1:-1]
+
+    for column in range(matrix.shape[1]):
+        values = matrix[:, column]
+        edges = np.quantile(values, quantiles)
+        scores[:, column] = np.searchsorted(edges, values, side="right") + 1
+
+    # A low recency (days since last purchase) is good, so flip its score
+    scores[:, 0] = bins + 1 - scores[:, 0]
+    return scores
+
+
+def kmeans(features, k, max_iterations=KMEANS_MAX_ITERATIONS, tolerance=KMEANS_TOLERANCE, seed=0):
+    """Lloyd's k-means with k-means++ seeding; returns (labels, centroids)"""
+    n = features.shape[0]
+    k = min(k, n)
+    rng = np.random.default_rng(seed)
+
+    centroids = np.empty((k, features.shape[1]), dtype=np.float64)
+    centroids[0] = features[rng.integers(n)]
+    closest = ((features - centroids[0]) ** 2).sum(axis=1)
+
+    for i in range(1, k):
+        total = closest.sum()
+        index = rng.choice(n, p=closest / total) if total > 0 else rng.integers(n)
+        centroids[i] = features[index]
+        closest = np.minimum(closest, ((features - centroids[i]) ** 2).sum(axis=1))
+
+    squared_norms = (features ** 2).sum(axis=1)[:, None]
+    labels = np.zeros(n, dtype=np.int64)
+
+    for _ in range(max_iterations):
+        distances = squared_norms - 2 * features @ centroids.T + (centroids ** 2).sum(axis=1)[None, :]
+        labels = distances.argmin(axis=1)
+
+        counts = np.bincount(labels, minlength=k).astype(np.float64)
+        sums = np.stack([np.bincount(labels, weights=features[:, column], minlength=k)
+            for column in range(features.shape[1])], axis=1)
+
+        # Keep the previous centroid for clusters that lost all their members
+        empty = counts == 0
+        new_centroids = np.where(empty[:, None], centroids, sums / np.maximum(counts, 1)[:, None])
+
+        shift = np.abs(new_centroids - centroids).max()
+        centroids = new_centroids
+        if shift <= tolerance:
+            break
+
+    return labels, centroids
+
+
+def cluster_customers(matrix, k, method="kmeans"):
+    """Return cluster ranks (0 = most valuable) for every row of the RFM matrix"""
+    scores = rfm_scores(matrix)
+    composite = scores.sum(axis=1).astype(np.float64)
+
+    if method == "quantile":
+        edges = np.quantile(composite, np.linspace(0, 1, k + 1)[1:-1])
+        bands = np.searchsorted(edges, composite, side="right")
+        return (k - 1) - bands
+
+    # Cluster on log-scaled, standardized raw values so monetary outliers do not dominate
+    features = np.log1p(np.maximum(matrix, 0))
+    std = features.std(axis=0)
+    features = (features - features.mean(axis=0)) / np.where(std > 0, std, 1)
+    features[:, 0] = -features[:, 0]
+
+    labels, _ = kmeans(features, k)
+
+    # Rank clusters by their mean composite RFM score
+    clusters = labels.max() + 1
+    mean_score = np.bincount(labels, weights=composite, minlength=clusters) / np.maximum(
+        np.bincount(labels, minlength=clusters), 1)
+    rank = np.empty(clusters, dtype=np.int64)
+    rank[np.argsort(-mean_score)] = np.arange(clusters)
+    return rank[labels]
+
+
+@frappe.whitelist()
+def run_rfm_segmentation(segment_type="Behavioral", method="kmeans", lookback_days=RFM_LOOKBACK_DAYS):
+    """Cluster customers by RFM and assign each cluster to a segment of `segment_type`"""
+    frappe.only_for(["Sales Manager", "Customer Service Manager"])
+
+    if method not in ("kmeans", "quantile"):
+        frappe.throw("Clustering method must be 'kmeans' or 'quantile'")
+
+    segments = frappe.get_all("HD Customer Segment",
+        filters={"segment_type": segment_type, "status": "Active"},
+        pluck="name",
+        order_by="priority desc, name asc"
+    )
+
+    if len(segments) < 2:
+        frappe.throw(f"At least two active {segment_type} segments are required for clustering")
+
+    customers, matrix = build_rfm_matrix(lookback_days)
+    if not len(customers):
+        return {"success": True, "customers_clustered": 0, "message": "No invoiced customers to cluster"}
+
+    ranks = cluster_customers(matrix, len(segments), method=method)
+    target_segment = {customer: segments[rank] for customer, rank in zip(customers.tolist(), ranks.tolist())}
+
+    # Close assignments of customers whose cluster moved them to another segment
+    current = frappe.get_all("HD Customer Segment Assignment",
+        filters={"customer_segment": ["in", segments], "status": "Active"},
+        fields=["name", "customer", "customer_segment"]
+    )
+    stale = [row.name for row in current
+        if row.customer in target_segment and target_segment[row.customer] != row.customer_segment]
+
+    for chunk in chunked(stale):
+        frappe.db.sql("""
+            UPDATE `tabHD Customer Segment Assignment`
+            SET status = 'Inactive', is_primary = 0, effective_to = %s
+            WHERE name IN ({0})
+        """.format(", ".join(["%s"] * len(chunk))), [nowdate()] + chunk)
+    close_intervals(stale, closed_by="Reclustered")
+
+    members = {segment: [] for segment in segments}
+    for customer, segment in target_segment.items():
+        members[segment].append(customer)
+
+    assignments_created = 0
+    for segment, segment_customers in members.items():
+        result = bulk_assign_customers(segment, segment_customers, resolve_primary=False,
+            opened_by="Reclustered")
+        assignments_created += result["assignments_created"]
+
+    resolve_primary_segments(list(target_segment))
+
+    return {
+        "success": True,
+        "customers_clustered": len(customers),
+        "assignments_created": assignments_created,
+        "assignments_closed": len(stale),
+        "cluster_sizes": {segment: len(segment_customers) for segment, segment_customers in members.items()},
+        "message": f"Clustered {len(customers)} customers into {len(segments)} {segment_type} segments"
+    }
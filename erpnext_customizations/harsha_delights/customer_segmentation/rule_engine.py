@@ -0,0 +1,368 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+"""Compiled evaluator for HD Customer Segment auto assignment rules.
+
+Rules are compiled once per segment into vectorized predicates that run
+against a columnar NumPy snapshot of customer metrics, so every
+auto-assignment segment can be evaluated for every customer in one pass.
+
+Rule format (conditions may nest groups of their own)::
+
+    {
+        "logic": "AND",
+        "conditions": [
+            {"field": "annual_purchase", "operator": ">=", "value": 500000},
+            {"logic": "OR", "conditions": [
+                {"field": "territory", "operator": "IN", "value": ["Mumbai", "Pune"]},
+                {"field": "total_orders", "operator": ">", "value": 24}
+            ]}
+        ]
+    }
+
+Item group affinity fields (see item_group_affinity) take an extra
+"item_group" key and are read from a spend matrix loaded on first use.
+"""
+
+import json
+
+import frappe
+import numpy as np
+from frappe.utils import flt, getdate
+
+from erpnext_customizations.customer_segmentation.item_group_affinity import (
+    AFFINITY_FIELDS, ITEM_GROUP_FIELDS, load_affinity_matrix
+)
+
+NUMERIC_FIELDS = (
+    "annual_purchase",
+    "total_orders",
+    "order_frequency",
+    "invoice_count",
+    "avg_order_value",
+    "days_since_last_purchase",
+)
+
+CATEGORICAL_FIELDS = (
+    "customer_group",
+    "territory",
+    "customer_type",
+)
+
+DATE_FIELDS = (
+    "creation_date",
+)
+
+SUPPORTED_OPERATORS = (
+    "=", "!=", ">", ">=", "<", "<=", "IN", "NOT IN", "BETWEEN", "NOT BETWEEN",
+)
+
+# Process-local cache of compiled predicates: {segment name: (modified, predicate)}
+_compiled_rules = {}
+
+
+class CustomerMetricsSnapshot:
+    """Columnar snapshot of the metrics the segment rules can refer to"""
+
+    def __init__(self, customers, columns):
+        self.customers = customers
+        self.columns = columns
+        self.index = {customer: i for i, customer in enumerate(customers)}
+        self._affinity = None
+
+    def __len__(self):
+        return len(self.customers)
+
+    def column(self, field):
+        return self.columns[field]
+
+    def affinity(self):
+        """Item group spend matrix aligned with this snapshot, loaded on first use"""
+        if self._affinity is None:
+            self._affinity = load_affinity_matrix(self.customers)
+        return self._affinity
+
+    def select(self, mask):
+        """Return the customers selected by a boolean mask"""
+        return self.customers[mask].tolist()
+
+
+def load_customer_metrics(customers=None):
+    """Build a columnar snapshot of customer metrics with one aggregate query"""
+    conditions = ""
+    params = []
+
+    if customers is not None:
+        if not customers:
+            return _build_snapshot([])
+        conditions = " AND c.name IN ({0})".format(", ".join(["%s"] * len(customers)))
+        params.extend(customers)
+
+    rows = frappe.db.sql("""
+        SELECT
+            c.name AS customer,
+            c.customer_group,
+            c.territory,
+            c.customer_type,
+            DATE(c.creation) AS creation_date,
+            COALESCE(si.annual_purchase, 0) AS annual_purchase,
+            COALESCE(si.invoice_count, 0) AS invoice_count,
+            DATEDIFF(CURDATE(), si.last_purchase_date) AS days_since_last_purchase,
+            COALESCE(so.total_orders, 0) AS total_orders
+        FROM `tabCustomer` c
+        LEFT JOIN (
+            SELECT customer,
+                SUM(grand_total) AS annual_purchase,
+                COUNT(*) AS invoice_count,
+                MAX(posting_date) AS last_purchase_date
+            FROM `tabSales Invoice`
+            WHERE posting_date >= DATE_SUB(CURDATE(), INTERVAL 12 MONTH)
+            AND docstatus = 1
+            GROUP BY customer
+        ) si ON si.customer = c.name
+        LEFT JOIN (
+            SELECT customer, COUNT(*) AS total_orders
+            FROM `tabSales Order`
+            WHERE transaction_date >= DATE_SUB(CURDATE(), INTERVAL 12 MONTH)
+            AND docstatus = 1
+            GROUP BY customer
+        ) so ON so.customer = c.name
+        WHERE c.disabled = 0{0}
+    """.format(conditions), params, as_dict=True)
+
+    return _build_snapshot(rows)
+
+
+def _build_snapshot(rows):
+    count = len(rows)
+    customers = np.array([row["customer"] for row in rows], dtype=object)
+
+    annual_purchase = np.fromiter((flt(row["annual_purchase"]) for row in rows), dtype=np.float64, count=count)
+    invoice_count = np.fromiter((flt(row["invoice_count"]) for row in rows), dtype=np.float64, count=count)
+    total_orders = np.fromiter((flt(row["total_orders"]) for row in rows), dtype=np.float64, count=count)
+    days_since_last_purchase = np.fromiter(
+        (np.inf if row["days_since_last_purchase"] is None else flt(row["days_since_last_purchase"]) for row in rows),
+        dtype=np.float64, count=count
+    )
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        avg_order_value = np.where(invoice_count > 0, annual_purchase / np.maximum(invoice_count, 1), 0.0)
+
+    columns = {
+        "annual_purchase": annual_purchase,
+        "invoice_count": invoice_count,
+        "total_orders": total_orders,
+        "order_frequency": total_orders / 12,
+        "avg_order_value": avg_order_value,
+        "days_since_last_purchase": days_since_last_purchase,
+        "creation_date": np.array(
+            [np.datetime64(row["creation_date"], "D") if row["creation_date"] else np.datetime64("NaT") for row in rows],
+            dtype="datetime64[D]"
+        ),
+    }
+
+    for field in CATEGORICAL_FIELDS:
+        columns[field] = np.array([row[field] or "" for row in rows], dtype=object)
+
+    return CustomerMetricsSnapshot(customers, columns)
+
+
+def compile_rules(rules):
+    """Compile a rule tree into a predicate mapping a snapshot to a boolean mask"""
+    if isinstance(rules, str):
+        rules = json.loads(rules)
+
+    if not isinstance(rules, dict):
+        frappe.throw("Auto assignment rules must be a JSON object")
+
+    return _compile_node(rules)
+
+
+def _compile_node(node):
+    if not isinstance(node, dict):
+        frappe.throw("Each auto assignment condition must be a JSON object")
+
+    if "conditions" in node:
+        return _compile_group(node)
+
+    return _compile_condition(node)
+
+
+def _compile_group(node):
+    logic = (node.get("logic") or "AND").upper()
+    if logic not in ("AND", "OR"):
+        frappe.throw(f"Unsupported rule logic '{logic}'. Use AND or OR")
+
+    children = [_compile_node(child) for child in node.get("conditions") or []]
+    children = [child for child in children if child is not None]
+
+    if not children:
+        return None
+
+    reducer = np.logical_and if logic == "AND" else np.logical_or
+
+    def predicate(snapshot):
+        mask = children[0](snapshot)
+        for child in children[1:]:
+            mask = reducer(mask, child(snapshot))
+        return mask
+
+    return predicate
+
+
+def _compile_condition(condition):
+    field = condition.get("field")
+    operator = (condition.get("operator") or "").upper()
+    value = condition.get("value")
+
+    if not field or not operator or value is None:
+        return None
+
+    if field not in NUMERIC_FIELDS + CATEGORICAL_FIELDS + DATE_FIELDS + AFFINITY_FIELDS:
+        frappe.throw(f"Unsupported rule field '{field}'")
+
+    if operator not in SUPPORTED_OPERATORS:
+        frappe.throw(f"Unsupported rule operator '{operator}'")
+
+    if field in CATEGORICAL_FIELDS and operator not in ("=", "!=", "IN", "NOT IN"):
+        frappe.throw(f"Operator '{operator}' is not supported for field '{field}'")
+
+    column = _compile_column(field, condition)
+
+    if operator in ("IN", "NOT IN"):
+        if not isinstance(value, (list, tuple)):
+            frappe.throw(f"Operator '{operator}' expects a list value for field '{field}'")
+        values = np.array([_coerce(field, v) for v in value],
+            dtype=object if field in CATEGORICAL_FIELDS else None)
+        invert = operator == "NOT IN"
+        return lambda snapshot: np.isin(column(snapshot), values, invert=invert)
+
+    if operator in ("BETWEEN", "NOT BETWEEN"):
+        if not isinstance(value, (list, tuple)) or len(value) != 2:
+            frappe.throw(f"Operator '{operator}' expects a [from, to] value for field '{field}'")
+        low, high = _coerce(field, value[0]), _coerce(field, value[1])
+        if operator == "BETWEEN":
+            return lambda snapshot: (column(snapshot) >= low) & (column(snapshot) <= high)
+        return lambda snapshot: (column(snapshot) < low) | (column(snapshot) > high)
+
+    operand = _coerce(field, value)
+    comparators = {
+        "=": np.equal,
+        "!=": np.not_equal,
+        ">": np.greater,
+        ">=": np.greater_equal,
+        "<": np.less,
+        "<=": np.less_equal,
+    }
+    comparator = comparators[operator]
+    return lambda snapshot: comparator(column(snapshot), operand)
+
+
+def _compile_column(field, condition):
+    """Return a function reading the values a condition compares against"""
+    if field not in AFFINITY_FIELDS:
+        return lambda snapshot: snapshot.column(field)
+
+    if field not in ITEM_GROUP_FIELDS:
+        return lambda snapshot: snapshot.affinity().metric(field)
+
+    item_groups = condition.get("item_group")
+    if isinstance(item_groups, str):
+        item_groups = [item_groups]
+    if not item_groups or not isinstance(item_groups, (list, tuple)):
+        frappe.throw(f"Field '{field}' needs an 'item_group' (a group name or a list of them)")
+
+    item_groups = tuple(item_groups)
+    return lambda snapshot: snapshot.affinity().metric(field, item_groups)
+
+
+def _coerce(field, value):
+    if field in NUMERIC_FIELDS + AFFINITY_FIELDS:
+        return flt(value)
+    if field in DATE_FIELDS:
+        return np.datetime64(getdate(value), "D")
+    return value
+
+
+def compile_segment(segment_doc, include_rules=True):
+    """Compile the rules and built-in conditions of a segment into one predicate"""
+    predicates = []
+
+    if include_rules and segment_doc.auto_assignment_rules:
+        rules_predicate = compile_rules(segment_doc.auto_assignment_rules)
+        if rules_predicate:
+            predicates.append(rules_predicate)
+
+    if segment_doc.min_annual_purchase:
+        min_annual_purchase = flt(segment_doc.min_annual_purchase)
+        predicates.append(lambda snapshot: snapshot.column("annual_purchase") >= min_annual_purchase)
+
+    if segment_doc.geographic_restriction:
+        territory = segment_doc.geographic_restriction
+        predicates.append(lambda snapshot: snapshot.column("territory") == territory)
+
+    def predicate(snapshot):
+        mask = np.ones(len(snapshot), dtype=bool)
+        for segment_predicate in predicates:
+            mask &= segment_predicate(snapshot)
+        return mask
+
+    return predicate
+
+
+def get_segment_predicate(segment_doc):
+    """Return the cached compiled predicate for a segment, recompiling when it changed"""
+    modified = str(segment_doc.modified)
+    cached = _compiled_rules.get(segment_doc.name)
+
+    if cached and cached[0] == modified:
+        return cached[1]
+
+    predicate = compile_segment(segment_doc)
+    _compiled_rules[segment_doc.name] = (modified, predicate)
+    return predicate
+
+
+def clear_compiled_rules(segment=None):
+    """Invalidate cached predicates for one segment, or all of them"""
+    if segment:
+        _compiled_rules.pop(segment, None)
+    else:
+        _compiled_rules.clear()
+
+
+def evaluate_segment(segment_doc, snapshot=None):
+    """Return customers matching a single segment"""
+    if snapshot is None:
+        snapshot = load_customer_metrics()
+
+    if not len(snapshot):
+        return []
+
+    return snapshot.select(get_segment_predicate(segment_doc)(snapshot))
+
+
+def evaluate_all_segments(snapshot=None):
+    """Evaluate every active auto-assignment segment against one shared snapshot"""
+    segments = frappe.get_all("HD Customer Segment",
+        filters={"auto_assignment_enabled": 1, "status": "Active"},
+        pluck="name"
+    )
+
+    if not segments:
+        return {}
+
+    if snapshot is None:
+        snapshot = load_customer_metrics()
+
+    eligible = {}
+    for segment in segments:
+        segment_doc = frappe.get_cached_doc("HD Customer Segment", segment)
+        try:
+            eligible[segment] = evaluate_segment(segment_doc, snapshot)
+        except Exception as e:
+            frappe.log_error(f"Error evaluating rules for segment {segment}: {str(e)}",
+                "Segment Rule Evaluation")
+            eligible[segment] = []
+
+    return eligible
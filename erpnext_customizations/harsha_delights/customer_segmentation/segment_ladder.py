@@ -0,0 +1,227 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+"""Escalation/demotion ladder for HD Customer Segment.
+
+The whole ladder is loaded once as a graph of escalation and demotion edges.
+Cycles are rejected at save time, and the review job walks each customer
+straight to their final segment over as many hops as they qualify for,
+against one shared metrics snapshot, instead of moving one hop per review.
+"""
+
+import frappe
+from frappe.utils import flt, nowdate
+
+from erpnext_customizations.customer_segmentation.bulk_assignment import (
+    bulk_assign_customers, chunked, resolve_primary_segments
+)
+from erpnext_customizations.customer_segmentation.membership_history import close_intervals
+from erpnext_customizations.customer_segmentation.rule_engine import (
+    compile_segment, load_customer_metrics
+)
+
+LADDER_EDGES = ("escalation_segment", "demotion_segment")
+
+
+class SegmentLadder:
+    """Escalation and demotion edges between segments"""
+
+    def __init__(self, segments):
+        self.segments = {segment.name: segment for segment in segments}
+        self.edges = {
+            edge: {segment.name: segment.get(edge) for segment in segments if segment.get(edge)}
+            for edge in LADDER_EDGES
+        }
+
+    def find_cycle(self, edge):
+        """Return the first cycle along `edge` links as a list of segment names, or None"""
+        links = self.edges[edge]
+        finished = set()
+
+        for start in links:
+            path = []
+            on_path = {}
+            node = start
+
+            while node in links and node not in finished:
+                if node in on_path:
+                    return path[on_path[node]:] + [node]
+                on_path[node] = len(path)
+                path.append(node)
+                node = links[node]
+
+            finished.update(path)
+
+        return None
+
+    def next_segment(self, segment, edge):
+        return self.edges[edge].get(segment)
+
+
+def load_segment_ladder(overrides=None):
+    """Load every segment's ladder links in one query, optionally overriding unsaved values"""
+    segments = frappe.get_all("HD Customer Segment",
+        fields=["name", "status", "escalation_segment", "demotion_segment"]
+    )
+
+    if overrides:
+        for segment in segments:
+            if segment.name == overrides.name:
+                segment.update(overrides)
+                break
+        else:
+            segments.append(overrides)
+
+    return SegmentLadder(segments)
+
+
+def validate_segment_ladder(segment_doc):
+    """Reject escalation or demotion chains that loop back on themselves"""
+    ladder = load_segment_ladder(frappe._dict(
+        name=segment_doc.name,
+        status=segment_doc.status,
+        escalation_segment=segment_doc.escalation_segment,
+        demotion_segment=segment_doc.demotion_segment
+    ))
+
+    for edge, label in (("escalation_segment", "Escalation"), ("demotion_segment", "Demotion")):
+        cycle = ladder.find_cycle(edge)
+        if cycle:
+            frappe.throw(f"{label} segments form a cycle: {' → '.join(cycle)}")
+
+
+def compile_qualification(segment_doc):
+    """Predicate for whether customers still qualify for a segment"""
+    # Rules only bind members of segments that assign by them; manual segments keep their members
+    segment_predicate = compile_segment(segment_doc, include_rules=bool(segment_doc.auto_assignment_enabled))
+    min_order_frequency = flt(segment_doc.min_order_frequency)
+
+    def predicate(snapshot):
+        mask = segment_predicate(snapshot)
+        if min_order_frequency:
+            mask &= snapshot.column("order_frequency") >= min_order_frequency
+        return mask
+
+    return predicate
+
+
+def customer_qualifies(segment_doc, customer):
+    """Single-customer qualification check against a one-row snapshot"""
+    snapshot = load_customer_metrics([customer])
+    if not len(snapshot):
+        return False
+    return bool(compile_qualification(segment_doc)(snapshot)[0])
+
+
+def review_segment_assignments(segments=None):
+    """Move every reviewed customer straight to their final segment in one pass.
+
+    Customers who still qualify climb the escalation chain as far as they
+    qualify; customers who no longer qualify descend the demotion chain to
+    the first segment they qualify for (or the end of the chain), and are
+    deactivated when their segment has no demotion target.
+    """
+    ladder = load_segment_ladder()
+
+    filters = {"status": "Active"}
+    if segments:
+        filters["customer_segment"] = ["in", segments]
+
+    assignments = frappe.get_all("HD Customer Segment Assignment",
+        filters=filters,
+        fields=["name", "customer", "customer_segment"]
+    )
+
+    if not assignments:
+        return {"escalated": 0, "demoted": 0, "deactivated": 0}
+
+    snapshot = load_customer_metrics(list({row.customer for row in assignments}))
+    qualification = {}
+
+    def qualifies(segment, position):
+        if position is None:
+            return False
+        if segment not in qualification:
+            segment_doc = frappe.get_cached_doc("HD Customer Segment", segment)
+            qualification[segment] = compile_qualification(segment_doc)(snapshot)
+        return bool(qualification[segment][position])
+
+    def is_active(segment):
+        return segment in ladder.segments and ladder.segments[segment].status == "Active"
+
+    moves = {"escalation_segment": {}, "demotion_segment": {}}
+    deactivated = []
+
+    for assignment in assignments:
+        position = snapshot.index.get(assignment.customer)
+        current = assignment.customer_segment
+
+        if qualifies(current, position):
+            edge = "escalation_segment"
+            target = current
+            visited = {current}
+            candidate = ladder.next_segment(target, edge)
+            while candidate and candidate not in visited and is_active(candidate) and qualifies(candidate, position):
+                target = candidate
+                visited.add(candidate)
+                candidate = ladder.next_segment(target, edge)
+        else:
+            edge = "demotion_segment"
+            target = None
+            visited = {current}
+            candidate = ladder.next_segment(current, edge)
+            while candidate and candidate not in visited and is_active(candidate):
+                target = candidate
+                visited.add(candidate)
+                if qualifies(candidate, position):
+                    break
+                candidate = ladder.next_segment(target, edge)
+
+            if not target:
+                deactivated.append(assignment.name)
+                continue
+
+        if target != current:
+            moves[edge].setdefault(target, []).append(assignment)
+
+    today = nowdate()
+    touched_customers = {row.customer for row in assignments}
+
+    _close_assignments(deactivated, today, "Deactivated")
+
+    for edge, assignment_type, reason in (
+        ("escalation_segment", "Upgraded", "Escalated"),
+        ("demotion_segment", "Downgraded", "Demoted"),
+    ):
+        moved = [row.name for rows in moves[edge].values() for row in rows]
+        _close_assignments(moved, today, reason)
+
+        for target, rows in moves[edge].items():
+            bulk_assign_customers(target, [row.customer for row in rows],
+                assignment_type=assignment_type, resolve_primary=False, opened_by=reason)
+
+    resolve_primary_segments(list(touched_customers))
+
+    return {
+        "escalated": sum(len(rows) for rows in moves["escalation_segment"].values()),
+        "demoted": sum(len(rows) for rows in moves["demotion_segment"].values()),
+        "deactivated": len(deactivated),
+    }
+
+
+def _close_assignments(assignments, effective_to, reason):
+    for chunk in chunked(assignments):
+        frappe.db.sql("""
+            UPDATE `tabHD Customer Segment Assignment`
+            SET status = 'Inactive', is_primary = 0, effective_to = %s
+            WHERE name IN ({0})
+        """.format(", ".join(["%s"] * len(chunk))), [effective_to] + chunk)
+
+    close_intervals(assignments, valid_to=effective_to, closed_by=reason)
+
+
+@frappe.whitelist()
+def run_segment_review():
+    """Review every active assignment across the whole segment ladder"""
+    frappe.only_for(["Sales Manager", "Customer Service Manager"])
+    return review_segment_assignments()
@@ -0,0 +1,166 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+"""Nightly nearest-neighbour index for "customers like this one also buy".
+
+Each customer's item group spend over the affinity window is L2-normalized,
+and cosine similarities are computed within every active segment with
+blocked matrix products, so memory stays bounded for large segments. The
+top-K neighbours of each member, plus the item groups those neighbours buy
+that the customer does not yet, are stored in HD Customer Similarity under a
+name derived from (segment, customer). The sales app then reads a customer's
+list with a single primary key lookup.
+"""
+
+import hashlib
+import json
+
+import frappe
+import numpy as np
+from frappe.utils import cint, now
+
+from erpnext_customizations.customer_segmentation.item_group_affinity import load_affinity_matrix
+
+SIMILARITY_DOCTYPE = "HD Customer Similarity"
+DEFAULT_NEIGHBOURS = 20
+DEFAULT_RECOMMENDATIONS = 5
+WRITE_CHUNK_SIZE = 1000
+
+# Upper bound on similarity scores held in memory per block (float32 entries)
+BLOCK_ELEMENTS = 1 << 24
+
+
+def similarity_key(segment, customer):
+    """Primary key of a customer's neighbour list within a segment"""
+    return hashlib.md5(f"{segment}::{customer}".encode()).hexdigest()
+
+
+def normalize_rows(dense):
+    """L2-normalize purchase vectors; customers without spend stay all-zero"""
+    norms = np.linalg.norm(dense, axis=1)
+    return (dense / np.where(norms > 0, norms, 1)[:, None]).astype(np.float32)
+
+
+def top_neighbours(vectors, k, recommendations=DEFAULT_RECOMMENDATIONS):
+    """Yield (row, neighbour rows, scores, recommended columns, recommendation scores) per vector"""
+    n = vectors.shape[0]
+    k = min(k, n - 1)
+    if k <= 0:
+        return
+
+    block_size = max(1, BLOCK_ELEMENTS // n)
+    bought = vectors > 0
+
+    for start in range(0, n, block_size):
+        end = min(start + block_size, n)
+        scores = vectors[start:end] @ vectors.T
+        scores[np.arange(end - start), np.arange(start, end)] = -np.inf
+
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+        order = np.argsort(-candidate_scores, axis=1)
+        neighbours = np.take_along_axis(candidates, order, axis=1)
+        neighbour_scores = np.take_along_axis(candidate_scores, order, axis=1)
+
+        # Score item groups by what similar customers buy, weighted by similarity
+        weights = np.maximum(neighbour_scores, 0)
+        group_scores = np.einsum("bk,bkg->bg", weights, vectors[neighbours])
+        group_scores[bought[start:end]] = 0
+
+        for offset in range(end - start):
+            positive = neighbour_scores[offset] > 0
+            top_groups = np.argsort(-group_scores[offset])[:recommendations]
+            top_groups = top_groups[group_scores[offset][top_groups] > 0]
+            yield (start + offset, neighbours[offset][positive], neighbour_scores[offset][positive],
+                top_groups, group_scores[offset][top_groups])
+
+
+def refresh_similarity_index(k=DEFAULT_NEIGHBOURS):
+    """Nightly job: rebuild the neighbour lists of every active segment"""
+    members = frappe.db.sql("""
+        SELECT a.customer_segment, a.customer
+        FROM `tabHD Customer Segment Assignment` a
+        INNER JOIN `tabHD Customer Segment` s ON s.name = a.customer_segment AND s.status = 'Active'
+        WHERE a.status = 'Active'
+    """)
+
+    customers_by_segment = {}
+    for segment, customer in members:
+        customers_by_segment.setdefault(segment, set()).add(customer)
+
+    matrix = load_affinity_matrix()
+    index = {customer: i for i, customer in enumerate(matrix.customers.tolist())}
+
+    report = {}
+    for segment, customers in customers_by_segment.items():
+        try:
+            positions = np.array(sorted(index[customer] for customer in customers if customer in index),
+                dtype=np.int64)
+            report[segment] = _rebuild_segment(segment, matrix, positions, cint(k))
+            frappe.db.commit()
+        except Exception as e:
+            frappe.db.rollback()
+            frappe.log_error(f"Error building similarity index for segment {segment}: {str(e)}",
+                "Customer Similarity Index")
+
+    # Segments that were deactivated or lost all members keep no stale lists
+    frappe.db.sql("""
+        DELETE FROM `tab{0}`
+        WHERE customer_segment NOT IN (
+            SELECT name FROM `tabHD Customer Segment` WHERE status = 'Active'
+        )
+    """.format(SIMILARITY_DOCTYPE))
+    frappe.db.commit()
+
+    return report
+
+
+def _rebuild_segment(segment, matrix, positions, k):
+    customers = matrix.customers[positions]
+    vectors = normalize_rows(matrix.to_dense(positions))
+    timestamp = now()
+    user = frappe.session.user
+
+    values = []
+    for row, neighbours, scores, groups, group_scores in top_neighbours(vectors, k):
+        customer = customers[row]
+        values.append((
+            similarity_key(segment, customer), timestamp, timestamp, user, user,
+            customer, segment, len(neighbours), timestamp,
+            json.dumps([[customers[n], round(float(score), 4)] for n, score in zip(neighbours, scores)]),
+            json.dumps([[matrix.item_groups[g], round(float(score), 4)] for g, score in zip(groups, group_scores)]),
+        ))
+
+    frappe.db.sql("DELETE FROM `tab{0}` WHERE customer_segment = %s".format(SIMILARITY_DOCTYPE), (segment,))
+
+    for i in range(0, len(values), WRITE_CHUNK_SIZE):
+        frappe.db.bulk_insert(SIMILARITY_DOCTYPE, [
+            "name", "creation", "modified", "owner", "modified_by",
+            "customer", "customer_segment", "neighbour_count", "refreshed_on",
+            "neighbours", "recommended_item_groups",
+        ], values[i:i + WRITE_CHUNK_SIZE])
+
+    return len(values)
+
+
+@frappe.whitelist()
+def get_similar_customers(customer, segment=None):
+    """Precomputed neighbours and cross-sell item groups of a customer within a segment"""
+    frappe.has_permission(SIMILARITY_DOCTYPE, "read", throw=True)
+
+    segment = segment or frappe.db.get_value("Customer", customer, "hd_primary_segment")
+    if not segment:
+        return {"customer": customer, "segment": None, "neighbours": [], "recommended_item_groups": []}
+
+    row = frappe.db.get_value(SIMILARITY_DOCTYPE, similarity_key(segment, customer),
+        ["neighbours", "recommended_item_groups", "refreshed_on"], as_dict=True)
+
+    return {
+        "customer": customer,
+        "segment": segment,
+        "neighbours": [{"customer": name, "score": score}
+            for name, score in json.loads(row.neighbours or "[]")] if row else [],
+        "recommended_item_groups": [{"item_group": name, "score": score}
+            for name, score in json.loads(row.recommended_item_groups or "[]")] if row else [],
+        "refreshed_on": row.refreshed_on if row else None,
+    }
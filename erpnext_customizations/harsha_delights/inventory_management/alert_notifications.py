@@ -0,0 +1,273 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+"""Batched stakeholder notifications for stock and batch alerts.
+
+Raising an alert only appends a row to HD Alert Notification in the caller's
+transaction, so it costs one insert however many users will be told about
+it. A digest job drains the queue every few minutes. It resolves roles to
+users through a cached role map and coalesces the pending alerts into one
+Notification Log per user. ToDos, their document shares and assignments
+are written with multi-row inserts.
+"""
+
+import json
+
+import frappe
+from frappe.utils import escape_html, nowdate, now
+
+QUEUE_DOCTYPE = "HD Alert Notification"
+STOCK_ALERT_DOCTYPE = "HD Stock Alert"
+DIGEST_CHUNK_SIZE = 1000
+
+ROLE_USERS_CACHE_KEY = "hd_alert_role_users"
+ROLE_USERS_CACHE_TTL = 60 * 60
+
+# Alerts drained per digest run; the rest wait for the next run
+DIGEST_LIMIT = 5000
+
+STOCK_ALERT_ROLES = {
+    "Low Stock": ["Stock Manager", "Purchase Manager"],
+    "Zero Stock": ["Stock Manager", "Purchase Manager"],
+    "High Stock": ["Stock Manager", "Purchase Manager"],
+    "Expiry Warning": ["Stock Manager", "Quality Manager"],
+    "Expired Stock": ["Stock Manager", "Quality Manager"],
+    "Quality Alert": ["Quality Manager", "Production Manager"],
+    "Negative Stock": ["Stock Manager", "Accounts Manager"],
+}
+
+# Alert levels that also assign a ToDo to every recipient
+TODO_ALERT_LEVELS = ("Critical", "Urgent")
+
+
+def get_role_users():
+    """Map of role to enabled users holding it, cached across requests"""
+    role_users = frappe.cache().get_value(ROLE_USERS_CACHE_KEY)
+    if role_users is None:
+        role_users = {}
+        for role, user in frappe.db.sql("""
+            SELECT hr.role, hr.parent
+            FROM `tabHas Role` hr
+            INNER JOIN `tabUser` u ON u.name = hr.parent
+            WHERE hr.parenttype = 'User'
+            AND u.enabled = 1
+        """):
+            role_users.setdefault(role, []).append(user)
+
+        frappe.cache().set_value(ROLE_USERS_CACHE_KEY, role_users, expires_in_sec=ROLE_USERS_CACHE_TTL)
+
+    return role_users
+
+
+def clear_role_users_cache(doc=None, method=None):
+    """User hook: role assignments are saved with the User"""
+    frappe.cache().delete_value(ROLE_USERS_CACHE_KEY)
+
+
+def queue_notifications(notifications):
+    """Queue notifications (reference_doctype, reference_name, subject, message, roles, todo_priority) for the next digest"""
+    timestamp = now()
+    user = frappe.session.user
+
+    values = [(
+        frappe.generate_hash(length=10), timestamp, timestamp, user, user,
+        n["reference_doctype"], n["reference_name"], "\n".join(n["roles"]),
+        n.get("todo_priority") or "", n.get("subject"), n.get("message"),
+    ) for n in notifications if n.get("roles")]
+
+    for i in range(0, len(values), DIGEST_CHUNK_SIZE):
+        frappe.db.bulk_insert(QUEUE_DOCTYPE, [
+            "name", "creation", "modified", "owner", "modified_by",
+            "reference_doctype", "reference_name", "notify_roles",
+            "todo_priority", "subject", "message",
+        ], values[i:i + DIGEST_CHUNK_SIZE])
+
+
+def queue_stock_alerts(alerts):
+    """Queue stakeholder notifications for HD Stock Alerts by name"""
+    rows = []
+    for i in range(0, len(alerts), DIGEST_CHUNK_SIZE):
+        rows.extend(frappe.get_all(STOCK_ALERT_DOCTYPE,
+            filters={"name": ["in", alerts[i:i + DIGEST_CHUNK_SIZE]]},
+            fields=["name", "alert_type", "alert_level", "item_name", "alert_message"]))
+
+    queue_notifications([{
+        "reference_doctype": STOCK_ALERT_DOCTYPE,
+        "reference_name": row.name,
+        "subject": f"Stock Alert: {row.alert_type} - {row.item_name}",
+        "message": row.alert_message,
+        "roles": STOCK_ALERT_ROLES.get(row.alert_type, []),
+        "todo_priority": "High" if row.alert_level in TODO_ALERT_LEVELS else None,
+    } for row in rows])
+
+
+def notify_roles(roles, subject, message):
+    """One Notification Log per user holding any of the roles, for summaries that refer to no single document"""
+    role_users = get_role_users()
+    users = sorted({user for role in roles for user in role_users.get(role, [])})
+
+    summary = frappe._dict(subject=subject, message=message, reference_doctype=None, reference_name=None)
+    insert_digest_notifications({user: {None: summary} for user in users})
+
+    for user in users:
+        frappe.publish_realtime("notification", user=user, after_commit=True)
+
+
+def send_alert_digest():
+    """Scheduled job: send every queued alert as one Notification Log per user, with bulk ToDos"""
+    pending = frappe.db.sql("""
+        SELECT name, reference_doctype, reference_name, notify_roles, todo_priority, subject, message
+        FROM `tabHD Alert Notification`
+        ORDER BY creation
+        LIMIT %s
+        FOR UPDATE
+    """, (DIGEST_LIMIT,), as_dict=True)
+
+    if not pending:
+        return
+
+    role_users = get_role_users()
+
+    # Latest notification per user and document; repeated alerts on one document coalesce
+    per_user = {}
+    for row in pending:
+        users = {user for role in (row.notify_roles or "").split("\n") for user in role_users.get(role, [])}
+        for user in users:
+            per_user.setdefault(user, {})[(row.reference_doctype, row.reference_name)] = row
+
+    try:
+        insert_digest_notifications(per_user)
+        insert_alert_todos(per_user)
+        share_alert_documents(per_user)
+
+        frappe.db.sql("DELETE FROM `tabHD Alert Notification` WHERE name IN %s", ([row.name for row in pending],))
+        frappe.db.commit()
+    except Exception as e:
+        frappe.db.rollback()
+        frappe.log_error(f"Error sending stock alert digest: {str(e)}", "Stock Alert Notification")
+        return
+
+    for user in per_user:
+        frappe.publish_realtime("notification", user=user)
+
+
+def insert_digest_notifications(per_user):
+    """One Notification Log per user listing every alert queued for them"""
+    timestamp = now()
+    values = []
+
+    for user, alerts in per_user.items():
+        rows = list(alerts.values())
+        single = rows[0] if len(rows) == 1 else None
+
+        values.append((
+            frappe.generate_hash(length=10), timestamp, timestamp, "Administrator", "Administrator",
+            single.subject if single else f"{len(rows)} stock and batch alerts need attention",
+            single.message if single else "<ul>{0}</ul>".format("".join(
+                f"<li><b>{escape_html(row.subject or '')}</b>: {escape_html(row.message or '')}</li>" for row in rows)),
+            user, "Alert",
+            single.reference_doctype if single else None,
+            single.reference_name if single else None,
+            0,
+        ))
+
+    for i in range(0, len(values), DIGEST_CHUNK_SIZE):
+        frappe.db.bulk_insert("Notification Log", [
+            "name", "creation", "modified", "owner", "modified_by",
+            "subject", "email_content", "for_user", "type",
+            "document_type", "document_name", "read",
+        ], values[i:i + DIGEST_CHUNK_SIZE])
+
+
+def insert_alert_todos(per_user):
+    """Bulk ToDos for alerts that need action, skipping users who already hold an open one"""
+    wanted = [(user, row) for user, alerts in per_user.items() for row in alerts.values() if row.todo_priority]
+    if not wanted:
+        return
+
+    references = sorted({row.reference_name for _, row in wanted})
+    existing = set()
+    for i in range(0, len(references), DIGEST_CHUNK_SIZE):
+        existing.update(frappe.db.sql("""
+            SELECT reference_type, reference_name, allocated_to
+            FROM `tabToDo`
+            WHERE status = 'Open'
+            AND reference_name IN %s
+        """, (references[i:i + DIGEST_CHUNK_SIZE],)))
+
+    timestamp = now()
+    values = []
+    assignees = {}
+
+    for user, row in wanted:
+        reference = (row.reference_doctype, row.reference_name)
+        if reference + (user,) in existing:
+            continue
+
+        assignees.setdefault(reference, []).append(user)
+        values.append((
+            frappe.generate_hash(length=10), timestamp, timestamp, "Administrator", "Administrator",
+            "Open", row.todo_priority, nowdate(), user, row.message,
+            row.reference_doctype, row.reference_name, "Stock Manager", "Administrator",
+        ))
+
+    for i in range(0, len(values), DIGEST_CHUNK_SIZE):
+        frappe.db.bulk_insert("ToDo", [
+            "name", "creation", "modified", "owner", "modified_by",
+            "status", "priority", "date", "allocated_to", "description",
+            "reference_type", "reference_name", "role", "assigned_by",
+        ], values[i:i + DIGEST_CHUNK_SIZE])
+
+    update_assignments(list(assignees))
+
+
+def update_assignments(references):
+    """Refresh the _assign list of each document from its open ToDos"""
+    for doctype in {reference_doctype for reference_doctype, _ in references}:
+        names = [name for reference_doctype, name in references if reference_doctype == doctype]
+        assigned = {}
+        for name, user in frappe.db.sql("""
+            SELECT reference_name, allocated_to
+            FROM `tabToDo`
+            WHERE status = 'Open'
+            AND reference_type = %s
+            AND reference_name IN %s
+            ORDER BY creation
+        """, (doctype, names)):
+            assigned.setdefault(name, []).append(user)
+
+        # Documents with the same assignees share one UPDATE
+        by_assignees = {}
+        for name, users in assigned.items():
+            by_assignees.setdefault(json.dumps(users), []).append(name)
+
+        for assign, group in by_assignees.items():
+            frappe.db.sql("UPDATE `tab{0}` SET `_assign` = %s WHERE name IN %s".format(doctype), (assign, group))
+
+
+def share_alert_documents(per_user):
+    """Share each notified document with its recipients, skipping existing shares"""
+    wanted = {(row.reference_doctype, row.reference_name, user)
+        for user, alerts in per_user.items() for row in alerts.values()}
+
+    names = sorted({name for _, name, _ in wanted})
+    existing = set()
+    for i in range(0, len(names), DIGEST_CHUNK_SIZE):
+        existing.update(frappe.db.sql("""
+            SELECT share_doctype, share_name, user
+            FROM `tabDocShare`
+            WHERE share_name IN %s
+        """, (names[i:i + DIGEST_CHUNK_SIZE],)))
+
+    timestamp = now()
+    values = [(
+        frappe.generate_hash(length=10), timestamp, timestamp, "Administrator", "Administrator",
+        user, doctype, name, 1, 0, 0, 0, 0, 1,
+    ) for doctype, name, user in sorted(wanted - existing)]
+
+    for i in range(0, len(values), DIGEST_CHUNK_SIZE):
+        frappe.db.bulk_insert("DocShare", [
+            "name", "creation", "modified", "owner", "modified_by",
+            "user", "share_doctype", "share_name",
+            "read", "write", "share", "submit", "everyone", "notify",
+        ], values[i:i + DIGEST_CHUNK_SIZE])
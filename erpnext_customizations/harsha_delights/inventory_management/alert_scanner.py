@@ -0,0 +1,358 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+"""Set-based scanner for HD Stock Alert.
+
+Each scan is one query that anti-joins its candidates against alerts that
+are still open, so nothing already alerted is read back. Open alerts carry a
+dedupe key (a hash of alert family, item, warehouse and batch) under a
+unique index; the anti-join is an index lookup on that key, and new alerts
+are written with multi-row INSERT IGNORE, so two overlapping scans cannot
+both create the same alert. Alert documents are built in memory only to
+reuse HDStockAlert's message, level and suggested action logic.
+Notifications for new alerts are queued for the alert digest in one
+multi-row insert per run. Every scan reports its duration and row counts.
+
+The scheduler runs the cheap Bin-driven scans every 15 minutes and all scans
+as a daily deep scan, which adds batch expiry and overstock detection. A
+Redis lock keeps runs from overlapping across bench workers, and every
+scheduled run is recorded in HD Stock Alert Scan Log.
+"""
+
+import hashlib
+import json
+import time
+
+import frappe
+import numpy as np
+from frappe.utils import add_days, cint, flt, getdate, now, nowdate
+
+from erpnext_customizations.inventory_management.alert_notifications import queue_stock_alerts
+from erpnext_customizations.inventory_management.expiry_calendar import get_expiring_warehouses
+from erpnext_customizations.inventory_management.stock_velocity import days_of_cover, get_sales_velocity
+
+ALERT_DOCTYPE = "HD Stock Alert"
+OPEN_STATUSES = ("Open", "Acknowledged", "In Progress")
+EXPIRY_WARNING_DAYS = 30
+
+# Days of cover above which stock is reported as High Stock; site config hd_overstock_cover_days overrides it
+OVERSTOCK_COVER_DAYS = 120
+
+# Alert types that share one open alert per item, warehouse and batch
+DEDUPE_FAMILIES = {
+    "Expiry Warning": "Expiry",
+    "Expired Stock": "Expiry",
+}
+INSERT_CHUNK_SIZE = 1000
+
+SCAN_LOG_DOCTYPE = "HD Stock Alert Scan Log"
+SCAN_LOCK_KEY = "hd_stock_alert_scan_lock"
+
+# A crashed worker releases the lock after this many seconds
+SCAN_LOCK_TIMEOUT = 30 * 60
+
+ALERT_FIELDS = [
+    "alert_type", "item_code", "item_name", "warehouse", "batch_id", "dedupe_key",
+    "alert_date", "alert_level", "status",
+    "current_stock", "minimum_stock", "maximum_stock", "reorder_level", "reorder_qty",
+    "expiry_date", "days_to_expiry", "potential_loss_value",
+    "suggested_action", "alert_message",
+]
+
+
+def alert_dedupe_key(alert_type, item_code, warehouse, batch_id=None):
+    """Key shared by every open alert of the same family for an item, warehouse and batch"""
+    family = DEDUPE_FAMILIES.get(alert_type, alert_type)
+    return hashlib.md5("|".join([family, item_code or "", warehouse or "", batch_id or ""]).encode()).hexdigest()
+
+
+def _dedupe_key_sql(family, item_code, warehouse, batch_id="''"):
+    """SQL expression matching alert_dedupe_key for the given column expressions"""
+    return "MD5(CONCAT_WS('|', '{0}', COALESCE({1}, ''), COALESCE({2}, ''), COALESCE({3}, '')))".format(
+        family, item_code, warehouse, batch_id)
+
+
+def run_alert_scan(scans=None):
+    """Run the given scans (all by default), queue their notifications and return per-scan reports"""
+    scans = scans or list(SCANS)
+    reports = []
+    created = []
+
+    for scan in scans:
+        started = time.monotonic()
+        rows_read = _session_rows_read()
+        candidates = SCANS[scan]()
+        rows_scanned = _session_rows_read() - rows_read
+        names = insert_alerts(candidates)
+        created.extend(names)
+
+        reports.append({
+            "scan": scan,
+            "rows_scanned": rows_scanned,
+            "candidates": len(candidates),
+            "alerts_created": len(names),
+            "duration": round(time.monotonic() - started, 3),
+        })
+
+    if created:
+        queue_stock_alerts(created)
+
+    return reports
+
+
+def _session_rows_read():
+    """Rows read by the storage engine in this database session so far"""
+    return sum(int(value) for _, value in frappe.db.sql("SHOW SESSION STATUS LIKE 'Handler_read%'"))
+
+
+def run_frequent_alert_scan():
+    """Scheduled every 15 minutes: the Bin-driven scans"""
+    return run_locked_alert_scan("Frequent", FREQUENT_SCANS)
+
+
+def run_deep_alert_scan():
+    """Scheduled daily: every scan, including batch expiry"""
+    return run_locked_alert_scan("Deep", list(SCANS))
+
+
+def run_locked_alert_scan(scan_mode, scans):
+    """Run scans under the scan lock and record the run; returns the HD Stock Alert Scan Log name"""
+    started_at = now()
+    started = time.monotonic()
+    log = {"scan_mode": scan_mode, "started_at": started_at}
+
+    token = _acquire_scan_lock()
+    if not token:
+        log.update(status="Skipped", error="Another stock alert scan was still running")
+        return _record_scan(log)
+
+    try:
+        reports = run_alert_scan(scans)
+        frappe.db.commit()
+        log.update(
+            status="Completed",
+            rows_scanned=sum(report["rows_scanned"] for report in reports),
+            candidates=sum(report["candidates"] for report in reports),
+            alerts_created=sum(report["alerts_created"] for report in reports),
+            scan_details=json.dumps(reports, indent=1),
+        )
+    except Exception:
+        frappe.db.rollback()
+        log.update(status="Failed", error=frappe.get_traceback())
+        frappe.log_error(f"Stock alert {scan_mode.lower()} scan failed:\n{log['error']}", "Stock Alert Scan")
+    finally:
+        _release_scan_lock(token)
+
+    log["duration"] = round(time.monotonic() - started, 3)
+    return _record_scan(log)
+
+
+def _acquire_scan_lock():
+    """Take the cross-worker scan lock; returns its token, or None if another run holds it"""
+    cache = frappe.cache()
+    token = frappe.generate_hash(length=16)
+    if cache.set(cache.make_key(SCAN_LOCK_KEY), token, nx=True, ex=SCAN_LOCK_TIMEOUT):
+        return token
+    return None
+
+
+def _release_scan_lock(token):
+    """Release the scan lock unless it expired and was taken by another run"""
+    cache = frappe.cache()
+    key = cache.make_key(SCAN_LOCK_KEY)
+    if frappe.safe_decode(cache.get(key) or b"") == token:
+        cache.delete(key)
+
+
+def _record_scan(log):
+    scan_log = frappe.get_doc(dict(log, doctype=SCAN_LOG_DOCTYPE))
+    scan_log.insert(ignore_permissions=True)
+    frappe.db.commit()
+    return scan_log.name
+
+
+def scan_low_stock():
+    """Bins at or below their forecast (else Item Reorder) level without an open Low Stock alert"""
+    rows = frappe.db.sql("""
+        SELECT b.item_code, i.item_name, b.warehouse, b.actual_qty,
+            COALESCE(NULLIF(f.reorder_level, 0), ir.warehouse_reorder_level) AS reorder_level,
+            COALESCE(NULLIF(f.reorder_qty, 0), ir.warehouse_reorder_qty) AS reorder_qty
+        FROM `tabBin` b
+        INNER JOIN `tabItem` i ON i.name = b.item_code
+        LEFT JOIN `tabItem Reorder` ir ON ir.parent = b.item_code AND ir.warehouse = b.warehouse
+        LEFT JOIN `tabHD Reorder Forecast` f ON f.item_code = b.item_code AND f.warehouse = b.warehouse
+        LEFT JOIN `tabHD Stock Alert` a ON a.dedupe_key = {0}
+        WHERE COALESCE(NULLIF(f.reorder_level, 0), ir.warehouse_reorder_level) > 0
+        AND b.actual_qty <= COALESCE(NULLIF(f.reorder_level, 0), ir.warehouse_reorder_level)
+        AND a.name IS NULL
+    """.format(_dedupe_key_sql("Low Stock", "b.item_code", "b.warehouse")), as_dict=True)
+
+    return [{
+        "alert_type": "Low Stock",
+        "item_code": row.item_code,
+        "item_name": row.item_name,
+        "warehouse": row.warehouse,
+        "current_stock": row.actual_qty,
+        "minimum_stock": row.reorder_level,
+        "reorder_level": row.reorder_level,
+        "reorder_qty": row.reorder_qty,
+    } for row in rows]
+
+
+def scan_expiring_batches():
+    """Batches with stock expiring within the warning window, or already Expired, without an open expiry alert"""
+    today = getdate(nowdate())
+    params = {"today": today, "warning_until": add_days(today, EXPIRY_WARNING_DAYS)}
+
+    # Today's expiry calendar narrows the scan to warehouses that hold expiring stock
+    warehouse_condition = ""
+    warehouses = get_expiring_warehouses(today)
+    if warehouses is not None:
+        if not warehouses:
+            return []
+        warehouse_condition = " AND bm.warehouse IN %(warehouses)s"
+        params["warehouses"] = tuple(warehouses)
+
+    rows = frappe.db.sql("""
+        SELECT bm.name AS batch_id, bm.item, bm.item_name, bm.warehouse, bm.expiry_date,
+            bm.available_qty, bm.unit_cost,
+            DATEDIFF(bm.expiry_date, %(today)s) AS days_to_expiry
+        FROM `tabHD Batch Master` bm
+        LEFT JOIN `tabHD Stock Alert` a ON a.dedupe_key = {0}
+        WHERE bm.status IN ('Active', 'Expired')
+        AND bm.expiry_date <= %(warning_until)s
+        AND bm.available_qty > 0{1}
+        AND a.name IS NULL
+    """.format(_dedupe_key_sql("Expiry", "bm.item", "bm.warehouse", "bm.name"), warehouse_condition),
+        params, as_dict=True)
+
+    return [{
+        "alert_type": "Expired Stock" if row.days_to_expiry <= 0 else "Expiry Warning",
+        "item_code": row.item,
+        "item_name": row.item_name,
+        "warehouse": row.warehouse,
+        "batch_id": row.batch_id,
+        "current_stock": row.available_qty,
+        "expiry_date": row.expiry_date,
+        "days_to_expiry": row.days_to_expiry,
+        "potential_loss_value": flt(row.available_qty) * flt(row.unit_cost),
+    } for row in rows]
+
+
+def scan_negative_stock():
+    """Bins with negative stock without an open Negative Stock alert"""
+    rows = frappe.db.sql("""
+        SELECT b.item_code, i.item_name, b.warehouse, b.actual_qty
+        FROM `tabBin` b
+        INNER JOIN `tabItem` i ON i.name = b.item_code
+        LEFT JOIN `tabHD Stock Alert` a ON a.dedupe_key = {0}
+        WHERE b.actual_qty < 0
+        AND a.name IS NULL
+    """.format(_dedupe_key_sql("Negative Stock", "b.item_code", "b.warehouse")), as_dict=True)
+
+    return [{
+        "alert_type": "Negative Stock",
+        "item_code": row.item_code,
+        "item_name": row.item_name,
+        "warehouse": row.warehouse,
+        "current_stock": row.actual_qty,
+    } for row in rows]
+
+
+def scan_high_stock():
+    """Bins holding more days of cover at their rolling sales velocity than the overstock threshold"""
+    cover_days = flt(frappe.conf.get("hd_overstock_cover_days") or OVERSTOCK_COVER_DAYS)
+
+    bins = frappe.db.sql("""
+        SELECT b.item_code, i.item_name, b.warehouse, b.actual_qty, b.valuation_rate
+        FROM `tabBin` b
+        INNER JOIN `tabItem` i ON i.name = b.item_code
+        LEFT JOIN `tabHD Stock Alert` a ON a.dedupe_key = {0}
+        WHERE b.actual_qty > 0
+        AND i.disabled = 0
+        AND a.name IS NULL
+    """.format(_dedupe_key_sql("High Stock", "b.item_code", "b.warehouse")), as_dict=True)
+
+    if not bins:
+        return []
+
+    velocity = get_sales_velocity([(row.item_code, row.warehouse) for row in bins])
+    qty = np.array([flt(row.actual_qty) for row in bins])
+    cover = days_of_cover(qty, velocity)
+
+    candidates = []
+    for i in np.flatnonzero(cover > cover_days):
+        row = bins[i]
+        maximum_stock = round(float(velocity[i]) * cover_days, 3)
+        candidates.append({
+            "alert_type": "High Stock",
+            "item_code": row.item_code,
+            "item_name": row.item_name,
+            "warehouse": row.warehouse,
+            "current_stock": row.actual_qty,
+            "maximum_stock": maximum_stock,
+            "potential_loss_value": (flt(row.actual_qty) - maximum_stock) * flt(row.valuation_rate),
+        })
+
+    return candidates
+
+
+SCANS = {
+    "low_stock": scan_low_stock,
+    "expiring_batches": scan_expiring_batches,
+    "negative_stock": scan_negative_stock,
+    "high_stock": scan_high_stock,
+}
+
+# Scans whose inputs change within the day; expiry and sales velocity are only rescanned daily
+FREQUENT_SCANS = ["low_stock", "negative_stock"]
+
+
+def build_alert_values(alert_data, timestamp):
+    """Field values of a new alert, derived with HDStockAlert's own validate helpers"""
+    alert = frappe.get_doc(dict(alert_data, doctype=ALERT_DOCTYPE, alert_date=timestamp, status="Open"))
+    alert.dedupe_key = alert_dedupe_key(alert.alert_type, alert.item_code, alert.warehouse, alert.batch_id)
+    alert.set_alert_message()
+    alert.calculate_suggested_actions()
+    alert.set_alert_level()
+    return [alert.get(field) for field in ALERT_FIELDS]
+
+
+def insert_alerts(candidates):
+    """Multi-row INSERT IGNORE of new open alerts; returns the names that were actually inserted"""
+    if not candidates:
+        return []
+
+    timestamp = now()
+    user = frappe.session.user
+    names = _reserve_alert_names(len(candidates))
+    values = [[name, timestamp, timestamp, user, user] + build_alert_values(candidate, timestamp)
+        for name, candidate in zip(names, candidates)]
+
+    for i in range(0, len(values), INSERT_CHUNK_SIZE):
+        frappe.db.bulk_insert(ALERT_DOCTYPE, ["name", "creation", "modified", "owner", "modified_by"] + ALERT_FIELDS,
+            values[i:i + INSERT_CHUNK_SIZE], ignore_duplicates=True)
+
+    # Rows skipped on a duplicate dedupe key were created by an overlapping scan
+    inserted = set()
+    for i in range(0, len(names), INSERT_CHUNK_SIZE):
+        inserted.update(frappe.get_all(ALERT_DOCTYPE,
+            filters={"name": ["in", names[i:i + INSERT_CHUNK_SIZE]]}, pluck="name"))
+
+    return [name for name in names if name in inserted]
+
+
+def _reserve_alert_names(count):
+    """Reserve `count` consecutive names from the HD Stock Alert naming series in one step"""
+    today = getdate(nowdate())
+    prefix = f"ALERT-{today.year}-{today.month:02d}-{today.day:02d}-"
+
+    current = frappe.db.sql("SELECT `current` FROM `tabSeries` WHERE name = %s FOR UPDATE", prefix)
+    if current:
+        start = cint(current[0][0])
+        frappe.db.sql("UPDATE `tabSeries` SET `current` = %s WHERE name = %s", (start + count, prefix))
+    else:
+        start = 0
+        frappe.db.sql("INSERT INTO `tabSeries` (name, `current`) VALUES (%s, %s)", (prefix, count))
+
+    return [f"{prefix}{str(start + i).zfill(5)}" for i in range(1, count + 1)]
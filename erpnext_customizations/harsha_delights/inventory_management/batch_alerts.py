@@ -0,0 +1,50 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+"""Debounced, asynchronous alerts raised by HD Batch Master saves.
+
+A save only raises an alert when it changes something the alert depends
+on, for example crossing into the expiry window or a downgrade to a
+failing quality grade. Building and queueing the notification runs in a
+background job after the save commits. That job takes a Redis key per
+(batch, alert type) pair that expires after BATCH_ALERT_WINDOW, so a pair
+notifies at most once per window however often the batch is saved, and a
+save that rolls back never claims the window.
+"""
+
+import frappe
+
+DEBOUNCE_KEY = "hd_batch_alert"
+
+# Seconds during which a batch raises each alert type at most once
+BATCH_ALERT_WINDOW = 24 * 60 * 60
+
+
+def enqueue_batch_alerts(batch, alert_types):
+    """Queue a batch's alerts for the job that runs once the save commits"""
+    frappe.enqueue(
+        "erpnext_customizations.inventory_management.batch_alerts.emit_batch_alerts",
+        queue="short",
+        enqueue_after_commit=True,
+        batch=batch,
+        alert_types=alert_types
+    )
+
+
+def take_alert_window(batch, alert_type):
+    """Claim the (batch, alert type) debounce key; False when it already fired within the window"""
+    cache = frappe.cache()
+    return bool(cache.set(cache.make_key(f"{DEBOUNCE_KEY}::{batch}::{alert_type}"), 1, nx=True, ex=BATCH_ALERT_WINDOW))
+
+
+def emit_batch_alerts(batch, alert_types):
+    """Background job: send the batch's alerts that still apply and have not fired within the window"""
+    try:
+        doc = frappe.get_doc("HD Batch Master", batch)
+        for alert_type in alert_types:
+            if doc.alert_applies(alert_type) and take_alert_window(batch, alert_type):
+                doc.send_alert(alert_type)
+    except frappe.DoesNotExistError:
+        pass
+    except Exception as e:
+        frappe.log_error(f"Error sending alerts for batch {batch}: {str(e)}", "Batch Master Notification Error")
@@ -0,0 +1,191 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+"""First-expiry-first-out allocation across HD Batch Master batches.
+
+Open batches (Active, unexpired, with stock) are loaded for every requested
+item and warehouse in one query and kept in a heap per (item, warehouse),
+ordered by expiry date, then manufacturing date. Demand is drawn from the
+top of the heap until it is met, so a quantity larger than any single batch
+is split across batches in FEFO order. Quarantine, Expired, Rejected and
+Consumed batches never enter the index.
+
+When allocations are consumed the batch rows are loaded with SELECT ... FOR
+UPDATE, so concurrent allocators queue up behind each other instead of
+drawing the same stock twice, and each draw goes through the guarded
+decrement in batch_consumption.
+"""
+
+import heapq
+
+import frappe
+from frappe.utils import cint, flt, getdate, nowdate
+
+from erpnext_customizations.inventory_management.batch_consumption import (
+    QTY_TOLERANCE, decrement_batch_qty, insert_consumption_logs, make_log_row
+)
+
+BATCH_DOCTYPE = "HD Batch Master"
+
+
+class OpenBatchIndex:
+    """Heap of open batches per (item, warehouse), earliest expiry first"""
+
+    def __init__(self, batches):
+        self.batches = {}
+        self.heaps = {}
+
+        for batch in batches:
+            self.batches[batch.name] = batch
+            self.heaps.setdefault((batch.item, batch.warehouse), []).append(
+                (getdate(batch.expiry_date), getdate(batch.manufacturing_date), batch.name))
+
+        for heap in self.heaps.values():
+            heapq.heapify(heap)
+
+    def allocate(self, item, warehouse, qty):
+        """Draw qty from the earliest-expiring batches; returns (allocations, shortfall)"""
+        heap = self.heaps.get((item, warehouse), [])
+        remaining = flt(qty)
+        allocations = []
+
+        while remaining > QTY_TOLERANCE and heap:
+            batch = self.batches[heap[0][2]]
+            take = min(flt(batch.available_qty), remaining)
+
+            allocations.append(frappe._dict(
+                batch_id=batch.name,
+                item=batch.item,
+                warehouse=batch.warehouse,
+                expiry_date=batch.expiry_date,
+                qty=take,
+            ))
+
+            batch.available_qty = flt(batch.available_qty) - take
+            remaining -= take
+
+            if batch.available_qty <= QTY_TOLERANCE:
+                heapq.heappop(heap)
+
+        return allocations, max(remaining, 0)
+
+
+def load_open_batches(item_warehouses, for_update=False):
+    """Build the FEFO index for the given (item, warehouse) pairs with one query"""
+    item_warehouses = sorted(set(item_warehouses))
+    if not item_warehouses:
+        return OpenBatchIndex([])
+
+    batches = frappe.db.sql("""
+        SELECT name, item, warehouse, expiry_date, manufacturing_date, available_qty
+        FROM `tabHD Batch Master`
+        WHERE status = 'Active'
+        AND expiry_date > %s
+        AND available_qty > 0
+        AND (item, warehouse) IN ({0})
+        ORDER BY name
+        {1}
+    """.format(", ".join(["(%s, %s)"] * len(item_warehouses)), "FOR UPDATE" if for_update else ""),
+        [nowdate()] + [value for pair in item_warehouses for value in pair], as_dict=True)
+
+    return OpenBatchIndex(batches)
+
+
+def consume_allocations(allocations, consumption_type="Sale", reference_type=None, reference_name=None):
+    """Decrement allocated batches and write their consumption logs"""
+    logs = []
+
+    for allocation in allocations:
+        row = decrement_batch_qty(allocation.batch_id, allocation.qty)
+        logs.append(make_log_row(row, allocation.qty, consumption_type,
+            reference_type=allocation.get("reference_type") or reference_type,
+            reference_name=allocation.get("reference_name") or reference_name))
+
+    insert_consumption_logs(logs)
+
+
+@frappe.whitelist()
+def allocate_batches(item, warehouse, qty, consume=0, consumption_type="Sale",
+        reference_type=None, reference_name=None, allow_partial=0):
+    """Split a quantity of an item in a warehouse across open batches, earliest expiry first"""
+    qty = flt(qty)
+    consume = cint(consume)
+
+    if qty <= 0:
+        frappe.throw("Allocation quantity must be greater than zero")
+
+    frappe.has_permission(BATCH_DOCTYPE, "write" if consume else "read", throw=True)
+
+    index = load_open_batches([(item, warehouse)], for_update=consume)
+    allocations, shortfall = index.allocate(item, warehouse, qty)
+
+    if shortfall > QTY_TOLERANCE and not cint(allow_partial):
+        frappe.throw(f"Cannot allocate {qty} of {item} in {warehouse}. Only {qty - shortfall} available in active batches")
+
+    if consume and allocations:
+        consume_allocations(allocations, consumption_type, reference_type, reference_name)
+
+    return {
+        "success": True,
+        "allocations": allocations,
+        "allocated_qty": qty - shortfall,
+        "shortfall": shortfall
+    }
+
+
+@frappe.whitelist()
+def allocate_sales_orders(sales_orders, consume=0):
+    """Allocate every pending line of many Sales Orders in one pass.
+
+    Orders are served by delivery date, so the earliest-expiring stock goes
+    to the earliest deliveries. Lines that cannot be fully covered get a
+    partial allocation and report their shortfall.
+    """
+    sales_orders = frappe.parse_json(sales_orders) if isinstance(sales_orders, str) else sales_orders
+    consume = cint(consume)
+
+    if not sales_orders:
+        frappe.throw("No Sales Orders to allocate")
+
+    frappe.has_permission(BATCH_DOCTYPE, "write" if consume else "read", throw=True)
+
+    lines = frappe.db.sql("""
+        SELECT so.name AS sales_order, soi.name AS so_detail, soi.item_code, soi.warehouse,
+            soi.stock_qty - soi.delivered_qty * soi.conversion_factor AS pending_qty
+        FROM `tabSales Order Item` soi
+        INNER JOIN `tabSales Order` so ON so.name = soi.parent
+        WHERE so.name IN ({0})
+        AND so.docstatus = 1
+        AND soi.stock_qty > soi.delivered_qty * soi.conversion_factor
+        ORDER BY so.delivery_date, so.name, soi.idx
+    """.format(", ".join(["%s"] * len(sales_orders))), list(sales_orders), as_dict=True)
+
+    index = load_open_batches([(line.item_code, line.warehouse) for line in lines], for_update=consume)
+
+    results = {}
+    consumed = []
+    for line in lines:
+        allocations, shortfall = index.allocate(line.item_code, line.warehouse, line.pending_qty)
+        for allocation in allocations:
+            allocation.reference_type = "Sales Order"
+            allocation.reference_name = line.sales_order
+        consumed.extend(allocations)
+
+        results.setdefault(line.sales_order, []).append({
+            "so_detail": line.so_detail,
+            "item_code": line.item_code,
+            "warehouse": line.warehouse,
+            "pending_qty": flt(line.pending_qty),
+            "allocations": allocations,
+            "shortfall": shortfall
+        })
+
+    if consume and consumed:
+        consume_allocations(consumed, "Sale")
+
+    return {
+        "success": True,
+        "orders": results,
+        "fully_allocated": [order for order, order_lines in results.items()
+            if all(line["shortfall"] <= QTY_TOLERANCE for line in order_lines)]
+    }
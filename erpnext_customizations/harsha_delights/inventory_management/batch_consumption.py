@@ -0,0 +1,147 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+"""Atomic HD Batch Master quantity movements.
+
+Consumption decrements with one guarded statement,
+``UPDATE ... SET available_qty = available_qty - qty WHERE available_qty >= qty``,
+which also flips an emptied batch to Consumed. Two concurrent consumers can
+therefore never both draw the last units, and neither loses the other's
+update. The consumption log is written with a direct insert in the same
+transaction, so a consumption no longer re-runs the batch's validate and
+on_update (Item lookups, alert fan-out) or the log's own validate. Each
+logged consumption and each reversal also appends to the batch ledger.
+"""
+
+import frappe
+from frappe.utils import flt, now, nowdate
+
+from erpnext_customizations.inventory_management.batch_ledger import post_ledger_entries
+
+BATCH_DOCTYPE = "HD Batch Master"
+LOG_DOCTYPE = "HD Batch Consumption Log"
+
+# Quantities below this are treated as fully consumed
+QTY_TOLERANCE = 1e-6
+
+LOG_FIELDS = [
+    "batch_id", "item_code", "item_name", "warehouse",
+    "consumption_date", "consumption_type", "qty_consumed", "remaining_qty",
+    "reference_type", "reference_name", "consumed_by",
+    "unit_rate", "total_value", "batch_expiry_date", "consumption_notes",
+]
+
+
+def decrement_batch_qty(batch, qty):
+    """Take qty from a batch if enough is available; returns the batch row after the update"""
+    qty = flt(qty)
+    if qty <= 0:
+        frappe.throw("Consumption quantity must be greater than zero")
+
+    frappe.db.sql("""
+        UPDATE `tabHD Batch Master`
+        SET available_qty = available_qty - %s,
+            status = IF(available_qty <= %s, 'Consumed', status),
+            modified = %s,
+            modified_by = %s
+        WHERE name = %s
+        AND available_qty >= %s
+    """, (qty, QTY_TOLERANCE, now(), frappe.session.user, batch, qty - QTY_TOLERANCE))
+
+    updated = frappe.db.sql("SELECT ROW_COUNT()")[0][0]
+    row = get_batch_row(batch)
+
+    if not row:
+        frappe.throw(f"Batch {batch} does not exist")
+
+    if not updated:
+        frappe.throw(f"Cannot consume {qty}. Only {flt(row.available_qty)} available in batch {batch}")
+
+    return row
+
+
+def restore_batch_qty(batch, qty, voucher_type=None, voucher_no=None):
+    """Return qty to a batch, reactivating it if it had been consumed; returns the updated row"""
+    frappe.db.sql("""
+        UPDATE `tabHD Batch Master`
+        SET available_qty = available_qty + %s,
+            status = IF(status = 'Consumed' AND available_qty > %s, 'Active', status),
+            modified = %s,
+            modified_by = %s
+        WHERE name = %s
+    """, (flt(qty), QTY_TOLERANCE, now(), frappe.session.user, batch))
+
+    row = get_batch_row(batch)
+    post_ledger_entries([{
+        "batch_id": batch,
+        "item": row.item,
+        "warehouse": row.warehouse,
+        "entry_type": "Reversal",
+        "qty_change": flt(qty),
+        "balance_qty": row.available_qty,
+        "voucher_type": voucher_type,
+        "voucher_no": voucher_no,
+    }])
+
+    return row
+
+
+def get_batch_row(batch):
+    return frappe.db.get_value(BATCH_DOCTYPE, batch, [
+        "name", "item", "item_name", "warehouse", "expiry_date", "unit_cost", "available_qty", "status",
+    ], as_dict=True)
+
+
+def make_log_row(batch_row, qty, consumption_type="Sale", reference_type=None, reference_name=None,
+        consumption_date=None, remaining_qty=None, notes=None):
+    """Consumption log values for a batch row fetched from HD Batch Master"""
+    return frappe._dict(
+        batch_id=batch_row.name,
+        item_code=batch_row.item,
+        item_name=batch_row.item_name,
+        warehouse=batch_row.warehouse,
+        consumption_date=consumption_date or nowdate(),
+        consumption_type=consumption_type,
+        qty_consumed=flt(qty),
+        remaining_qty=flt(batch_row.available_qty) if remaining_qty is None else flt(remaining_qty),
+        reference_type=reference_type,
+        reference_name=reference_name,
+        consumed_by=frappe.session.user,
+        unit_rate=flt(batch_row.unit_cost),
+        total_value=flt(qty) * flt(batch_row.unit_cost),
+        batch_expiry_date=batch_row.expiry_date,
+        consumption_notes=notes,
+    )
+
+
+def insert_consumption_logs(logs):
+    """Multi-row insert of consumption logs built with make_log_row, with their ledger entries; returns their names"""
+    timestamp = now()
+    user = frappe.session.user
+    names = [frappe.generate_hash(length=10) for _ in logs]
+
+    frappe.db.bulk_insert(LOG_DOCTYPE, ["name", "creation", "modified", "owner", "modified_by"] + LOG_FIELDS,
+        [[name, timestamp, timestamp, user, user] + [log.get(field) for field in LOG_FIELDS]
+            for name, log in zip(names, logs)])
+
+    post_ledger_entries([{
+        "batch_id": log.batch_id,
+        "item": log.item_code,
+        "warehouse": log.warehouse,
+        "entry_type": "Consumption",
+        "qty_change": -flt(log.qty_consumed),
+        "balance_qty": log.remaining_qty,
+        "voucher_type": LOG_DOCTYPE,
+        "voucher_no": name,
+    } for name, log in zip(names, logs)])
+
+    return names
+
+
+def consume_batch(batch, qty, consumption_type="Sale", reference_type=None, reference_name=None, notes=None):
+    """Decrement a batch and log the consumption in the current transaction"""
+    row = decrement_batch_qty(batch, qty)
+    log = insert_consumption_logs([make_log_row(row, qty, consumption_type,
+        reference_type=reference_type, reference_name=reference_name, notes=notes)])[0]
+
+    return frappe._dict(log=log, remaining_qty=flt(row.available_qty), status=row.status)
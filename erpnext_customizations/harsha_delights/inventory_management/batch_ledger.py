@@ -0,0 +1,144 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+"""Batch-level stock ledger for HD Batch Master.
+
+Every change to a batch's available quantity appends an HD Batch Ledger Entry
+carrying the signed change and the batch's balance after it. The entry is
+written in the same transaction as the change, and because that
+transaction holds the batch row lock, running balances follow the order in
+which changes were applied.
+
+A daily job checkpoints each batch's balance in HD Batch Balance Snapshot, so
+balance_as_of() reads the latest snapshot at or before the requested time
+and replays only the short tail of entries after it. A reconciliation job
+compares the ledger with available_qty on the batches.
+"""
+
+import frappe
+from frappe.utils import add_to_date, flt, get_datetime, now, now_datetime
+
+LEDGER_DOCTYPE = "HD Batch Ledger Entry"
+SNAPSHOT_DOCTYPE = "HD Batch Balance Snapshot"
+LEDGER_CHUNK_SIZE = 1000
+
+# Snapshots stop short of now so entries of transactions still in flight are not skipped
+SNAPSHOT_LAG_MINUTES = 10
+
+# Differences below this are rounding noise, not ledger drift
+RECONCILE_TOLERANCE = 1e-6
+
+
+def post_ledger_entries(entries):
+    """Append ledger entries (batch_id, item, warehouse, entry_type, qty_change, balance_qty, voucher_type, voucher_no)"""
+    timestamp = now()
+    user = frappe.session.user
+
+    values = [(
+        frappe.generate_hash(length=10), timestamp, timestamp, user, user,
+        entry["batch_id"], entry.get("item"), entry.get("warehouse"), timestamp,
+        entry["entry_type"], flt(entry["qty_change"]), flt(entry["balance_qty"]),
+        entry.get("voucher_type"), entry.get("voucher_no"),
+    ) for entry in entries]
+
+    for i in range(0, len(values), LEDGER_CHUNK_SIZE):
+        frappe.db.bulk_insert(LEDGER_DOCTYPE, [
+            "name", "creation", "modified", "owner", "modified_by",
+            "batch_id", "item", "warehouse", "posting_datetime",
+            "entry_type", "qty_change", "balance_qty",
+            "voucher_type", "voucher_no",
+        ], values[i:i + LEDGER_CHUNK_SIZE])
+
+
+def snapshot_batch_balances():
+    """Daily job: checkpoint the balance of every batch with entries since its last snapshot"""
+    snapshot_time = add_to_date(now_datetime(), minutes=-SNAPSHOT_LAG_MINUTES)
+    timestamp = now()
+
+    frappe.db.sql("""
+        INSERT INTO `tab{0}`
+            (name, creation, modified, owner, modified_by, batch_id, snapshot_time, balance_qty)
+        SELECT
+            MD5(CONCAT(l.batch_id, '::', %(snapshot_time)s)),
+            %(timestamp)s, %(timestamp)s, %(user)s, %(user)s,
+            l.batch_id, %(snapshot_time)s,
+            COALESCE(MAX(s.balance_qty), 0) + SUM(l.qty_change)
+        FROM `tab{1}` l
+        LEFT JOIN (
+            SELECT snap.batch_id, snap.snapshot_time, snap.balance_qty
+            FROM `tab{0}` snap
+            INNER JOIN (
+                SELECT batch_id, MAX(snapshot_time) AS snapshot_time
+                FROM `tab{0}`
+                GROUP BY batch_id
+            ) latest ON latest.batch_id = snap.batch_id AND latest.snapshot_time = snap.snapshot_time
+        ) s ON s.batch_id = l.batch_id
+        WHERE l.posting_datetime > COALESCE(s.snapshot_time, '1900-01-01')
+        AND l.posting_datetime <= %(snapshot_time)s
+        GROUP BY l.batch_id
+    """.format(SNAPSHOT_DOCTYPE, LEDGER_DOCTYPE), {
+        "snapshot_time": snapshot_time,
+        "timestamp": timestamp,
+        "user": frappe.session.user,
+    })
+
+    frappe.db.commit()
+
+
+@frappe.whitelist()
+def balance_as_of(batch, ts=None):
+    """Ledger balance of a batch at a point in time: latest snapshot plus tail replay"""
+    frappe.has_permission(LEDGER_DOCTYPE, "read", throw=True)
+
+    ts = get_datetime(ts) if ts else now_datetime()
+
+    snapshot = frappe.db.sql("""
+        SELECT snapshot_time, balance_qty
+        FROM `tabHD Batch Balance Snapshot`
+        WHERE batch_id = %s
+        AND snapshot_time <= %s
+        ORDER BY snapshot_time DESC
+        LIMIT 1
+    """, (batch, ts), as_dict=True)
+
+    since = snapshot[0].snapshot_time if snapshot else get_datetime("1900-01-01")
+    tail = frappe.db.sql("""
+        SELECT COALESCE(SUM(qty_change), 0)
+        FROM `tabHD Batch Ledger Entry`
+        WHERE batch_id = %s
+        AND posting_datetime > %s
+        AND posting_datetime <= %s
+    """, (batch, since, ts))[0][0]
+
+    return flt(snapshot[0].balance_qty if snapshot else 0) + flt(tail)
+
+
+def reconcile_batch_ledger():
+    """Daily job: report batches whose ledger balance differs from available_qty"""
+    mismatches = frappe.db.sql("""
+        SELECT b.name AS batch_id, b.available_qty,
+            COALESCE(s.balance_qty, 0) + COALESCE(SUM(l.qty_change), 0) AS ledger_qty
+        FROM `tabHD Batch Master` b
+        LEFT JOIN (
+            SELECT snap.batch_id, snap.snapshot_time, snap.balance_qty
+            FROM `tab{0}` snap
+            INNER JOIN (
+                SELECT batch_id, MAX(snapshot_time) AS snapshot_time
+                FROM `tab{0}`
+                GROUP BY batch_id
+            ) latest ON latest.batch_id = snap.batch_id AND latest.snapshot_time = snap.snapshot_time
+        ) s ON s.batch_id = b.name
+        LEFT JOIN `tab{1}` l
+            ON l.batch_id = b.name
+            AND l.posting_datetime > COALESCE(s.snapshot_time, '1900-01-01')
+        GROUP BY b.name, b.available_qty, s.balance_qty
+        HAVING ABS(b.available_qty - ledger_qty) > %s
+    """.format(SNAPSHOT_DOCTYPE, LEDGER_DOCTYPE), (RECONCILE_TOLERANCE,), as_dict=True)
+
+    if mismatches:
+        details = "\n".join(f"{row.batch_id}: available {flt(row.available_qty)}, ledger {flt(row.ledger_qty)}"
+            for row in mismatches[:200])
+        frappe.log_error(f"{len(mismatches)} batches differ from the batch ledger:\n{details}",
+            "Batch Ledger Reconciliation")
+
+    return mismatches
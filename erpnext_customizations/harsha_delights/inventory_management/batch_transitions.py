@@ -0,0 +1,75 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+"""Nightly set-based HD Batch Master status transitions.
+
+HDBatchMaster.set_default_status only expires a batch when it is saved, so
+batches past their expiry date stayed Active. This job moves them in two
+statements. Active batches with nothing left are closed as Consumed. Active
+and Quarantine batches at or past their expiry date become Expired. Both
+statements are range predicates served by the (status, expiry_date,
+available_qty) index. One summary notification goes to stock and quality
+managers instead of an alert per batch.
+
+run_nightly_batch_jobs runs the transitions, then the expiry calendar
+refresh, then the deep alert scan, so both read the day's statuses. Expired
+batches that still hold stock remain visible to the expiry scan, so Expired
+Stock alerts still fire for them.
+"""
+
+import frappe
+from frappe.utils import flt, fmt_money, getdate, now, nowdate
+
+from erpnext_customizations.inventory_management.alert_notifications import notify_roles
+from erpnext_customizations.inventory_management.alert_scanner import run_deep_alert_scan
+from erpnext_customizations.inventory_management.batch_consumption import QTY_TOLERANCE
+from erpnext_customizations.inventory_management.expiry_calendar import refresh_expiry_calendar
+
+SUMMARY_ROLES = ["Stock Manager", "Quality Manager"]
+
+
+def run_nightly_batch_jobs():
+    """Daily job: transition batch statuses, then rebuild the expiry calendar, then run the deep alert scan"""
+    transition_batch_statuses()
+    refresh_expiry_calendar()
+    run_deep_alert_scan()
+
+
+def transition_batch_statuses():
+    """Close emptied batches, expire due ones and send one summary"""
+    today = getdate(nowdate())
+    timestamp = now()
+    user = frappe.session.user
+
+    frappe.db.sql("""
+        UPDATE `tabHD Batch Master`
+        SET status = 'Consumed', modified = %s, modified_by = %s
+        WHERE status = 'Active'
+        AND available_qty <= %s
+    """, (timestamp, user, QTY_TOLERANCE))
+    consumed = frappe.db.sql("SELECT ROW_COUNT()")[0][0]
+
+    batch_count, qty, value = frappe.db.sql("""
+        SELECT COUNT(*), COALESCE(SUM(available_qty), 0), COALESCE(SUM(available_qty * unit_cost), 0)
+        FROM `tabHD Batch Master`
+        WHERE status IN ('Active', 'Quarantine')
+        AND expiry_date <= %s
+    """, (today,))[0]
+
+    frappe.db.sql("""
+        UPDATE `tabHD Batch Master`
+        SET status = 'Expired', modified = %s, modified_by = %s
+        WHERE status IN ('Active', 'Quarantine')
+        AND expiry_date <= %s
+    """, (timestamp, user, today))
+    expired = frappe.db.sql("SELECT ROW_COUNT()")[0][0]
+
+    if expired or consumed:
+        notify_roles(SUMMARY_ROLES,
+            f"Batch status update: {expired} expired, {consumed} consumed",
+            f"{expired} batches reached their expiry date and were marked Expired, holding {flt(qty)} units "
+            f"worth {fmt_money(value)}. {consumed} Active batches with no remaining quantity were marked Consumed.")
+
+    frappe.db.commit()
+
+    return {"expired": expired, "consumed": consumed, "expired_qty": flt(qty), "expired_value": flt(value)}
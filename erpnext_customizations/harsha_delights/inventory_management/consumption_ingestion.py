@@ -0,0 +1,180 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+"""Bulk ingestion of batch consumption events from JSONL or CSV streams.
+
+Events are processed in chunks. Each chunk locks and prefetches the batches
+it refers to in one query, validates every event against that snapshot
+(running per-batch totals, so two events cannot overdraw the same batch),
+writes the accepted logs with a multi-row insert and applies one net
+decrement per batch. Rejected events are reported with their line number
+instead of failing the whole stream.
+
+Event fields: batch_id, qty_consumed, and optionally consumption_type
+(default Sale), consumption_date, reference_type, reference_name and notes.
+"""
+
+import csv
+import io
+import json
+
+import frappe
+from frappe.utils import flt, getdate, nowdate
+
+from erpnext_customizations.inventory_management.batch_consumption import (
+    LOG_DOCTYPE, QTY_TOLERANCE, decrement_batch_qty, insert_consumption_logs, make_log_row
+)
+
+INGEST_CHUNK_SIZE = 5000
+MAX_REPORTED_ERRORS = 1000
+
+CONSUMPTION_TYPES = ("Sale", "Production", "WriteOff", "Quality Test", "Sample", "Return", "Transfer")
+REFERENCE_TYPES = ("Sales Invoice", "Sales Order", "Delivery Note", "Stock Entry", "Work Order", "Quality Inspection")
+
+
+def read_events(stream, file_format="jsonl"):
+    """Yield (line number, event dict) from a text stream of JSONL or CSV"""
+    if file_format == "csv":
+        for line_no, row in enumerate(csv.DictReader(stream), start=2):
+            yield line_no, row
+        return
+
+    if file_format != "jsonl":
+        frappe.throw(f"Unsupported consumption event format '{file_format}'. Use jsonl or csv")
+
+    for line_no, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except ValueError:
+            yield line_no, None
+
+
+def ingest_consumption_events(events, chunk_size=INGEST_CHUNK_SIZE):
+    """Validate and apply (line number, event) pairs chunk by chunk; returns a report"""
+    report = {"received": 0, "ingested": 0, "rejected": 0, "batches_updated": 0, "errors": []}
+    chunk = []
+
+    for line_no, event in events:
+        chunk.append((line_no, event))
+        if len(chunk) >= chunk_size:
+            _ingest_chunk(chunk, report)
+            chunk = []
+
+    if chunk:
+        _ingest_chunk(chunk, report)
+
+    return report
+
+
+def _ingest_chunk(chunk, report):
+    report["received"] += len(chunk)
+
+    batch_ids = sorted({event.get("batch_id") for _, event in chunk if isinstance(event, dict) and event.get("batch_id")})
+    snapshot = {}
+    if batch_ids:
+        for row in frappe.db.sql("""
+            SELECT name, item, item_name, warehouse, expiry_date, unit_cost, available_qty, status
+            FROM `tabHD Batch Master`
+            WHERE name IN ({0})
+            FOR UPDATE
+        """.format(", ".join(["%s"] * len(batch_ids))), batch_ids, as_dict=True):
+            snapshot[row.name] = row
+
+    remaining = {name: flt(row.available_qty) for name, row in snapshot.items()}
+    net = {}
+    logs = []
+
+    for line_no, event in chunk:
+        error = _validate_event(event, snapshot, remaining)
+        if error:
+            report["rejected"] += 1
+            if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                report["errors"].append({"line": line_no, "error": error})
+            continue
+
+        batch_id = event["batch_id"]
+        qty = flt(event["qty_consumed"])
+        remaining[batch_id] -= qty
+        net[batch_id] = net.get(batch_id, 0) + qty
+
+        logs.append(make_log_row(snapshot[batch_id], qty,
+            consumption_type=event.get("consumption_type") or "Sale",
+            reference_type=event.get("reference_type") or None,
+            reference_name=event.get("reference_name") or None,
+            consumption_date=getdate(event.get("consumption_date") or nowdate()),
+            remaining_qty=remaining[batch_id],
+            notes=event.get("notes") or None))
+
+    if logs:
+        insert_consumption_logs(logs)
+
+    for batch_id, qty in net.items():
+        decrement_batch_qty(batch_id, qty)
+
+    frappe.db.commit()
+
+    report["ingested"] += len(logs)
+    report["batches_updated"] += len(net)
+
+
+def _validate_event(event, snapshot, remaining):
+    if not isinstance(event, dict):
+        return "Not a valid consumption event"
+
+    batch_id = event.get("batch_id")
+    if not batch_id:
+        return "batch_id is required"
+
+    if batch_id not in snapshot:
+        return f"Batch {batch_id} does not exist"
+
+    try:
+        qty = float(event.get("qty_consumed") or 0)
+    except (TypeError, ValueError):
+        return f"Invalid qty_consumed '{event.get('qty_consumed')}'"
+
+    if qty <= 0:
+        return "qty_consumed must be greater than zero"
+
+    if qty > remaining[batch_id] + QTY_TOLERANCE:
+        return f"Cannot consume {qty}. Only {remaining[batch_id]} available in batch {batch_id}"
+
+    consumption_type = event.get("consumption_type") or "Sale"
+    if consumption_type not in CONSUMPTION_TYPES:
+        return f"Unsupported consumption_type '{consumption_type}'"
+
+    reference_type = event.get("reference_type")
+    if reference_type and reference_type not in REFERENCE_TYPES:
+        return f"Unsupported reference_type '{reference_type}'"
+
+    if event.get("consumption_date"):
+        try:
+            getdate(event["consumption_date"])
+        except Exception:
+            return f"Invalid consumption_date '{event['consumption_date']}'"
+
+    return None
+
+
+@frappe.whitelist()
+def ingest_consumption(events=None, content=None, file_format="jsonl"):
+    """Ingest consumption events posted as a JSON list or as JSONL/CSV text"""
+    frappe.has_permission(LOG_DOCTYPE, "create", throw=True)
+
+    if events is not None:
+        events = frappe.parse_json(events) if isinstance(events, str) else events
+        if not isinstance(events, list):
+            frappe.throw("events must be a list of consumption events")
+        stream = enumerate(events, start=1)
+    elif content:
+        stream = read_events(io.StringIO(content), file_format)
+    else:
+        frappe.throw("Provide either events or content to ingest")
+
+    report = ingest_consumption_events(stream)
+    report["success"] = True
+    report["message"] = f"Ingested {report['ingested']} of {report['received']} consumption events"
+    return report
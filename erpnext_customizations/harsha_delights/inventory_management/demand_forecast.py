@@ -0,0 +1,218 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+"""Forecast-driven reorder levels for every stock item and warehouse.
+
+Weekly outflows from Stock Ledger Entry are loaded into one dense
+(item-warehouse x week) NumPy matrix. Festival weeks, the run-up to Diwali
+by default, are set apart: each SKU's festival uplift is its mean demand in
+festival weeks over its mean demand in the other weeks. Demand with the
+uplift divided out is fitted with damped-trend exponential smoothing, one
+vectorized update per week across all SKUs. Forecasts over the lead time
+put the uplift back for festival weeks that fall inside it.
+
+Safety stock is z x the standard deviation of one-week-ahead forecast
+errors, scaled by the square root of the lead time in weeks. The reorder
+level is lead time demand plus safety stock, and the reorder quantity
+covers ORDER_COVER_DAYS of forecast demand. Results are upserted into HD
+Reorder Forecast, which the low stock scan prefers over static Item
+Reorder levels.
+"""
+
+import math
+
+import frappe
+import numpy as np
+from frappe.utils import add_days, flt, getdate, now, nowdate
+
+FORECAST_DOCTYPE = "HD Reorder Forecast"
+HISTORY_WEEKS = 104
+WRITE_CHUNK_SIZE = 1000
+
+# Damped-trend smoothing parameters
+ALPHA = 0.3
+BETA = 0.05
+PHI = 0.9
+
+# z-score for a 95% cycle service level
+SERVICE_LEVEL_Z = 1.65
+
+DEFAULT_LEAD_TIME_DAYS = 7
+ORDER_COVER_DAYS = 30
+
+# Days before a festival during which demand builds up
+FESTIVAL_LEAD_DAYS = 21
+MAX_FESTIVAL_UPLIFT = 5.0
+
+# Diwali dates; site config hd_festival_dates (a list of dates) replaces them
+FESTIVAL_DATES = (
+    "2023-11-12", "2024-11-01", "2025-10-20", "2026-11-08", "2027-10-29", "2028-10-17",
+)
+
+
+def get_festival_dates():
+    return [getdate(d) for d in (frappe.conf.get("hd_festival_dates") or FESTIVAL_DATES)]
+
+
+def festival_week_mask(week_ends, festival_dates):
+    """True for weeks (given by their last day) overlapping a festival or its run-up"""
+    return np.array([
+        any(week_end >= add_days(festival, -FESTIVAL_LEAD_DAYS) and add_days(week_end, -6) <= festival
+            for festival in festival_dates)
+        for week_end in week_ends
+    ], dtype=bool)
+
+
+def festival_uplift(demand, mask):
+    """Per-row ratio of mean festival-week demand to mean demand in other weeks"""
+    uplift = np.ones(demand.shape[0])
+    if not mask.any() or mask.all():
+        return uplift
+
+    festival = demand[:, mask].mean(axis=1)
+    regular = demand[:, ~mask].mean(axis=1)
+    np.divide(festival, regular, out=uplift, where=(regular > 0) & (festival > 0))
+    return np.clip(uplift, 1 / MAX_FESTIVAL_UPLIFT, MAX_FESTIVAL_UPLIFT)
+
+
+def smooth_demand(demand, alpha=ALPHA, beta=BETA, phi=PHI):
+    """Damped-trend exponential smoothing of every row; returns level, trend and one-step error std"""
+    level = demand[:, :4].mean(axis=1)
+    trend = np.zeros(demand.shape[0])
+    errors = np.empty((demand.shape[0], demand.shape[1] - 1))
+
+    for week in range(1, demand.shape[1]):
+        predicted = level + phi * trend
+        errors[:, week - 1] = demand[:, week] - predicted
+        new_level = alpha * demand[:, week] + (1 - alpha) * predicted
+        trend = beta * (new_level - level) + (1 - beta) * phi * trend
+        level = new_level
+
+    return level, trend, errors.std(axis=1)
+
+
+def horizon_demand(level, trend, season, days, phi=PHI):
+    """Forecast demand over the next `days` (per row) and the season-weighted share of each week"""
+    weeks = season.shape[1]
+    damping = np.cumsum(phi ** np.arange(1, weeks + 1))
+    weekly = np.maximum(level[:, None] + trend[:, None] * damping[None, :], 0) * season
+
+    # Fraction of each future week inside the horizon; the last week may be partial
+    weights = np.clip(days[:, None] / 7.0 - np.arange(weeks)[None, :], 0, 1)
+    return (weekly * weights).sum(axis=1), (season * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+
+
+def forecast_reorder_levels(demand, lead_time_days, min_order_qty, history_mask, future_mask):
+    """Vectorized forecast for every row of a weekly demand matrix (oldest week first)"""
+    uplift = festival_uplift(demand, history_mask)
+    adjusted = demand / np.where(history_mask[None, :], uplift[:, None], 1.0)
+    level, trend, sigma = smooth_demand(adjusted)
+
+    season = np.where(future_mask[None, :], uplift[:, None], 1.0)
+    lead_demand, lead_season = horizon_demand(level, trend, season, lead_time_days)
+    cover_demand, _ = horizon_demand(level, trend, season, np.full(len(level), float(ORDER_COVER_DAYS)))
+
+    safety_stock = SERVICE_LEVEL_Z * sigma * lead_season * np.sqrt(lead_time_days / 7.0)
+    return {
+        "daily_demand": lead_demand / lead_time_days,
+        "weekly_demand_std": sigma,
+        "festival_uplift": uplift,
+        "safety_stock": safety_stock,
+        "reorder_level": lead_demand + safety_stock,
+        "reorder_qty": np.maximum(cover_demand, min_order_qty),
+    }
+
+
+def load_weekly_demand(today, weeks=HISTORY_WEEKS):
+    """Stock item bins with outflows in the window and their weekly demand matrix"""
+    bins = frappe.db.sql("""
+        SELECT b.item_code, b.warehouse, i.lead_time_days, i.min_order_qty
+        FROM `tabBin` b
+        INNER JOIN `tabItem` i ON i.name = b.item_code
+        WHERE i.is_stock_item = 1
+        AND i.disabled = 0
+    """, as_dict=True)
+
+    index = {(row.item_code, row.warehouse): i for i, row in enumerate(bins)}
+    demand = np.zeros((len(bins), weeks), dtype=np.float64)
+
+    rows = frappe.db.sql("""
+        SELECT item_code, warehouse, FLOOR(DATEDIFF(%(today)s, posting_date) / 7) AS week_age, SUM(-actual_qty)
+        FROM `tabStock Ledger Entry`
+        WHERE is_cancelled = 0
+        AND actual_qty < 0
+        AND voucher_type != 'Stock Reconciliation'
+        AND posting_date > DATE_SUB(%(today)s, INTERVAL %(days)s DAY)
+        AND posting_date <= %(today)s
+        GROUP BY item_code, warehouse, week_age
+    """, {"today": today, "days": weeks * 7})
+
+    positions, columns, qtys = [], [], []
+    for item_code, warehouse, week_age, qty in rows:
+        position = index.get((item_code, warehouse))
+        if position is not None:
+            positions.append(position)
+            columns.append(weeks - 1 - int(week_age))
+            qtys.append(qty)
+
+    np.add.at(demand, (np.array(positions, dtype=np.int64), np.array(columns, dtype=np.int64)),
+        np.array(qtys, dtype=np.float64))
+
+    active = np.flatnonzero(demand.sum(axis=1) > 0)
+    return [bins[i] for i in active], demand[active]
+
+
+def refresh_reorder_forecasts():
+    """Daily job: forecast demand and upsert suggested reorder levels for every active bin"""
+    today = getdate(nowdate())
+    bins, demand = load_weekly_demand(today)
+
+    if bins:
+        festivals = get_festival_dates()
+        history_mask = festival_week_mask([add_days(today, -7 * age) for age in range(HISTORY_WEEKS - 1, -1, -1)],
+            festivals)
+
+        lead_time_days = np.array([flt(row.lead_time_days) or DEFAULT_LEAD_TIME_DAYS for row in bins])
+        horizon_weeks = math.ceil(max(lead_time_days.max(), ORDER_COVER_DAYS) / 7)
+        future_mask = festival_week_mask([add_days(today, 7 * week) for week in range(1, horizon_weeks + 1)],
+            festivals)
+
+        forecast = forecast_reorder_levels(demand, lead_time_days,
+            np.array([flt(row.min_order_qty) for row in bins]), history_mask, future_mask)
+
+        _write_forecasts(bins, lead_time_days, forecast, today)
+
+    # Bins that no longer have demand fall back to their static reorder levels
+    frappe.db.sql("DELETE FROM `tabHD Reorder Forecast` WHERE forecast_date < %s", (today,))
+    frappe.db.commit()
+
+
+def _write_forecasts(bins, lead_time_days, forecast, today):
+    timestamp = now()
+    user = frappe.session.user
+    fields = ["daily_demand", "weekly_demand_std", "festival_uplift", "safety_stock", "reorder_level", "reorder_qty"]
+
+    values = [(
+        frappe.generate_hash(length=10), timestamp, timestamp, user, user,
+        row.item_code, row.warehouse, today, int(lead_time_days[i]),
+    ) + tuple(round(float(forecast[field][i]), 3) for field in fields) for i, row in enumerate(bins)]
+
+    for start in range(0, len(values), WRITE_CHUNK_SIZE):
+        chunk = values[start:start + WRITE_CHUNK_SIZE]
+        frappe.db.sql("""
+            INSERT INTO `tab{0}`
+                (name, creation, modified, owner, modified_by,
+                item_code, warehouse, forecast_date, lead_time_days, {1})
+            VALUES {2}
+            ON DUPLICATE KEY UPDATE
+                modified = VALUES(modified),
+                modified_by = VALUES(modified_by),
+                forecast_date = VALUES(forecast_date),
+                lead_time_days = VALUES(lead_time_days),
+                {3}
+        """.format(
+            FORECAST_DOCTYPE,
+            ", ".join(fields),
+            ", ".join(["(" + ", ".join(["%s"] * len(chunk[0])) + ")"] * len(chunk)),
+            ", ".join(f"{field} = VALUES({field})" for field in fields),
+        ), [value for row in chunk for value in row])
@@ -0,0 +1,9 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+class HDAlertNotification(Document):
+    """Pending stakeholder notification, sent with the next alert digest"""
+    pass
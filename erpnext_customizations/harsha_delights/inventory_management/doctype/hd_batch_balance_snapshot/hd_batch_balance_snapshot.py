@@ -0,0 +1,14 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+class HDBatchBalanceSnapshot(Document):
+    """Periodic checkpoint of a batch's ledger balance"""
+    pass
+
+
+def on_doctype_update():
+    """Point-in-time lookups take the latest snapshot at or before a timestamp"""
+    frappe.db.add_index("HD Batch Balance Snapshot", ["batch_id", "snapshot_time"])
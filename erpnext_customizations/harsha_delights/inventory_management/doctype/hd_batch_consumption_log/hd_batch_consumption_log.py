@@ -5,6 +5,11 @@ import frappe
 from frappe.model.document import Document
 from frappe.utils import flt, nowdate
 
+from erpnext_customizations.inventory_management.batch_consumption import (
+    decrement_batch_qty, get_batch_row, restore_batch_qty
+)
+from erpnext_customizations.inventory_management.batch_ledger import post_ledger_entries
+
 class HDBatchConsumptionLog(Document):
     def validate(self):
         """Validate batch consumption log"""
@@ -14,13 +19,14 @@ class HDBatchConsumptionLog(Document):
         
     def set_batch_details(self):
         """Set batch-related details"""
-        if self.batch_id:
-            batch_doc = frappe.get_doc("HD Batch Master", self.batch_id)
-            self.item_code = batch_doc.item
-            self.item_name = batch_doc.item_name
-            self.warehouse = batch_doc.warehouse
-            self.batch_expiry_date = batch_doc.expiry_date
-            self.unit_rate = batch_doc.unit_cost
+        self.batch_row = get_batch_row(self.batch_id) if self.batch_id else None
+        
+        if self.batch_row:
+            self.item_code = self.batch_row.item
+            self.item_name = self.batch_row.item_name
+            self.warehouse = self.batch_row.warehouse
+            self.batch_expiry_date = self.batch_row.expiry_date
+            self.unit_rate = self.batch_row.unit_cost
             
     def calculate_total_value(self):
         """Calculate total consumption value"""
@@ -28,10 +34,9 @@ class HDBatchConsumptionLog(Document):
         
     def validate_consumption_qty(self):
         """Validate consumption quantity against available quantity"""
-        if self.batch_id:
-            batch_doc = frappe.get_doc("HD Batch Master", self.batch_id)
-            if flt(self.qty_consumed) > flt(batch_doc.available_qty):
-                frappe.throw(f"Cannot consume {self.qty_consumed}. Only {batch_doc.available_qty} available in batch {self.batch_id}")
+        if self.batch_row:
+            if flt(self.qty_consumed) > flt(self.batch_row.available_qty):
+                frappe.throw(f"Cannot consume {self.qty_consumed}. Only {self.batch_row.available_qty} available in batch {self.batch_id}")
                 
     def on_submit(self):
         """Execute after document submission"""
@@ -41,31 +46,24 @@ class HDBatchConsumptionLog(Document):
     def update_batch_quantity(self):
         """Update batch available quantity"""
         if self.batch_id:
-            batch_doc = frappe.get_doc("HD Batch Master", self.batch_id)
-            new_qty = flt(batch_doc.available_qty) - flt(self.qty_consumed)
-            batch_doc.available_qty = new_qty
+            batch_row = decrement_batch_qty(self.batch_id, self.qty_consumed)
             
             # Update remaining quantity in log
-            self.remaining_qty = new_qty
-            
-            # Update batch status if fully consumed
-            if new_qty <= 0:
-                batch_doc.status = "Consumed"
-                
-            batch_doc.save()
+            self.db_set("remaining_qty", batch_row.available_qty)
             
     def create_stock_ledger_entry(self):
-        """Create stock ledger entry for consumption"""
-        try:
-            # This would typically create a stock ledger entry
-            # For now, we'll log the consumption
-            frappe.log_error(
-                f"Batch consumption: {self.batch_id} - {self.qty_consumed} consumed for {self.consumption_type}",
-                "Batch Consumption Tracking"
-            )
-            
-        except Exception as e:
-            frappe.log_error(f"Error creating stock ledger entry: {str(e)}")
+        """Create batch ledger entry for consumption"""
+        if self.batch_id:
+            post_ledger_entries([{
+                "batch_id": self.batch_id,
+                "item": self.item_code,
+                "warehouse": self.warehouse,
+                "entry_type": "Consumption",
+                "qty_change": -flt(self.qty_consumed),
+                "balance_qty": self.remaining_qty,
+                "voucher_type": self.doctype,
+                "voucher_no": self.name
+            }])
             
     def on_cancel(self):
         """Execute when document is cancelled"""
@@ -74,12 +72,4 @@ class HDBatchConsumptionLog(Document):
     def reverse_batch_quantity(self):
         """Reverse batch quantity update"""
         if self.batch_id:
-            batch_doc = frappe.get_doc("HD Batch Master", self.batch_id)
-            new_qty = flt(batch_doc.available_qty) + flt(self.qty_consumed)
-            batch_doc.available_qty = new_qty
-            
-            # Reactivate batch if it was consumed
-            if batch_doc.status == "Consumed" and new_qty > 0:
-                batch_doc.status = "Active"
-                
-            batch_doc.save()
\ No newline at end of file
+            restore_batch_qty(self.batch_id, self.qty_consumed, self.doctype, self.name)
\ No newline at end of file
@@ -0,0 +1,135 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+import threading
+import time
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_days, flt, nowdate
+
+from erpnext.stock.doctype.item.test_item import make_item
+from erpnext_customizations.inventory_management.batch_consumption import consume_batch
+
+WORKERS = 8
+START_QTY = 10
+CONSUME_QTY = 3
+
+# Consumptions per worker in the throughput comparison
+ROUNDS = 25
+
+# Guarded-UPDATE consumptions per second must beat load/subtract/save by at least this factor
+MIN_SPEEDUP = 2
+
+def consume_by_save(batch, qty):
+    """The previous consumption path: load the batch, subtract in Python, save, then insert the log"""
+    doc = frappe.get_doc("HD Batch Master", batch)
+    if flt(qty) > flt(doc.available_qty):
+        frappe.throw(f"Cannot consume {qty}. Only {doc.available_qty} available in batch")
+
+    doc.available_qty = flt(doc.available_qty) - flt(qty)
+    if doc.available_qty <= 0:
+        doc.status = "Consumed"
+    doc.save()
+
+    frappe.get_doc({
+        "doctype": "HD Batch Consumption Log",
+        "batch_id": batch,
+        "consumption_date": nowdate(),
+        "qty_consumed": qty,
+        "consumption_type": "Sale",
+        "consumed_by": frappe.session.user
+    }).insert(ignore_permissions=True)
+
+class TestHDBatchConsumptionLog(FrappeTestCase):
+    def setUp(self):
+        self.item = make_item("_Test HD Contention Item", {"is_stock_item": 1}).name
+        self.batches = []
+
+    def tearDown(self):
+        for batch in self.batches:
+            frappe.db.delete("HD Batch Consumption Log", {"batch_id": batch})
+            frappe.db.delete("HD Batch Ledger Entry", {"batch_id": batch})
+            frappe.db.delete("HD Batch Master", {"name": batch})
+        frappe.db.commit()
+
+    def make_batch(self, qty):
+        batch = frappe.get_doc({
+            "doctype": "HD Batch Master",
+            "batch_id": "_T-HD-CONTENTION-" + frappe.generate_hash(length=6),
+            "item": self.item,
+            "warehouse": "_Test Warehouse - _TC",
+            "manufacturing_date": nowdate(),
+            "expiry_date": add_days(nowdate(), 30),
+            "batch_qty": qty,
+            "available_qty": qty,
+            "status": "Active"
+        }).insert().name
+        self.batches.append(batch)
+
+        # The workers run on their own connections and only see committed rows
+        frappe.db.commit()
+        return batch
+
+    def run_workers(self, consume, batch, qty, rounds=1):
+        """Run WORKERS concurrent consumers on their own connections; returns per-attempt results and seconds taken"""
+        site = frappe.local.site
+        timing = {}
+        start = threading.Barrier(WORKERS, action=lambda: timing.setdefault("start", time.monotonic()))
+        results = []
+
+        def worker():
+            frappe.init(site=site)
+            frappe.connect()
+            try:
+                start.wait()
+                for _ in range(rounds):
+                    try:
+                        consume(batch, qty)
+                        frappe.db.commit()
+                        results.append(True)
+                    except frappe.ValidationError:
+                        frappe.db.rollback()
+                        results.append(False)
+            finally:
+                frappe.destroy()
+
+        threads = [threading.Thread(target=worker) for _ in range(WORKERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return results, time.monotonic() - timing["start"]
+
+    def test_concurrent_consumption_never_overdraws(self):
+        """Concurrent consumers of one batch draw exactly the stock it holds"""
+        batch = self.make_batch(START_QTY)
+        results, _ = self.run_workers(consume_batch, batch, CONSUME_QTY)
+
+        successes = results.count(True)
+        self.assertEqual(len(results), WORKERS)
+        self.assertEqual(successes, START_QTY // CONSUME_QTY)
+        self.assertEqual(results.count(False), WORKERS - successes)
+
+        available_qty = flt(frappe.db.get_value("HD Batch Master", batch, "available_qty"))
+        self.assertEqual(available_qty, START_QTY - successes * CONSUME_QTY)
+        self.assertEqual(frappe.db.count("HD Batch Consumption Log", {"batch_id": batch}), successes)
+
+    def test_guarded_update_outpaces_load_and_save(self):
+        """Guarded-UPDATE consumption sustains several times the throughput of load/subtract/save"""
+        start_qty = WORKERS * ROUNDS
+
+        batch = self.make_batch(start_qty)
+        results, guarded_seconds = self.run_workers(consume_batch, batch, 1, ROUNDS)
+        self.assertEqual(results.count(True), start_qty)
+        self.assertEqual(flt(frappe.db.get_value("HD Batch Master", batch, "available_qty")), 0)
+        guarded_rate = start_qty / guarded_seconds
+
+        # Concurrent saves of one batch fail on the modified timestamp check; only committed ones count
+        batch = self.make_batch(start_qty)
+        results, saved_seconds = self.run_workers(consume_by_save, batch, 1, ROUNDS)
+        saved_rate = results.count(True) / saved_seconds
+
+        self.assertGreaterEqual(guarded_rate, MIN_SPEEDUP * saved_rate,
+            f"Guarded UPDATE ran {guarded_rate:.1f} consumptions/s against {saved_rate:.1f}/s for load and save")
@@ -0,0 +1,15 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+class HDBatchLedgerEntry(Document):
+    """Append-only movement of a batch's available quantity with the running balance"""
+    pass
+
+
+def on_doctype_update():
+    """Tail replay and statements scan a batch's entries by time"""
+    frappe.db.add_index("HD Batch Ledger Entry", ["batch_id", "posting_datetime"])
+    frappe.db.add_index("HD Batch Ledger Entry", ["voucher_type", "voucher_no"])
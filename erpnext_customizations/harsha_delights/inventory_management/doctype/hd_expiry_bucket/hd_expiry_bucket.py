@@ -0,0 +1,14 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+class HDExpiryBucket(Document):
+    """Active batch stock of a warehouse expiring within one bucket, as of a calendar date"""
+    pass
+
+
+def on_doctype_update():
+    """Dashboards and the expiry scan read one calendar date at a time"""
+    frappe.db.add_index("HD Expiry Bucket", ["calendar_date", "warehouse"])
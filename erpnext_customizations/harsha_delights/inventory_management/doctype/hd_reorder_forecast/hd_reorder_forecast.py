@@ -0,0 +1,15 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+class HDReorderForecast(Document):
+    """Forecast-driven reorder level and quantity of an item in a warehouse"""
+    pass
+
+
+def on_doctype_update():
+    """The low stock scan joins forecasts to bins by item and warehouse"""
+    frappe.db.add_unique("HD Reorder Forecast", ["item_code", "warehouse"],
+        constraint_name="unique_item_warehouse")
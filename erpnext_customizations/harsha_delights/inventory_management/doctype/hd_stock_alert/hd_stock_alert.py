@@ -5,10 +5,16 @@ import frappe
 from frappe.model.document import Document
 from frappe.utils import flt, cint, nowdate, getdate, now, add_days
 
+from erpnext_customizations.inventory_management.alert_notifications import queue_stock_alerts
+from erpnext_customizations.inventory_management.alert_scanner import (
+    OPEN_STATUSES, alert_dedupe_key, run_alert_scan, run_deep_alert_scan
+)
+
 class HDStockAlert(Document):
     def validate(self):
         """Validate stock alert data"""
         self.set_item_name()
+        self.set_dedupe_key()
         self.set_alert_message()
         self.calculate_suggested_actions()
         self.set_alert_level()
@@ -18,6 +24,19 @@ class HDStockAlert(Document):
         if self.item_code:
             self.item_name = frappe.db.get_value("Item", self.item_code, "item_name")
             
+    def set_dedupe_key(self):
+        """Hold the dedupe key while the alert is open so only one open alert exists per family, item, warehouse and batch"""
+        if self.status not in OPEN_STATUSES:
+            self.dedupe_key = None
+            return
+            
+        self.dedupe_key = alert_dedupe_key(self.alert_type, self.item_code, self.warehouse, self.batch_id)
+        
+        existing = frappe.db.get_value("HD Stock Alert",
+            {"dedupe_key": self.dedupe_key, "name": ["!=", self.name or ""]}, "name")
+        if existing:
+            frappe.throw(f"An open stock alert {existing} already exists for {self.item_code} in {self.warehouse}")
+            
     def set_alert_message(self):
         """Generate appropriate alert message"""
         messages = {
@@ -36,8 +55,8 @@ class HDStockAlert(Document):
         """Calculate suggested actions based on alert type"""
         if self.alert_type == "Low Stock" or self.alert_type == "Zero Stock":
             self.suggested_action = "Purchase Order"
-            if self.reorder_level and self.current_stock <= self.reorder_level:
-                # Calculate reorder quantity
+            if self.reorder_level and self.current_stock <= self.reorder_level and not flt(self.reorder_qty):
+                # Calculate reorder quantity when no forecast or Item Reorder quantity was given
                 self.reorder_qty = max(
                     flt(self.minimum_stock) - flt(self.current_stock),
                     flt(self.minimum_stock) * 0.5  # Safety buffer
@@ -80,83 +99,8 @@ class HDStockAlert(Document):
             self.notify_stakeholders()
             
     def notify_stakeholders(self):
-        """Send notifications to relevant stakeholders"""
-        # Determine who to notify based on alert type
-        roles_to_notify = []
-        
-        if self.alert_type in ["Low Stock", "Zero Stock", "High Stock"]:
-            roles_to_notify = ["Stock Manager", "Purchase Manager"]
-        elif self.alert_type in ["Expiry Warning", "Expired Stock"]:
-            roles_to_notify = ["Stock Manager", "Quality Manager"]
-        elif self.alert_type == "Quality Alert":
-            roles_to_notify = ["Quality Manager", "Production Manager"]
-        elif self.alert_type == "Negative Stock":
-            roles_to_notify = ["Stock Manager", "Accounts Manager"]
-            
-        # Get users with these roles
-        users_to_notify = []
-        for role in roles_to_notify:
-            role_users = frappe.get_all("Has Role", 
-                filters={"role": role},
-                pluck="parent"
-            )
-            users_to_notify.extend(role_users)
-            
-        # Remove duplicates
-        users_to_notify = list(set(users_to_notify))
-        
-        # Create notifications
-        for user in users_to_notify:
-            self.create_notification(user)
-            
-            # Create ToDo for critical/urgent alerts
-            if self.alert_level in ["Critical", "Urgent"]:
-                self.create_todo(user)
-                
-    def create_notification(self, user):
-        """Create notification for user"""
-        try:
-            frappe.share.add("HD Stock Alert", self.name, user, notify=1)
-            
-            # Create notification log
-            frappe.get_doc({
-                "doctype": "Notification Log",
-                "subject": f"Stock Alert: {self.alert_type} - {self.item_name}",
-                "email_content": self.alert_message,
-                "for_user": user,
-                "type": "Alert",
-                "document_type": "HD Stock Alert",
-                "document_name": self.name
-            }).insert(ignore_permissions=True)
-            
-        except Exception as e:
-            frappe.log_error(f"Error creating notification: {str(e)}", "Stock Alert Notification")
-            
-    def create_todo(self, user):
-        """Create ToDo for urgent actions"""
-        try:
-            priority_map = {
-                "Urgent": "High",
-                "Critical": "High", 
-                "Warning": "Medium",
-                "Info": "Low"
-            }
-            
-            todo = frappe.get_doc({
-                "doctype": "ToDo",
-                "description": self.alert_message,
-                "priority": priority_map.get(self.alert_level, "Medium"),
-                "status": "Open",
-                "allocated_to": user,
-                "reference_type": "HD Stock Alert",
-                "reference_name": self.name,
-                "date": nowdate(),
-                "role": "Stock Manager"  # Default role
-            })
-            todo.insert(ignore_permissions=True)
-            
-        except Exception as e:
-            frappe.log_error(f"Error creating ToDo: {str(e)}", "Stock Alert ToDo")
+        """Queue notifications to relevant stakeholders for the next alert digest"""
+        queue_stock_alerts([self.name])
             
     @frappe.whitelist()
     def acknowledge_alert(self, notes=None):
@@ -283,137 +227,28 @@ class HDStockAlert(Document):
         
     @staticmethod
     def create_stock_alerts():
-        """Static method to create stock alerts - called by scheduler"""
-        # Check for low stock alerts
-        HDStockAlert.check_low_stock_levels()
-        
-        # Check for expiry alerts  
-        HDStockAlert.check_expiring_batches()
-        
-        # Check for negative stock
-        HDStockAlert.check_negative_stock()
-        
-        # Check for high stock
-        HDStockAlert.check_high_stock_levels()
+        """Static method to create stock alerts - same locked and logged run as the daily deep scan"""
+        return run_deep_alert_scan()
         
     @staticmethod
     def check_low_stock_levels():
         """Check for items with low stock levels"""
-        items_with_reorder = frappe.db.sql("""
-            SELECT 
-                b.item_code,
-                b.warehouse,
-                b.actual_qty,
-                ir.warehouse_reorder_level,
-                ir.warehouse_reorder_qty,
-                i.item_name
-            FROM `tabBin` b
-            INNER JOIN `tabItem Reorder` ir ON ir.parent = b.item_code AND ir.warehouse = b.warehouse
-            INNER JOIN `tabItem` i ON i.name = b.item_code
-            WHERE b.actual_qty <= ir.warehouse_reorder_level
-            AND ir.warehouse_reorder_level > 0
-        """, as_dict=True)
+        return run_alert_scan(["low_stock"])
         
-        for item in items_with_reorder:
-            # Check if alert already exists
-            existing_alert = frappe.db.exists("HD Stock Alert", {
-                "item_code": item.item_code,
-                "warehouse": item.warehouse,
-                "alert_type": "Low Stock",
-                "status": ["in", ["Open", "Acknowledged", "In Progress"]]
-            })
-            
-            if not existing_alert:
-                HDStockAlert.create_alert({
-                    "alert_type": "Low Stock",
-                    "item_code": item.item_code,
-                    "warehouse": item.warehouse,
-                    "current_stock": item.actual_qty,
-                    "minimum_stock": item.warehouse_reorder_level,
-                    "reorder_qty": item.warehouse_reorder_qty,
-                    "alert_date": now(),
-                    "status": "Open"
-                })
-                
     @staticmethod
     def check_expiring_batches():
         """Check for expiring batches"""
-        expiring_batches = frappe.db.sql("""
-            SELECT 
-                bm.batch_id,
-                bm.item,
-                bm.warehouse,
-                bm.expiry_date,
-                bm.available_qty,
-                bm.unit_cost,
-                DATEDIFF(bm.expiry_date, CURDATE()) as days_to_expiry
-            FROM `tabHD Batch Master` bm
-            WHERE bm.status = 'Active'
-            AND bm.available_qty > 0
-            AND bm.expiry_date IS NOT NULL
-            AND DATEDIFF(bm.expiry_date, CURDATE()) <= 30
-        """, as_dict=True)
+        return run_alert_scan(["expiring_batches"])
         
-        for batch in expiring_batches:
-            alert_type = "Expired Stock" if batch.days_to_expiry <= 0 else "Expiry Warning"
-            
-            # Check if alert already exists
-            existing_alert = frappe.db.exists("HD Stock Alert", {
-                "item_code": batch.item,
-                "warehouse": batch.warehouse,
-                "batch_id": batch.batch_id,
-                "alert_type": ["in", ["Expiry Warning", "Expired Stock"]],
-                "status": ["in", ["Open", "Acknowledged", "In Progress"]]
-            })
-            
-            if not existing_alert:
-                HDStockAlert.create_alert({
-                    "alert_type": alert_type,
-                    "item_code": batch.item,
-                    "warehouse": batch.warehouse,
-                    "batch_id": batch.batch_id,
-                    "current_stock": batch.available_qty,
-                    "expiry_date": batch.expiry_date,
-                    "days_to_expiry": batch.days_to_expiry,
-                    "potential_loss_value": flt(batch.available_qty) * flt(batch.unit_cost),
-                    "alert_date": now(),
-                    "status": "Open"
-                })
-                
     @staticmethod
     def check_negative_stock():
         """Check for negative stock"""
-        negative_stock_items = frappe.db.sql("""
-            SELECT item_code, warehouse, actual_qty
-            FROM `tabBin`
-            WHERE actual_qty < 0
-        """, as_dict=True)
+        return run_alert_scan(["negative_stock"])
         
-        for item in negative_stock_items:
-            # Check if alert already exists
-            existing_alert = frappe.db.exists("HD Stock Alert", {
-                "item_code": item.item_code,
-                "warehouse": item.warehouse,
-                "alert_type": "Negative Stock",
-                "status": ["in", ["Open", "Acknowledged", "In Progress"]]
-            })
-            
-            if not existing_alert:
-                HDStockAlert.create_alert({
-                    "alert_type": "Negative Stock",
-                    "item_code": item.item_code,
-                    "warehouse": item.warehouse,
-                    "current_stock": item.actual_qty,
-                    "alert_date": now(),
-                    "status": "Open"
-                })
-                
     @staticmethod
     def check_high_stock_levels():
-        """Check for items with high stock levels"""
-        # This would typically be based on maximum stock levels or slow-moving analysis
-        # Implementation depends on specific business requirements
-        pass
+        """Check for items with more days of cover than the overstock threshold"""
+        return run_alert_scan(["high_stock"])
         
     @staticmethod
     def create_alert(alert_data):
@@ -0,0 +1,14 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+class HDStockAlertScanLog(Document):
+    """Cost and outcome of one scheduled stock alert scan"""
+    pass
+
+
+def on_doctype_update():
+    """Scan cost is trended per mode over time"""
+    frappe.db.add_index("HD Stock Alert Scan Log", ["scan_mode", "started_at"])
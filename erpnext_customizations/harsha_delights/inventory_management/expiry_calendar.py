@@ -0,0 +1,107 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+"""Daily expiry bucket calendar for HD Batch Master.
+
+Once a day, batch stock that is Active, or Expired but not yet written
+off, is totalled per warehouse into the buckets Expired, 0-3, 4-7 and 8-30
+days to expiry, and stored in HD Expiry Bucket under that day's calendar
+date. Dashboards read these rows instead of scanning batches. The expiry
+scan reads them to narrow its batch query to warehouses that hold expiring
+stock.
+
+Every filter is a range on expiry_date against dates computed up front, so
+the (status, expiry_date, available_qty) index on HD Batch Master can serve
+it. Wrapping the column in DATEDIFF would prevent that.
+"""
+
+import frappe
+from frappe.utils import add_days, getdate, now, nowdate
+
+BUCKET_DOCTYPE = "HD Expiry Bucket"
+REFRESH_KEY = "hd_expiry_calendar_date"
+
+# Last day to expiry covered by each bucket; earlier dates are Expired
+EXPIRY_BUCKETS = (
+    ("0-3 Days", 3),
+    ("4-7 Days", 7),
+    ("8-30 Days", 30),
+)
+
+# Calendar dates kept for trend dashboards
+CALENDAR_RETENTION_DAYS = 400
+
+
+def refresh_expiry_calendar():
+    """Daily job: rewrite today's expiry buckets from batches holding stock"""
+    today = getdate(nowdate())
+    timestamp = now()
+
+    params = {
+        "today": today,
+        "timestamp": timestamp,
+        "user": frappe.session.user,
+        "until": add_days(today, EXPIRY_BUCKETS[-1][1]),
+    }
+    cases = []
+    for i, (bucket, days) in enumerate(EXPIRY_BUCKETS):
+        params[f"bucket_{i}"] = bucket
+        params[f"until_{i}"] = add_days(today, days)
+        cases.append(f"WHEN expiry_date <= %(until_{i})s THEN %(bucket_{i})s")
+
+    frappe.db.sql("DELETE FROM `tab{0}` WHERE calendar_date = %s".format(BUCKET_DOCTYPE), (today,))
+    frappe.db.sql("""
+        INSERT INTO `tab{0}`
+            (name, creation, modified, owner, modified_by,
+            calendar_date, warehouse, bucket,
+            batch_count, item_count, total_qty, total_value, earliest_expiry)
+        SELECT
+            MD5(CONCAT_WS('::', %(today)s, warehouse, bucket)),
+            %(timestamp)s, %(timestamp)s, %(user)s, %(user)s,
+            %(today)s, warehouse, bucket,
+            COUNT(*), COUNT(DISTINCT item), SUM(available_qty), SUM(available_qty * unit_cost), MIN(expiry_date)
+        FROM (
+            SELECT warehouse, item, available_qty, unit_cost, expiry_date,
+                CASE WHEN expiry_date < %(today)s THEN 'Expired' {1} END AS bucket
+            FROM `tabHD Batch Master`
+            WHERE status IN ('Active', 'Expired')
+            AND expiry_date <= %(until)s
+            AND available_qty > 0
+        ) batches
+        GROUP BY warehouse, bucket
+    """.format(BUCKET_DOCTYPE, " ".join(cases)), params)
+
+    frappe.db.sql("DELETE FROM `tab{0}` WHERE calendar_date < %s".format(BUCKET_DOCTYPE),
+        (add_days(today, -CALENDAR_RETENTION_DAYS),))
+
+    # A date without any buckets is only trustworthy once it has been built
+    frappe.db.set_global(REFRESH_KEY, str(today))
+    frappe.db.commit()
+
+
+def get_expiring_warehouses(calendar_date=None):
+    """Warehouses with expiring or expired stock on a calendar date; None when that date was not built"""
+    calendar_date = getdate(calendar_date or nowdate())
+    last_refresh = frappe.db.get_global(REFRESH_KEY)
+    if not last_refresh or getdate(last_refresh) < calendar_date:
+        return None
+
+    return frappe.db.sql_list("""
+        SELECT DISTINCT warehouse
+        FROM `tabHD Expiry Bucket`
+        WHERE calendar_date = %s
+    """, (calendar_date,))
+
+
+@frappe.whitelist()
+def get_expiry_buckets(warehouse=None, calendar_date=None):
+    """Expiry bucket totals for dashboards, for one warehouse or all"""
+    frappe.has_permission(BUCKET_DOCTYPE, "read", throw=True)
+
+    filters = {"calendar_date": getdate(calendar_date or nowdate())}
+    if warehouse:
+        filters["warehouse"] = warehouse
+
+    return frappe.get_all(BUCKET_DOCTYPE, filters=filters,
+        fields=["warehouse", "bucket", "batch_count", "item_count", "total_qty", "total_value", "earliest_expiry"],
+        order_by="warehouse, earliest_expiry")
@@ -0,0 +1,121 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+"""Consolidated Purchase Orders for open Low and Zero Stock alerts.
+
+The alerts are locked and read together with their default suppliers in a
+single query that joins Item Default for the warehouse's company. They are
+grouped by supplier, company and warehouse, and each group becomes one
+multi-line Purchase Order. All source alerts are then moved to In Progress,
+with the Purchase Order noted in action_taken, in one UPDATE.
+"""
+
+import frappe
+from frappe.utils import add_days, flt, getdate, now, nowdate
+
+ALERT_DOCTYPE = "HD Stock Alert"
+PURCHASE_ALERT_TYPES = ("Low Stock", "Zero Stock")
+PURCHASE_ALERT_STATUSES = ("Open", "Acknowledged")
+DEFAULT_LEAD_DAYS = 7
+
+
+@frappe.whitelist()
+def create_consolidated_purchase_orders(alerts=None, delivery_date=None):
+    """One draft Purchase Order per supplier and warehouse covering the given (or all) open purchase alerts"""
+    frappe.has_permission("Purchase Order", "create", throw=True)
+    frappe.has_permission(ALERT_DOCTYPE, "write", throw=True)
+
+    if isinstance(alerts, str):
+        alerts = frappe.parse_json(alerts)
+
+    delivery_date = getdate(delivery_date) if delivery_date else getdate(add_days(nowdate(), DEFAULT_LEAD_DAYS))
+    groups, skipped = get_purchase_groups(alerts)
+
+    purchase_orders = []
+    alert_orders = {}
+
+    for (supplier, company, warehouse), rows in groups.items():
+        po = frappe.get_doc({
+            "doctype": "Purchase Order",
+            "supplier": supplier,
+            "company": company,
+            "schedule_date": delivery_date,
+            "set_warehouse": warehouse,
+            "items": [{
+                "item_code": row.item_code,
+                "qty": flt(row.reorder_qty) or flt(row.minimum_stock),
+                "warehouse": warehouse,
+                "rate": flt(row.last_purchase_rate),
+                "schedule_date": delivery_date
+            } for row in rows]
+        })
+        po.insert()
+
+        purchase_orders.append(po.name)
+        for row in rows:
+            alert_orders[row.name] = po.name
+
+    mark_alerts_in_progress(alert_orders)
+
+    return {
+        "success": True,
+        "purchase_orders": purchase_orders,
+        "skipped": skipped,
+        "message": f"Created {len(purchase_orders)} Purchase Orders for {len(alert_orders)} stock alerts"
+    }
+
+
+def get_purchase_groups(alerts=None):
+    """Lock open purchase alerts and group them by (supplier, company, warehouse); returns groups and skipped alerts"""
+    condition = ""
+    params = {"alert_types": PURCHASE_ALERT_TYPES, "statuses": PURCHASE_ALERT_STATUSES}
+    if alerts:
+        condition = " AND a.name IN %(alerts)s"
+        params["alerts"] = tuple(alerts)
+
+    rows = frappe.db.sql("""
+        SELECT a.name, a.item_code, a.warehouse, a.reorder_qty, a.minimum_stock, a.last_purchase_rate,
+            w.company, idf.default_supplier AS supplier
+        FROM `tabHD Stock Alert` a
+        INNER JOIN `tabWarehouse` w ON w.name = a.warehouse
+        LEFT JOIN `tabItem Default` idf
+            ON idf.parent = a.item_code
+            AND idf.parenttype = 'Item'
+            AND idf.company = w.company
+        WHERE a.alert_type IN %(alert_types)s
+        AND a.status IN %(statuses)s{0}
+        ORDER BY a.item_code
+        FOR UPDATE
+    """.format(condition), params, as_dict=True)
+
+    groups = {}
+    skipped = []
+    for row in rows:
+        if not row.supplier:
+            skipped.append({"alert": row.name, "item_code": row.item_code, "reason": "No default supplier"})
+        elif flt(row.reorder_qty) <= 0 and flt(row.minimum_stock) <= 0:
+            skipped.append({"alert": row.name, "item_code": row.item_code, "reason": "No reorder quantity"})
+        else:
+            groups.setdefault((row.supplier, row.company, row.warehouse), []).append(row)
+
+    return groups, skipped
+
+
+def mark_alerts_in_progress(alert_orders):
+    """Single UPDATE moving alerts to In Progress and noting their Purchase Order"""
+    if not alert_orders:
+        return
+
+    names = list(alert_orders)
+    frappe.db.sql("""
+        UPDATE `tabHD Stock Alert`
+        SET status = 'In Progress',
+            action_taken = CONCAT(COALESCE(action_taken, ''), %s,
+                CASE name {0} END, ' created'),
+            modified = %s,
+            modified_by = %s
+        WHERE name IN %s
+    """.format(" ".join(["WHEN %s THEN %s"] * len(names))),
+        [f"\n{nowdate()}: Purchase Order "]
+        + [value for name in names for value in (name, alert_orders[name])]
+        + [now(), frappe.session.user, tuple(names)])
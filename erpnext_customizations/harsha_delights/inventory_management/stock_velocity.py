@@ -0,0 +1,71 @@
+# Copyright (c) 2024, Harsha Delights and contributors
+# For license information, please see license.txt
+
+"""Rolling sales velocity and days of cover per item and warehouse.
+
+Sales outflows (Delivery Note, Sales Invoice and POS Invoice ledger entries)
+are read from Stock Ledger Entry once for the longest window, grouped by
+day, and scattered into a dense (item-warehouse x day) matrix.
+Velocity over every window is then one cumulative sum over all SKUs at
+once. The fastest window wins, so an item that has started selling again
+is not reported as a slow mover because of an older quiet spell.
+"""
+
+import frappe
+import numpy as np
+
+# Rolling windows (days) the sales velocity is measured over
+VELOCITY_WINDOWS = (30, 90)
+
+# Transfers, manufacturing and other issues are not sales
+SALES_VOUCHER_TYPES = ("Delivery Note", "Sales Invoice", "POS Invoice")
+
+
+def load_daily_outflows(pairs, horizon):
+    """Matrix of sold qty per (item_code, warehouse) pair and day; column 0 is today"""
+    index = {pair: i for i, pair in enumerate(pairs)}
+    outflow = np.zeros((len(pairs), horizon), dtype=np.float64)
+    if not pairs:
+        return outflow
+
+    rows = frappe.db.sql("""
+        SELECT item_code, warehouse, DATEDIFF(CURDATE(), posting_date) AS age, SUM(-actual_qty)
+        FROM `tabStock Ledger Entry`
+        WHERE is_cancelled = 0
+        AND actual_qty < 0
+        AND voucher_type IN %s
+        AND posting_date > DATE_SUB(CURDATE(), INTERVAL %s DAY)
+        AND posting_date <= CURDATE()
+        GROUP BY item_code, warehouse, posting_date
+    """, (SALES_VOUCHER_TYPES, horizon))
+
+    positions, ages, qtys = [], [], []
+    for item_code, warehouse, age, qty in rows:
+        position = index.get((item_code, warehouse))
+        if position is not None:
+            positions.append(position)
+            ages.append(age)
+            qtys.append(qty)
+
+    np.add.at(outflow, (np.array(positions, dtype=np.int64), np.array(ages, dtype=np.int64)),
+        np.array(qtys, dtype=np.float64))
+    return outflow
+
+
+def rolling_velocity(outflow, windows=VELOCITY_WINDOWS):
+    """Highest average daily outflow across the rolling windows, per row"""
+    cumulative = np.cumsum(outflow, axis=1)
+    velocities = np.stack([cumulative[:, window - 1] / window for window in windows], axis=1)
+    return velocities.max(axis=1)
+
+
+def days_of_cover(qty, velocity):
+    """Days the current qty lasts at the given velocity; infinite where nothing moved"""
+    cover = np.full(len(qty), np.inf)
+    np.divide(qty, velocity, out=cover, where=velocity > 0)
+    return cover
+
+
+def get_sales_velocity(pairs, windows=VELOCITY_WINDOWS):
+    """Rolling sales velocity for (item_code, warehouse) pairs, in units per day"""
+    return rolling_velocity(load_daily_outflows(pairs, max(windows)), windows)
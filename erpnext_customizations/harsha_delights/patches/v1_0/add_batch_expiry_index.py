@@ -0,0 +1,13 @@
+import frappe
+
+from erpnext_customizations.inventory_management.expiry_calendar import refresh_expiry_calendar
+
+def execute():
+    """Index HD Batch Master for range scans on expiry date and build today's expiry calendar"""
+
+    frappe.reload_doc("confectionery_production", "doctype", "hd_batch_master")
+    frappe.reload_doc("inventory_management", "doctype", "hd_expiry_bucket")
+
+    frappe.db.add_index("HD Batch Master", ["status", "expiry_date", "available_qty"])
+
+    refresh_expiry_calendar()
@@ -0,0 +1,35 @@
+import frappe
+
+from erpnext_customizations.customer_segmentation.membership_history import OPEN_END
+
+def execute():
+    """Backfill membership intervals from existing segment assignments"""
+
+    frappe.reload_doc("customer_segmentation", "doctype", "hd_segment_membership_history")
+
+    # One interval per assignment; the assignment name doubles as the history name
+    frappe.db.sql("""
+        INSERT IGNORE INTO `tabHD Segment Membership History`
+            (name, creation, modified, owner, modified_by,
+            customer, customer_segment, assignment, valid_from, valid_to, opened_by, closed_by)
+        SELECT
+            a.name, NOW(), NOW(), 'Administrator', 'Administrator',
+            a.customer, a.customer_segment, a.name,
+            COALESCE(a.effective_from, a.assignment_date, DATE(a.creation)),
+            CASE
+                WHEN a.status = 'Active' THEN %s
+                ELSE GREATEST(COALESCE(a.effective_from, a.assignment_date, DATE(a.creation)),
+                    COALESCE(a.effective_to, DATE(a.modified)))
+            END,
+            'Backfill',
+            CASE
+                WHEN a.status = 'Active' THEN NULL
+                WHEN a.status = 'Expired' THEN 'Expired'
+                ELSE 'Deactivated'
+            END
+        FROM `tabHD Customer Segment Assignment` a
+        WHERE a.customer IS NOT NULL
+        AND a.customer_segment IS NOT NULL
+    """, (OPEN_END,))
+
+    frappe.db.commit()
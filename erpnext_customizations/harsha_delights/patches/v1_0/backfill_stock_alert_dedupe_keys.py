@@ -0,0 +1,41 @@
+import frappe
+
+from erpnext_customizations.inventory_management.alert_scanner import OPEN_STATUSES, alert_dedupe_key
+
+def execute():
+    """Set dedupe keys on open stock alerts and close older duplicates"""
+
+    frappe.reload_doc("inventory_management", "doctype", "hd_stock_alert")
+
+    alerts = frappe.db.sql("""
+        SELECT name, alert_type, item_code, warehouse, batch_id
+        FROM `tabHD Stock Alert`
+        WHERE status IN %s
+        AND dedupe_key IS NULL
+        ORDER BY creation DESC
+    """, (OPEN_STATUSES,), as_dict=True)
+
+    # Keys already held by alerts created after this patch was written
+    seen = set(frappe.get_all("HD Stock Alert", filters={"dedupe_key": ["is", "set"]}, pluck="dedupe_key"))
+    duplicates = []
+
+    for alert in alerts:
+        key = alert_dedupe_key(alert.alert_type, alert.item_code, alert.warehouse, alert.batch_id)
+        if key in seen:
+            duplicates.append(alert.name)
+            continue
+
+        seen.add(key)
+        frappe.db.sql("UPDATE `tabHD Stock Alert` SET dedupe_key = %s WHERE name = %s", (key, alert.name))
+
+    # An open alert without its key would fail validation on its next save, so older duplicates are closed
+    if duplicates:
+        frappe.db.sql("""
+            UPDATE `tabHD Stock Alert`
+            SET status = 'Closed',
+                resolution_notes = CONCAT(COALESCE(resolution_notes, ''),
+                    'Closed as a duplicate of a newer open alert for the same item, warehouse and batch')
+            WHERE name IN %s
+        """, (duplicates,))
+
+    frappe.db.commit()
@@ -0,0 +1,42 @@
+import frappe
+from frappe.utils.fixtures import sync_fixtures
+
+from erpnext_customizations.customer_segmentation.bulk_assignment import (
+    resolve_primary_segments, sync_customer_primary_segments
+)
+
+def execute():
+    """Replace per-customer segment Pricing Rules with one rule per segment"""
+
+    # The segment custom fields ship as fixtures, which migrate only syncs after patches run
+    sync_fixtures("erpnext_customizations")
+
+    # Membership lookups filter on the customer's active primary assignment
+    frappe.db.add_index("HD Customer Segment Assignment", ["customer", "status", "is_primary"])
+
+    resolve_primary_segments()
+    sync_customer_primary_segments()
+
+    # Collapse the per-customer rules created by the old assignment hook
+    legacy_rules = frappe.db.sql_list("""
+        SELECT pr.name
+        FROM `tabPricing Rule` pr
+        INNER JOIN `tabHD Customer Segment` s
+            ON pr.name LIKE CONCAT('Segment\\_', s.segment_code, '\\_%%')
+            OR pr.title LIKE CONCAT(s.segment_name, ' - %%')
+        WHERE pr.customer IS NOT NULL AND pr.customer != ''
+    """)
+
+    for i in range(0, len(legacy_rules), 1000):
+        chunk = legacy_rules[i:i + 1000]
+        placeholders = ", ".join(["%s"] * len(chunk))
+        for child_doctype in ["Pricing Rule Item Code", "Pricing Rule Item Group", "Pricing Rule Brand"]:
+            frappe.db.sql(f"DELETE FROM `tab{child_doctype}` WHERE parent IN ({placeholders})", chunk)
+        frappe.db.sql(f"DELETE FROM `tabPricing Rule` WHERE name IN ({placeholders})", chunk)
+
+    print(f"Removed {len(legacy_rules)} per-customer segment pricing rules")
+
+    for segment in frappe.get_all("HD Customer Segment", pluck="name"):
+        frappe.get_doc("HD Customer Segment", segment).sync_segment_pricing_rule()
+
+    frappe.db.commit()
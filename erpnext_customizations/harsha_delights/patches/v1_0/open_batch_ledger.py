@@ -0,0 +1,24 @@
+import frappe
+
+def execute():
+    """Open the batch ledger with the current available quantity of every batch"""
+
+    frappe.reload_doc("inventory_management", "doctype", "hd_batch_ledger_entry")
+
+    # Batches without ledger history start from an Opening entry; the batch name doubles as the entry name
+    frappe.db.sql("""
+        INSERT IGNORE INTO `tabHD Batch Ledger Entry`
+            (name, creation, modified, owner, modified_by,
+            batch_id, item, warehouse, posting_datetime,
+            entry_type, qty_change, balance_qty, voucher_type, voucher_no)
+        SELECT
+            b.name, NOW(), NOW(), 'Administrator', 'Administrator',
+            b.name, b.item, b.warehouse, NOW(),
+            'Opening', b.available_qty, b.available_qty, 'HD Batch Master', b.name
+        FROM `tabHD Batch Master` b
+        WHERE NOT EXISTS (
+            SELECT 1 FROM `tabHD Batch Ledger Entry` l WHERE l.batch_id = b.name
+        )
+    """)
+
+    frappe.db.commit()
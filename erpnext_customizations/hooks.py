@@ -104,34 +104,42 @@ app_license = "MIT"
 # ---------------
 # Hook on document methods and events
 
-# doc_events = {
-# 	"*": {
-# 		"on_update": "method",
-# 		"on_cancel": "method",
-# 		"on_trash": "method"
-#	}
-# }
+doc_events = {
+	"Sales Invoice": {
+		"on_submit": "erpnext_customizations.customer_segmentation.loyalty_ledger.on_sales_invoice_submit",
+		"on_cancel": "erpnext_customizations.customer_segmentation.loyalty_ledger.on_sales_invoice_cancel"
+	},
+	"User": {
+		"on_update": "erpnext_customizations.inventory_management.alert_notifications.clear_role_users_cache",
+		"on_trash": "erpnext_customizations.inventory_management.alert_notifications.clear_role_users_cache"
+	}
+}
 
 # Scheduled Tasks
 # ---------------
 
-# scheduler_events = {
-# 	"all": [
-# 		"erpnext_customizations.tasks.all"
-# 	],
-# 	"daily": [
-# 		"erpnext_customizations.tasks.daily"
-# 	],
-# 	"hourly": [
-# 		"erpnext_customizations.tasks.hourly"
-# 	],
-# 	"weekly": [
-# 		"erpnext_customizations.tasks.weekly"
-# 	],
-# 	"monthly": [
-# 		"erpnext_customizations.tasks.monthly"
-# 	],
-# }
+scheduler_events = {
+	"daily": [
+		"erpnext_customizations.customer_segmentation.item_group_affinity.refresh_item_group_affinity",
+		"erpnext_customizations.customer_segmentation.similarity_index.refresh_similarity_index",
+		"erpnext_customizations.customer_segmentation.segment_ladder.review_segment_assignments",
+		"erpnext_customizations.customer_segmentation.analytics_rollup.refresh_segment_analytics",
+		"erpnext_customizations.inventory_management.batch_ledger.snapshot_batch_balances",
+		"erpnext_customizations.inventory_management.batch_ledger.reconcile_batch_ledger"
+	],
+	"daily_long": [
+		"erpnext_customizations.inventory_management.batch_transitions.run_nightly_batch_jobs",
+		"erpnext_customizations.inventory_management.demand_forecast.refresh_reorder_forecasts"
+	],
+	"cron": {
+		"*/15 * * * *": [
+			"erpnext_customizations.inventory_management.alert_scanner.run_frequent_alert_scan"
+		],
+		"*/5 * * * *": [
+			"erpnext_customizations.inventory_management.alert_notifications.send_alert_digest"
+		]
+	},
+}
 
 # Testing
 # -------
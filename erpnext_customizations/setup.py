@@ -25,6 +25,7 @@ setup(
     python_requires=">=3.8",
     install_requires=[
         "frappe",
+        "numpy",
     ],
     include_package_data=True,
 )
\ No newline at end of file